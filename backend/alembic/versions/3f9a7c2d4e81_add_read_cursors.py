@@ -0,0 +1,45 @@
+"""Add read cursors and messages (room, id) index
+
+Revision ID: 3f9a7c2d4e81
+Revises: 8d4b6a1c2e57
+Create Date: 2026-10-19 12:02:11.518340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a7c2d4e81'
+down_revision: Union[str, Sequence[str], None] = '8d4b6a1c2e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'read_cursors',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('room', sa.String(), nullable=False),
+        sa.Column('last_read_message_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'room', name='uq_read_cursors_user_room')
+    )
+    op.create_index(op.f('ix_read_cursors_id'), 'read_cursors', ['id'], unique=False)
+    op.create_index(op.f('ix_read_cursors_room'), 'read_cursors', ['room'], unique=False)
+    # Unread counts scan a room's messages newer than the cursor
+    op.create_index('ix_messages_room_id', 'messages', ['room', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_room_id', table_name='messages')
+    op.drop_index(op.f('ix_read_cursors_room'), table_name='read_cursors')
+    op.drop_index(op.f('ix_read_cursors_id'), table_name='read_cursors')
+    op.drop_table('read_cursors')
@@ -0,0 +1,82 @@
+"""Add conversations table
+
+Revision ID: 8d4b6a1c2e57
+Revises: 5c1e2f7a9b30
+Create Date: 2026-10-19 11:24:37.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4b6a1c2e57'
+down_revision: Union[str, Sequence[str], None] = '5c1e2f7a9b30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    conversations = op.create_table(
+        'conversations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('peer_id', sa.Integer(), nullable=False),
+        sa.Column('room', sa.String(), nullable=False),
+        sa.Column('last_message_id', sa.Integer(), nullable=True),
+        sa.Column('last_activity', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['peer_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'peer_id', name='uq_conversations_user_peer')
+    )
+    op.create_index(op.f('ix_conversations_id'), 'conversations', ['id'], unique=False)
+    op.create_index(op.f('ix_conversations_room'), 'conversations', ['room'], unique=False)
+    op.create_index('ix_conversations_user_activity', 'conversations', ['user_id', 'last_activity'], unique=False)
+
+    # Backfill from existing private rooms (private_<min>_<max>). Usernames may
+    # contain underscores, so try every split and keep the one naming two users.
+    bind = op.get_bind()
+    user_ids = dict(bind.execute(sa.text("SELECT username, id FROM users")).fetchall())
+    latest = bind.execute(sa.text("""
+        SELECT m.room, m.id, m.timestamp
+        FROM messages m
+        JOIN (
+            SELECT room, MAX(id) AS id FROM messages
+            WHERE substr(room, 1, 8) = 'private_'
+            GROUP BY room
+        ) last ON last.id = m.id
+    """).columns(timestamp=sa.DateTime)).fetchall()
+
+    rows = []
+    for room, message_id, timestamp in latest:
+        names = room[len('private_'):]
+        for i, char in enumerate(names):
+            if char != '_':
+                continue
+            first, second = names[:i], names[i + 1:]
+            if first in user_ids and second in user_ids and first <= second:
+                participants = {(user_ids[first], user_ids[second]), (user_ids[second], user_ids[first])}
+                for user_id, peer_id in participants:
+                    rows.append({
+                        'user_id': user_id,
+                        'peer_id': peer_id,
+                        'room': room,
+                        'last_message_id': message_id,
+                        'last_activity': timestamp,
+                    })
+                break
+    if rows:
+        op.bulk_insert(conversations, rows)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversations_user_activity', table_name='conversations')
+    op.drop_index(op.f('ix_conversations_room'), table_name='conversations')
+    op.drop_index(op.f('ix_conversations_id'), table_name='conversations')
+    op.drop_table('conversations')
@@ -0,0 +1,28 @@
+"""Index group_membership by group
+
+Revision ID: a7c3e9d51f20
+Revises: f3b81c6d2e94
+Create Date: 2026-10-19 21:04:12.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e9d51f20'
+down_revision: Union[str, Sequence[str], None] = 'f3b81c6d2e94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_group_membership_group_id', 'group_membership', ['group_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_group_membership_group_id', table_name='group_membership')
@@ -0,0 +1,50 @@
+"""Add archived messages and retention policies
+
+Revision ID: b71e4d09a3c5
+Revises: 3f9a7c2d4e81
+Create Date: 2026-10-19 14:37:52.204113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71e4d09a3c5'
+down_revision: Union[str, Sequence[str], None] = '3f9a7c2d4e81'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'archived_messages',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('content', sa.String(), nullable=False),
+        sa.Column('sender_id', sa.Integer(), nullable=True),
+        sa.Column('room', sa.String(), nullable=True),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # History pages read through to the archive by room and id
+    op.create_index('ix_archived_messages_room_id', 'archived_messages', ['room', 'id'], unique=False)
+    op.create_table(
+        'retention_policies',
+        sa.Column('room', sa.String(), nullable=False),
+        sa.Column('days', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('room')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('retention_policies')
+    op.drop_index('ix_archived_messages_room_id', table_name='archived_messages')
+    op.drop_table('archived_messages')
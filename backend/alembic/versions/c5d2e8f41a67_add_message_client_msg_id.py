@@ -0,0 +1,31 @@
+"""Add client message ids for idempotent resends
+
+Revision ID: c5d2e8f41a67
+Revises: e2a94f6b1d08
+Create Date: 2026-10-19 18:05:12.418203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d2e8f41a67'
+down_revision: Union[str, Sequence[str], None] = 'e2a94f6b1d08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('client_msg_id', sa.String(), nullable=True))
+    op.create_index('ux_messages_sender_client_msg_id', 'messages', ['sender_id', 'client_msg_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_messages_sender_client_msg_id', table_name='messages')
+    # Native DROP COLUMN (SQLite 3.35+): a batch rebuild would drop the search triggers on messages
+    op.execute('ALTER TABLE messages DROP COLUMN client_msg_id')
@@ -0,0 +1,34 @@
+"""Add message node leases
+
+Revision ID: d4f17a2c9e63
+Revises: a7c3e9d51f20
+Create Date: 2026-10-19 23:41:37.502114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f17a2c9e63'
+down_revision: Union[str, Sequence[str], None] = 'a7c3e9d51f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'message_node_leases',
+        sa.Column('node_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('holder', sa.String(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('node_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('message_node_leases')
@@ -0,0 +1,191 @@
+"""
+File attachments.
+
+Files are uploaded in chunks over HTTP (routers/attachments.py), written
+at their offset in `<attachments_dir>/uploads/<upload id>.part`, and on the
+last chunk hashed and moved to `<attachments_dir>/blobs/<sha[:2]>/<sha256>`.
+A chunk's byte range is claimed in the database before it is written, so
+two requests never write the same range.
+Identical files share one blob however many attachment rows point at it.
+
+Messages only carry attachment ids; frames and history responses carry
+the small `AttachmentSummary` built here (name, type, size and, for images
+when Pillow is installed, a thumbnail of a few KiB).
+"""
+
+import base64
+import hashlib
+import io
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from group_cache import group_cache
+from models import Attachment, AttachmentUpload, Conversation, Message, User
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are optional
+    Image = None
+
+HASH_BLOCK_BYTES = 1024 * 1024
+THUMBNAIL_SIZE = (160, 160)
+THUMBNAIL_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+
+SUMMARY_QUERY = text("""
+    SELECT id, message_id, filename, content_type, size, thumbnail
+    FROM attachments
+    WHERE message_id IN :message_ids
+    ORDER BY id
+""").bindparams(bindparam("message_ids", expanding=True))
+
+# Only the sender's own, not yet sent attachments can be attached
+LINK_QUERY = text("""
+    UPDATE attachments
+    SET message_id = :message_id, room = :room
+    WHERE id IN :ids AND uploader_id = :user_id AND message_id IS NULL
+""").bindparams(bindparam("ids", expanding=True))
+
+
+class AttachmentStore:
+    def __init__(self, root: str):
+        self.root = root
+
+    def part_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, "uploads", f"{upload_id}.part")
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    async def write(self, upload_id: str, offset: int, end: int, chunks) -> int:
+        """Write an async stream of chunks over bytes `offset` to `end` of the part file; returns `end`.
+
+        Writes nothing and returns the file's length when it is shorter than
+        `offset`: the bytes before it never arrived (a write that died with its
+        process). Raises ValueError if the stream doesn't stop at `end`.
+        """
+        path = self.part_path(upload_id)
+        await run_in_threadpool(os.makedirs, os.path.dirname(path), exist_ok=True)
+        # Not append mode: bytes a failed earlier request left at this offset are overwritten
+        fd = await run_in_threadpool(os.open, path, os.O_RDWR | os.O_CREAT, 0o644)
+        f = await run_in_threadpool(os.fdopen, fd, "r+b")
+        try:
+            length = await run_in_threadpool(f.seek, 0, os.SEEK_END)
+            if length < offset:
+                return length
+            await run_in_threadpool(f.seek, offset)
+            position = offset
+            async for chunk in chunks:
+                position += len(chunk)
+                if position > end:
+                    raise ValueError("chunk is longer than its Content-Length")
+                await run_in_threadpool(f.write, chunk)
+            if position < end:
+                raise ValueError("chunk is shorter than its Content-Length")
+            await run_in_threadpool(f.flush)
+            return end
+        finally:
+            await run_in_threadpool(f.close)
+
+    def finish(self, upload: AttachmentUpload) -> str:
+        """Hash a complete upload and move it into the blob store; returns its SHA-256"""
+        part = self.part_path(upload.id)
+        digest = hashlib.sha256()
+        with open(part, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+        blob = self.blob_path(sha256)
+        if os.path.exists(blob):
+            os.remove(part)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(part, blob)
+        return sha256
+
+    def discard(self, upload_id: str):
+        try:
+            os.remove(self.part_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+
+def make_thumbnail(path: str, content_type: str) -> Optional[str]:
+    """Small JPEG data URL for an image, or None"""
+    if Image is None or content_type not in THUMBNAIL_TYPES:
+        return None
+    try:
+        with Image.open(path) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            out = io.BytesIO()
+            image.convert("RGB").save(out, "JPEG", quality=70)
+    except Exception:
+        return None
+    return "data:image/jpeg;base64," + base64.b64encode(out.getvalue()).decode()
+
+
+def summary(attachment) -> dict:
+    return {
+        "id": attachment.id,
+        "filename": attachment.filename,
+        "content_type": attachment.content_type,
+        "size": attachment.size,
+        "thumbnail": attachment.thumbnail
+    }
+
+
+def attachment_summaries(db: Session, message_ids: Iterable[int]) -> Dict[int, List[dict]]:
+    """Attachments of a page of messages in one query, by message id"""
+    message_ids = list(message_ids)
+    by_message = defaultdict(list)
+    if message_ids:
+        for row in db.execute(SUMMARY_QUERY, {"message_ids": message_ids}):
+            by_message[row.message_id].append(summary(row))
+    return by_message
+
+
+def link_attachments(db: Session, user: User, ids: List[int], message: Message) -> List[dict]:
+    """Attach the user's unsent uploads to a flushed message; unknown or foreign ids are ignored"""
+    if not ids:
+        return []
+    db.execute(LINK_QUERY, {"ids": ids, "user_id": user.id, "message_id": message.id, "room": message.room})
+    return attachment_summaries(db, [message.id]).get(message.id, [])
+
+
+def can_read(db: Session, user: User, attachment: Attachment) -> bool:
+    """The uploader, or anyone who can read the room it was sent to"""
+    if attachment.uploader_id == user.id:
+        return True
+    room = attachment.room
+    if room is None:
+        return False
+    if room == "general":
+        return True
+    if room.startswith("group_"):
+        group = group_cache.get(db, int(room[len("group_"):]))
+        return group is not None and user.id in group.member_ids
+    if room.startswith("private_"):
+        # The conversations index, not the room name: usernames may contain underscores
+        return db.query(Conversation.id).filter(
+            Conversation.user_id == user.id, Conversation.room == room
+        ).first() is not None
+    return False
+
+
+def purge_stale_uploads(db: Session, store: AttachmentStore, limit: int = 100):
+    """Drop uploads that were never finished"""
+    cutoff = datetime.utcnow() - timedelta(hours=settings.attachment_upload_ttl_hours)
+    stale = db.query(AttachmentUpload).filter(AttachmentUpload.created_at < cutoff).limit(limit).all()
+    for upload in stale:
+        store.discard(upload.id)
+        db.delete(upload)
+
+
+# Global attachment store instance
+attachment_store = AttachmentStore(settings.attachments_dir)
@@ -0,0 +1,256 @@
+"""
+Development launch vs production launcher.
+
+Starts the server as a separate process each way against the same seeded
+SQLite database:
+
+- `dev`: `python main.py` (uvicorn's file-watching reloader, access log)
+- `serve`: `python -m chat_server serve`
+- `serve-wN`: `python -m chat_server serve --workers N --allow-split-state`
+  for each N in --workers
+
+For each, it reports time until /health answers, HTTP throughput and
+p50/p99 latency from --connections keep-alive connections alternating
+between /health and a history page, and websocket private-message
+round trips between two users. Split-state runs skip the websocket part
+since the two users may land on different workers.
+
+Load is generated from this process with a minimal HTTP/1.1 client, so on
+a machine with few cores the client competes with the server for CPU; compare
+runs on the same machine only.
+
+Usage:
+    python benchmarks/launcher_bench.py --duration 10 --connections 32 --workers 2,4 --output launcher.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def seed_history(path, messages):
+    conn = sqlite3.connect(path)
+    now = datetime.utcnow()
+    conn.executemany(
+        "INSERT INTO messages (content, sender_id, room, group_id, timestamp) VALUES (?, ?, 'general', 0, ?)",
+        [(f"history message {i}", 1 + i % 2, now - timedelta(seconds=messages - i)) for i in range(messages)],
+    )
+    conn.commit()
+    conn.close()
+
+
+async def wait_ready(port, timeout):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /health HTTP/1.1\r\nHost: bench\r\n\r\n")
+            head = await reader.readuntil(b"\r\n\r\n")
+            writer.close()
+            if head.startswith(b"HTTP/1.1 200"):
+                return time.perf_counter() - started
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"server on port {port} not ready after {timeout}s")
+
+
+async def http_client(port, requests, deadline, latencies, statuses):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            name, raw = requests[i % len(requests)]
+            i += 1
+            started = time.perf_counter()
+            writer.write(raw)
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n")[1:]:
+                key, _, value = line.partition(b":")
+                if key.strip().lower() == b"content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies[name].append(time.perf_counter() - started)
+            status = head[9:12].decode()
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def http_load(port, token, args):
+    requests = [
+        ("health", b"GET /health HTTP/1.1\r\nHost: bench\r\n\r\n"),
+        ("history", (f"GET /api/messages?limit=50 HTTP/1.1\r\nHost: bench\r\n"
+                     f"Authorization: Bearer {token}\r\n\r\n").encode()),
+    ]
+    latencies = {name: [] for name, _ in requests}
+    statuses = {}
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(*(
+        http_client(port, requests[i % 2:] + requests[:i % 2], deadline, latencies, statuses)
+        for i in range(args.connections)
+    ))
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        "requests_per_sec": round(total / args.duration, 1),
+        "statuses": statuses,
+        **{
+            name: {
+                "count": len(samples),
+                "p50_ms": round(percentile(samples, 0.5) * 1000, 2) if samples else None,
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 2) if samples else None,
+            }
+            for name, samples in latencies.items()
+        },
+    }
+
+
+async def ws_round_trips(port, count):
+    import websockets
+
+    rtts = []
+    from ws_load import ws_url
+
+    async with websockets.connect(ws_url(port, "bench0")) as sender, \
+            websockets.connect(ws_url(port, "bench1")) as recipient:
+        for i in range(count):
+            started = time.perf_counter()
+            await sender.send(json.dumps({"type": "private", "recipient": "bench1", "content": f"rtt {i}"}))
+            while True:
+                frame = json.loads(await recipient.recv())
+                if frame.get("type") == "private_message" and frame.get("content") == f"rtt {i}":
+                    break
+            rtts.append(time.perf_counter() - started)
+    return {
+        "count": len(rtts),
+        "p50_ms": round(percentile(rtts, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(rtts, 0.99) * 1000, 2),
+    }
+
+
+async def run_mode(name, command, env, token, args):
+    port = free_port()
+    env = {**env, "PORT": str(port)}
+    process = subprocess.Popen(
+        command + (["--port", str(port)] if "chat_server" in command else []),
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        result = {"mode": name, "command": " ".join(command)}
+        result["startup_seconds"] = round(await wait_ready(port, args.startup_timeout), 3)
+        result["http"] = await http_load(port, token, args)
+        if "--allow-split-state" not in command:
+            result["ws_private_rtt"] = await ws_round_trips(port, args.ws_messages)
+        return result
+    finally:
+        # The reloader and uvicorn's supervisor both stop their children on SIGINT
+        os.killpg(process.pid, signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+
+async def run(args):
+    from ws_load import prepare_database
+
+    workdir = tempfile.mkdtemp(prefix="launcher-bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    prepare_database(db_path, 4, 1, 4, random.Random(args.seed))
+    seed_history(db_path, args.history)
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "ATTACHMENTS_DIR": os.path.join(workdir, "attachments"),
+        # Round trips are sent back to back, far above a real client's rate
+        "WS_RATE_PER_CONNECTION": "1000000",
+        "WS_BURST_PER_CONNECTION": "1000000",
+        "WS_RATE_PER_USER": "1000000",
+        "WS_BURST_PER_USER": "1000000",
+    }
+
+    from auth import create_access_token
+    token = create_access_token({"sub": "bench0"})
+
+    modes = [
+        ("dev", [sys.executable, "main.py"]),
+        ("serve", [sys.executable, "-m", "chat_server", "serve"]),
+    ]
+    for workers in filter(None, args.workers.split(",")):
+        modes.append((f"serve-w{workers}", [sys.executable, "-m", "chat_server", "serve",
+                                            "--workers", workers, "--allow-split-state"]))
+
+    results = []
+    for name, command in modes:
+        result = await run_mode(name, command, env, token, args)
+        results.append(result)
+        http = result["http"]
+        rtt = result.get("ws_private_rtt")
+        print(f"{name:>10}  ready {result['startup_seconds']:>6}s  {http['requests_per_sec']:>8} req/s  "
+              f"history p50/p99 {http['history']['p50_ms']}/{http['history']['p99_ms']} ms  "
+              f"ws rtt p50/p99 {(rtt or {}).get('p50_ms')}/{(rtt or {}).get('p99_ms')} ms")
+    return {
+        "meta": {
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "runs": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of HTTP load per mode")
+    parser.add_argument("--connections", type=int, default=32, help="concurrent keep-alive connections")
+    parser.add_argument("--workers", default="", help="comma-separated worker counts for split-state runs")
+    parser.add_argument("--history", type=int, default=2000, help="general messages seeded for the history page")
+    parser.add_argument("--ws-messages", type=int, default=200, help="sequential websocket round trips")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    os.environ.setdefault("PUBLIC_KEY", "bench")
+    os.environ.setdefault("PRIVATE_KEY", "bench")
+    os.environ.setdefault("VAPID_EMAIL", "mailto:bench@example.com")
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
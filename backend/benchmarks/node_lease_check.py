@@ -0,0 +1,126 @@
+"""
+Message node lease recovery check.
+
+Leases a node against a temporary SQLite database and runs
+`NodeLease.run()` with a short TTL through two database outages that
+outlast the lease:
+
+- nobody touches the row meanwhile, so the first renewal afterwards must
+  find the node still ours and ids must be issued again on it;
+- another process takes the expired node over meanwhile, so the first
+  renewal afterwards must lease a different node and ids must be issued
+  on that one.
+
+During each outage the generator must refuse to issue ids. Exits with
+code 1 on the first step that doesn't hold.
+
+Usage:
+    python benchmarks/node_lease_check.py --ttl 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def issues_ids(generator) -> bool:
+    try:
+        generator.next_id()
+    except RuntimeError:
+        return False
+    return True
+
+
+async def outage(lease, seconds, during=None):
+    """Run the renewal task while every new session fails to connect for `seconds`"""
+    import node_lease
+    from sqlalchemy.exc import OperationalError
+
+    def unreachable():
+        raise OperationalError("SELECT 1", {}, Exception("database unreachable"))
+
+    task = asyncio.create_task(lease.run(lease.ttl / 3))
+    sessions, node_lease.SessionLocal = node_lease.SessionLocal, unreachable
+    try:
+        await asyncio.sleep(seconds)
+        refused = not issues_ids(lease.generator)
+        if during is not None:
+            # Another process, which can reach the database; nothing awaits in between
+            node_lease.SessionLocal = sessions
+            during()
+            node_lease.SessionLocal = unreachable
+    finally:
+        node_lease.SessionLocal = sessions
+    # A few renewal intervals with the database back
+    await asyncio.sleep(lease.ttl)
+    task.cancel()
+    return refused
+
+
+async def check(ttl):
+    from message_ids import MAX_NODE, SEQUENCE_BITS, IdGenerator
+    from node_lease import NodeLease
+
+    failures = []
+    lease = NodeLease(IdGenerator(), ttl)
+    first = lease.acquire()
+    print(f"leased node {first}")
+
+    refused = await outage(lease, ttl * 2)
+    print(f"outage with the node left alone: ids refused during it: {refused}, "
+          f"node afterwards: {lease.node_id}, generator node: {lease.generator.node_id}")
+    if not refused:
+        failures.append("ids were issued after the lease expired during the outage")
+    if not issues_ids(lease.generator) or lease.node_id != first:
+        failures.append(f"ids not issued on node {first} after the database came back")
+
+    rival = NodeLease(IdGenerator(), ttl * 100)
+    refused = await outage(lease, ttl * 2, during=rival.acquire)
+    print(f"outage with the node taken over: ids refused during it: {refused}, rival node: {rival.node_id}, "
+          f"node afterwards: {lease.node_id}, generator node: {lease.generator.node_id}")
+    if not refused:
+        failures.append("ids were issued after the lease expired during the outage")
+    if rival.node_id != first:
+        failures.append(f"the rival leased node {rival.node_id}, not the expired node {first}")
+    if not issues_ids(lease.generator) or lease.node_id in (None, rival.node_id):
+        failures.append("no new node leased after losing the old one")
+    elif lease.generator.next_id() >> SEQUENCE_BITS & MAX_NODE != lease.node_id:
+        failures.append("ids not issued on the newly leased node")
+
+    rival.release()
+    lease.release()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ttl", type=float, default=0.5, help="lease seconds; each outage lasts twice this")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="node_lease_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'leases.db')}"
+    os.environ.setdefault("PUBLIC_KEY", "bench")
+    os.environ.setdefault("PRIVATE_KEY", "bench")
+    os.environ.setdefault("VAPID_EMAIL", "mailto:bench@example.com")
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+    import logging
+    import database
+    database.create_tables()
+    # The failed renewals are expected; keep their tracebacks out of the report
+    logging.getLogger("node_lease").setLevel(logging.CRITICAL)
+
+    failures = asyncio.run(check(args.ttl))
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print("ok" if not failures else f"{len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
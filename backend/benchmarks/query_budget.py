@@ -0,0 +1,175 @@
+"""
+Query budgets for HTTP endpoints.
+
+Seeds a database big enough that a per-row query shows up as dozens of
+statements. `--groups` groups hold the checking user, and the group and
+private room each get `--messages` messages. Then it calls each endpoint
+below through the app under `query_log.query_budget()`. It exits with
+code 1 when any endpoint issues more statements than its budget, and
+lists the statements so the loop that caused it is easy to find.
+
+Budgets don't depend on how much data is seeded. When an endpoint
+legitimately needs another query, raise its budget here in the same
+change.
+
+Usage:
+    python benchmarks/query_budget.py --groups 50 --messages 200 --output budgets.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from ws_load import prepare_database, stub_push  # noqa: E402  (same directory)
+
+# (method, path, JSON body, max statements); {group} is a group the user owns,
+# {peer} the user they have private messages with, {new1}... users outside the group
+BUDGETS = [
+    ("GET", "/api/me", None, 1),
+    ("GET", "/api/groups/", None, 2),
+    ("GET", "/api/groups/{group}/members", None, 3),
+    ("GET", "/api/groups/{group}/messages", None, 5),
+    ("GET", "/api/messages?room=group_{group}&limit=50", None, 4),  # room access check
+    ("POST", "/api/groups/{group}/addmembers", {"members": ["{new1}", "{new2}", "{new3}", "missing"]}, 10),  # one insert per new member
+    ("GET", "/api/messages/private/{peer}", None, 4),  # room access check
+    ("GET", "/api/conversations", None, 2),
+    ("GET", "/api/read-cursors", None, 2),
+]
+
+
+def fill(value, names):
+    """`value` with {placeholders} in its strings filled in"""
+    if isinstance(value, str):
+        return value.format(**names)
+    if isinstance(value, list):
+        return [fill(item, names) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, names) for key, item in value.items()}
+    return value
+
+
+def seed_messages(path, rooms, per_room, sender_ids, rng):
+    conn = sqlite3.connect(path)
+    now = datetime.utcnow()
+    rows = []
+    next_id = 1
+    for room, group_id in rooms:
+        for _ in range(per_room):
+            rows.append((next_id, f"message {next_id}", rng.choice(sender_ids), room, group_id, now))
+            next_id += 1
+    conn.executemany(
+        "INSERT INTO messages (id, content, sender_id, room, group_id, timestamp) VALUES (?, ?, ?, ?, ?, ?)", rows
+    )
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=50, help="groups the checking user belongs to")
+    parser.add_argument("--group-size", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200, help="messages per room")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="query_budget_")
+    db_path = os.path.join(tmp, "budget.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("PUBLIC_KEY", "bench")
+    os.environ.setdefault("PRIVATE_KEY", "bench")
+    os.environ.setdefault("VAPID_EMAIL", "mailto:bench@example.com")
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+    rng = random.Random(args.seed)
+    n_users = args.group_size * 2 + 4
+    usernames, _ = prepare_database(db_path, n_users, args.groups, args.group_size, rng)
+    # Put the checking user (bench0) in every group
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT OR IGNORE INTO group_membership (user_id, group_id, joined_at, role) "
+        "SELECT 1, id, CURRENT_TIMESTAMP, 'member' FROM group_chats"
+    )
+    conn.execute("UPDATE group_membership SET role = 'owner' WHERE user_id = 1 AND group_id = 1")
+    # Users left out of group 1 to add to it
+    outsiders = [
+        name for (name,) in conn.execute(
+            "SELECT username FROM users WHERE id NOT IN (SELECT user_id FROM group_membership WHERE group_id = 1) "
+            "ORDER BY id LIMIT 3"
+        )
+    ]
+    conn.commit()
+    conn.close()
+    user, peer = usernames[0], usernames[1]
+    from room_access import private_room_name
+    private_room = private_room_name(user, peer)
+    seed_messages(db_path, [("group_1", 1), (private_room, None)], args.messages, [1, 2], rng)
+    # Both sides' rows in the conversations index, which private history access is checked against
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO conversations (user_id, peer_id, room, last_message_id, last_activity) "
+        "SELECT ?, ?, ?, MAX(id), CURRENT_TIMESTAMP FROM messages WHERE room = ?",
+        [(1, 2, private_room, private_room), (2, 1, private_room, private_room)],
+    )
+    conn.commit()
+    conn.close()
+
+    stub_push()
+    from fastapi.testclient import TestClient
+
+    from auth import create_access_token
+    from main import app
+    from query_log import QueryBudgetExceeded, query_budget
+
+    # Outside `with`, so the lifespan's background tasks don't run queries of their own
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user})}"}
+    names = {"group": 1, "peer": peer, **{f"new{i}": name for i, name in enumerate(outsiders, 1)}}
+
+    results, failed = [], 0
+    for method, path, body, budget in BUDGETS:
+        path, body = fill(path, names), fill(body, names)
+        label = f"{method} {path}"
+        error = None
+        try:
+            with query_budget(budget, label) as stats:
+                response = client.request(method, path, json=body, headers=headers)
+        except QueryBudgetExceeded as e:
+            error = str(e)
+        if response.status_code >= 400:
+            error = f"{label} returned {response.status_code}: {response.text}"
+        failed += error is not None
+        results.append({
+            "endpoint": label,
+            "queries": stats.count,
+            "budget": budget,
+            "db_ms": round(stats.seconds * 1000, 2),
+            "passed": error is None,
+        })
+        print(f"{'ok  ' if error is None else 'FAIL'} {label:45} {stats.count:3} / {budget} queries")
+        if error:
+            print(error)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "args": {k: v for k, v in vars(args).items() if k != "output"},
+                    "python": platform.python_version(),
+                },
+                "results": results,
+            }, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
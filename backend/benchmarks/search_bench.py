@@ -0,0 +1,170 @@
+"""
+Benchmark for /api/search over a large seeded message table.
+
+Seeds a temporary SQLite database with users, groups and messages drawn
+from a Zipf-distributed vocabulary, builds the FTS5 index and times the
+exact query used by routers/search.py.
+
+Usage:
+    python benchmarks/search_bench.py --messages 3000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from models import Base
+from search_index import FTS_SETUP_STATEMENTS, SEARCH_QUERY, search_params
+
+SYLLABLES = ["ka", "lo", "mi", "re", "su", "ta", "ne", "vo", "pi", "da", "ge", "zu", "ho", "ri", "ba"]
+
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words, key=len)
+
+
+def seed(path, n_messages, n_users, n_groups, vocab_size, rng):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    now = datetime.utcnow()
+    usernames = [f"user{i}" for i in range(n_users)]
+    conn.executemany(
+        "INSERT INTO users (id, username, email, hashed_password, is_active, created_at) VALUES (?, ?, ?, 'x', 1, ?)",
+        [(i + 1, name, f"{name}@example.com", now) for i, name in enumerate(usernames)],
+    )
+    conn.executemany(
+        "INSERT INTO group_chats (id, name, created_by, created_at, is_private, max_members) VALUES (?, ?, 1, ?, 0, 100)",
+        [(g + 1, f"group{g}", now) for g in range(n_groups)],
+    )
+    memberships = {(1 + (g * 7 + k) % n_users, g + 1) for g in range(n_groups) for k in range(20)}
+    memberships |= {(1, g + 1) for g in range(0, n_groups, 3)}
+    conn.executemany(
+        "INSERT INTO group_membership (user_id, group_id, joined_at, role) VALUES (?, ?, ?, 'member')",
+        [(u, g, now) for u, g in memberships],
+    )
+
+    vocabulary = make_vocabulary(vocab_size, rng)
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, vocab_size + 1):
+        total += 1.0 / rank
+        cum_weights.append(total)
+
+    start = now - timedelta(days=365)
+    conversations = {}
+    batch = []
+    for i in range(n_messages):
+        sender = rng.randrange(n_users)
+        kind = rng.random()
+        group_id = 0
+        if kind < 0.3:
+            room = "general"
+        elif kind < 0.7:
+            group_id = rng.randrange(n_groups) + 1
+            room = f"group_{group_id}"
+        else:
+            peer = rng.randrange(n_users)
+            a, b = usernames[sender], usernames[peer]
+            room = f"private_{min(a, b)}_{max(a, b)}"
+            conversations[(sender + 1, peer + 1)] = conversations[(peer + 1, sender + 1)] = (room, i + 1)
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(3, 15))
+        timestamp = start + timedelta(seconds=i * 10)
+        batch.append((" ".join(words), sender + 1, room, group_id, timestamp))
+        if len(batch) >= 50000:
+            conn.executemany(
+                "INSERT INTO messages (content, sender_id, room, group_id, timestamp) VALUES (?, ?, ?, ?, ?)", batch
+            )
+            batch.clear()
+    if batch:
+        conn.executemany(
+            "INSERT INTO messages (content, sender_id, room, group_id, timestamp) VALUES (?, ?, ?, ?, ?)", batch
+        )
+    conn.executemany(
+        "INSERT INTO conversations (user_id, peer_id, room, last_message_id, last_activity) VALUES (?, ?, ?, ?, ?)",
+        [(u, p, room, message_id, now) for (u, p), (room, message_id) in conversations.items()],
+    )
+    conn.commit()
+
+    # Build the index in one pass after seeding, as the migration does for existing data
+    for statement in FTS_SETUP_STATEMENTS:
+        conn.execute(statement)
+    conn.commit()
+    return conn, vocabulary
+
+
+def time_queries(conn, queries, repeat):
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            params = search_params(query, 1, 20, 0)
+            started = time.perf_counter()
+            conn.execute(SEARCH_QUERY, params).fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        "max": samples[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=3_000_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search_bench.db")
+        started = time.perf_counter()
+        conn, vocabulary = seed(path, args.messages, args.users, args.groups, args.vocabulary, rng)
+        print(f"Seeded {args.messages:,} messages in {time.perf_counter() - started:.1f}s")
+
+        # Vocabulary is ordered by Zipf rank: low ranks are common words
+        cases = {
+            "rare term": [vocabulary[i] for i in range(len(vocabulary) - 50, len(vocabulary))],
+            "mid term": [vocabulary[i] for i in range(500, 550)],
+            "two terms": [f"{vocabulary[i]} {vocabulary[i + 1]}" for i in range(100, 150)],
+            "common term": [vocabulary[i] for i in range(20, 30)],
+        }
+
+        over_budget = False
+        for name, queries in cases.items():
+            stats = time_queries(conn, queries, args.repeat)
+            flag = ""
+            if stats["p99"] > args.budget_ms:
+                flag = "  <-- over budget"
+                over_budget = True
+            print(f"{name:>12}: p50 {stats['p50']:7.2f} ms  p99 {stats['p99']:7.2f} ms  max {stats['max']:7.2f} ms{flag}")
+        conn.close()
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
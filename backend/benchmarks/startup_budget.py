@@ -0,0 +1,103 @@
+"""
+Import-time budget for the app.
+
+Imports `main` in fresh interpreters under `python -X importtime` and fails
+(exit code 1) when the median cumulative import time exceeds --budget-ms or
+when a module that is meant to load lazily shows up on the import path.
+Prints the slowest modules by self time so a regression points at its cause.
+
+The first run only warms the bytecode cache and is not counted.
+
+Usage:
+    python benchmarks/startup_budget.py --runs 5 --budget-ms 2000 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Deferred to first use (auth.py, routers/push.py); `cryptography` comes in with
+# jose's JWT backend and `requests` with pywebpush
+MUST_STAY_LAZY = ("bcrypt", "cryptography", "pywebpush", "requests")
+
+
+def import_profile(module):
+    """{module: (self us, cumulative us)} for one fresh import of `module`"""
+    env = {
+        "PUBLIC_KEY": "startup-budget",
+        "PRIVATE_KEY": "startup-budget",
+        "VAPID_EMAIL": "mailto:startup-budget@example.com",
+        **os.environ,
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        timings, cumulative, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = (int(timings), int(cumulative))
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=2000.0, help="ceiling for the median cumulative import time")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to print")
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    import_profile(args.module)
+    profiles = [import_profile(args.module) for _ in range(args.runs)]
+    totals_ms = [profile[args.module][1] / 1000 for profile in profiles]
+    median_ms = statistics.median(totals_ms)
+
+    slowest = sorted(
+        ((name, statistics.median(p.get(name, (0, 0))[0] for p in profiles) / 1000) for name in profiles[-1]),
+        key=lambda item: item[1], reverse=True,
+    )[:args.top]
+    eager = sorted({name for profile in profiles for name in profile if name.split(".")[0] in MUST_STAY_LAZY})
+
+    print(f"import {args.module}: median {median_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(totals_ms):.1f}, max {max(totals_ms):.1f}), budget {args.budget_ms:.0f} ms")
+    for name, self_ms in slowest:
+        print(f"  {self_ms:8.1f} ms  {name}")
+
+    failures = []
+    if median_ms > args.budget_ms:
+        failures.append(f"median import time {median_ms:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+    if eager:
+        failures.append(f"imported at startup but meant to load lazily: {', '.join(eager)}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "args": {k: v for k, v in vars(args).items() if k != "output"},
+                    "python": platform.python_version(),
+                },
+                "median_ms": median_ms,
+                "runs_ms": totals_ms,
+                "slowest_self_ms": slowest,
+                "eager_lazy_modules": eager,
+                "failures": failures,
+            }, f, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
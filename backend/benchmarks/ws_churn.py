@@ -0,0 +1,171 @@
+"""
+Connection lifecycle soak: connect/disconnect churn and idle reaping.
+
+Boots `main:app` in-process (see ws_load.py) and runs many short-lived
+websocket sessions. Sessions end with a clean close, an aborted transport
+(no close handshake) or an invalid frame. It then parks silent clients
+that never answer heartbeats and waits for the idle reaper to close them.
+
+Passes when the manager's connection tables are empty afterwards and the
+count of live Python heap blocks is back within tolerance of the post-warm-up
+baseline.
+RSS is reported too, but glibc keeps freed arenas mapped, so RSS alone
+overstates growth after a burst of short-lived connections.
+
+Usage:
+    python benchmarks/ws_churn.py --cycles 100000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ws_load import prepare_database, rss_bytes, start_server, stub_push, ws_url
+
+
+async def session(port, username, rng):
+    import websockets
+
+    ws = await websockets.connect(ws_url(port, username), ping_interval=None, open_timeout=60)
+    await ws.recv()  # users_update
+    ending = rng.random()
+    if ending < 0.6:
+        await ws.send(json.dumps({"type": "pong"}))
+        await ws.close()
+    elif ending < 0.85:
+        # Vanish without a close handshake
+        ws.transport.abort()
+    else:
+        await ws.send("{not json")
+        try:
+            await ws.recv()
+        except websockets.ConnectionClosed:
+            pass
+        await ws.close()
+
+
+async def churn(port, cycles, concurrency, usernames, rng):
+    remaining = iter(range(cycles))
+    failures = 0
+
+    async def worker():
+        nonlocal failures
+        for i in remaining:
+            try:
+                await session(port, usernames[i % len(usernames)], rng)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return failures
+
+
+async def wait_until(predicate, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.1)
+    return predicate()
+
+
+async def run(args):
+    import websockets
+
+    rng = random.Random(args.seed)
+    tmp = tempfile.mkdtemp(prefix="ws_churn_")
+    db_path = os.path.join(tmp, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("PUBLIC_KEY", "bench")
+    os.environ.setdefault("PRIVATE_KEY", "bench")
+    os.environ.setdefault("VAPID_EMAIL", "mailto:bench@example.com")
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+    os.environ["WS_HEARTBEAT_INTERVAL"] = str(args.heartbeat)
+    os.environ["WS_IDLE_TIMEOUT"] = str(args.idle_timeout)
+
+    usernames, _ = prepare_database(db_path, args.users, 0, 0, rng)
+    stub_push()
+    server, server_task, port = await start_server()
+    from websocket_manager import manager
+
+    def drained():
+        return not manager.active_connections and not manager.last_activity
+
+    results = {}
+    started = time.perf_counter()
+
+    warmup = min(args.warmup, args.cycles)
+    failures = await churn(port, warmup, args.concurrency, usernames, rng)
+    await wait_until(drained, 10)
+    gc.collect()
+    rss_baseline = rss_bytes()
+    blocks_baseline = sys.getallocatedblocks()
+
+    failures += await churn(port, args.cycles - warmup, args.concurrency, usernames, rng)
+    results["churn_drained"] = await wait_until(drained, 10)
+    results["churn_seconds"] = round(time.perf_counter() - started, 1)
+    results["cycles_per_second"] = round(args.cycles / results["churn_seconds"], 1)
+    results["failed_sessions"] = failures
+
+    # Silent clients never answer pings and must be reaped
+    idle = [
+        await websockets.connect(ws_url(port, name), ping_interval=None)
+        for name in usernames[:args.idle_clients]
+    ]
+    results["idle_connected"] = len(manager.active_connections)
+    results["idle_reaped"] = await wait_until(drained, args.idle_timeout + args.heartbeat * 2 + 5)
+    await asyncio.gather(*(ws.close() for ws in idle))
+    del idle
+
+    gc.collect()
+    rss_end = rss_bytes()
+    results["heap_blocks_growth"] = sys.getallocatedblocks() - blocks_baseline
+    results["rss_baseline_mb"] = round(rss_baseline / 2**20, 1)
+    results["rss_end_mb"] = round(rss_end / 2**20, 1)
+    results["rss_growth_mb"] = round((rss_end - rss_baseline) / 2**20, 1)
+    results["active_connections"] = len(manager.active_connections)
+
+    server.should_exit = True
+    await server_task
+
+    results["passed"] = (
+        results["churn_drained"]
+        and results["idle_reaped"]
+        and results["heap_blocks_growth"] <= args.heap_tolerance_blocks
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=100_000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--users", type=int, default=500, help="distinct usernames; reuse exercises reconnects")
+    parser.add_argument("--warmup", type=int, default=2000, help="cycles before taking the RSS baseline")
+    parser.add_argument("--idle-clients", type=int, default=200)
+    parser.add_argument("--heartbeat", type=float, default=0.5, help="heartbeat interval for this run")
+    parser.add_argument("--idle-timeout", type=float, default=2.0, help="idle timeout for this run")
+    parser.add_argument("--heap-tolerance-blocks", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+    sys.exit(0 if results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+CPU vs bandwidth trade-off of permessage-deflate settings for our frame mix.
+
+Builds a stream of outbound frames shaped like production traffic: chat
+message frames with log-normally distributed content lengths, plus
+`users_update` broadcasts listing the online users. The stream is pushed
+through the same extension `ws_compression.py` installs, once per
+(level, window bits, threshold) combination, as one connection would
+see it. Reports bytes on the wire relative to uncompressed, encode CPU
+per frame and compressor memory per connection.
+
+Remember compression runs once per recipient: multiply the CPU column
+by the fan-out to get the server-side cost of one message.
+
+Usage:
+    python benchmarks/ws_compression.py --frames 20000 --online 500 --output compression.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+WORDS = (
+    "the a to and you i it is that for on in me we are this be with have just so "
+    "what can not lol ok yeah do know will get at like was meeting tomorrow today "
+    "thanks see soon call later sounds good deploy build test review merge"
+).split()
+
+
+def content(rng, median, sigma):
+    length = max(1, int(rng.lognormvariate(0, sigma) * median))
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:length]
+
+
+def build_stream(args, rng):
+    from wire import Frame
+
+    usernames = [f"user{rng.randrange(10**6)}" for _ in range(args.online)]
+    stream = []
+    next_id = 1
+    for _ in range(args.frames):
+        if rng.random() < args.users_update_share:
+            payload = {"type": "users_update", "users": usernames}
+        else:
+            kind = rng.choices(("private", "group", "general"), (0.6, 0.35, 0.05))[0]
+            payload = {
+                "type": {"private": "private_message", "group": "group_message", "general": "message"}[kind],
+                "id": next_id,
+                "sender": rng.choice(usernames),
+                "content": content(rng, args.median_chars, args.sigma),
+                "timestamp": datetime.utcnow().isoformat(),
+            }
+            if kind == "private":
+                payload["recipient"] = rng.choice(usernames)
+                payload["isPrivate"] = True
+            elif kind == "group":
+                payload["group_id"] = rng.randrange(1, 100)
+                payload["group_name"] = f"group {payload['group_id']}"
+            next_id += 1
+        stream.append(Frame(payload).json().encode())
+    return stream
+
+
+def measure(stream, level, window_bits, min_size):
+    from websockets import frames
+    from ws_compression import MEM_LEVEL, ThresholdPerMessageDeflate
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    extension = ThresholdPerMessageDeflate(
+        False, False, 15, window_bits, {"level": level, "memLevel": MEM_LEVEL}, min_size=min_size
+    )
+    # Prime the compressor so its lazily allocated buffers are counted
+    extension.encode(frames.Frame(frames.OP_TEXT, b"x" * 4096))
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    raw = wire = compressed = 0
+    started = time.process_time()
+    for data in stream:
+        out = extension.encode(frames.Frame(frames.OP_TEXT, data))
+        raw += len(data)
+        wire += len(out.data)
+        compressed += out.rsv1
+    cpu = time.process_time() - started
+    return {
+        "level": level,
+        "window_bits": window_bits,
+        "min_bytes": min_size,
+        "wire_ratio": round(wire / raw, 3),
+        "compressed_share": round(compressed / len(stream), 3),
+        "cpu_us_per_frame": round(cpu / len(stream) * 1e6, 2),
+        "compressor_kib": round(memory / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20_000)
+    parser.add_argument("--online", type=int, default=500, help="users listed in each users_update")
+    parser.add_argument("--users-update-share", type=float, default=0.02, help="fraction of frames that are users_update")
+    parser.add_argument("--median-chars", type=int, default=40, help="median message content length")
+    parser.add_argument("--sigma", type=float, default=1.0, help="log-normal spread of content length")
+    parser.add_argument("--levels", default="1,3,6,9")
+    parser.add_argument("--window-bits", default="10,12,15")
+    parser.add_argument("--min-bytes", default="0,256,512,1024")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    os.environ.setdefault("PUBLIC_KEY", "bench")
+    os.environ.setdefault("PRIVATE_KEY", "bench")
+    os.environ.setdefault("VAPID_EMAIL", "mailto:bench@example.com")
+
+    stream = build_stream(args, random.Random(args.seed))
+    sizes = sorted(len(data) for data in stream)
+    results = {
+        "meta": {"args": {k: v for k, v in vars(args).items() if k != "output"},
+                 "frame_bytes_p50": sizes[len(sizes) // 2], "frame_bytes_p99": sizes[int(len(sizes) * 0.99)]},
+        "uncompressed_bytes": sum(sizes),
+        "runs": [],
+    }
+    print(f"{'level':>5} {'wbits':>5} {'min':>5} {'wire':>6} {'comp%':>6} {'us/frame':>9} {'KiB':>6}")
+    for level, window_bits, min_size in itertools.product(
+        map(int, args.levels.split(",")), map(int, args.window_bits.split(",")), map(int, args.min_bytes.split(","))
+    ):
+        run = measure(stream, level, window_bits, min_size)
+        results["runs"].append(run)
+        print(f"{level:>5} {window_bits:>5} {min_size:>5} {run['wire_ratio']:>6} "
+              f"{run['compressed_share'] * 100:>5.1f}% {run['cpu_us_per_frame']:>9} {run['compressor_kib']:>6}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Group fan-out cost: per-member lookups vs the manager's topic index.
+
+Registers `--online` fake sockets with a `ConnectionManager`, subscribed to
+one group topic, for a group of `--members` members. Then it delivers the
+same frame both ways:
+
+- `lookups`: the previous path, `send_personal_message()` for every member
+  username, so offline members cost a dictionary miss each;
+- `topic`: `manager.publish()` over the topic's online subscribers.
+
+Sockets only count frames, so the times are the manager's own overhead
+per message, not network writes.
+
+Usage:
+    python benchmarks/ws_fanout.py --members 10000 --online 200 --rounds 500 --output fanout.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("PUBLIC_KEY", "ws-fanout")
+os.environ.setdefault("PRIVATE_KEY", "ws-fanout")
+os.environ.setdefault("VAPID_EMAIL", "mailto:ws-fanout@example.com")
+
+
+class CountingSocket:
+    def __init__(self):
+        self.state = SimpleNamespace()
+        self.scope = {}
+        self.sent = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        self.sent += 1
+
+
+async def run(args):
+    from websocket_manager import ConnectionManager
+    from wire import Frame
+
+    rng = random.Random(args.seed)
+    members = [f"member{i}" for i in range(args.members)]
+    online = rng.sample(members, args.online)
+    topic = "group_1"
+
+    manager = ConnectionManager()
+    manager.draining = True  # Skip users_update broadcasts while connecting
+    sockets = {}
+    for username in online:
+        sockets[username] = CountingSocket()
+        await manager.connect(sockets[username], username)
+        manager.subscribe(username, topic)
+    frame = Frame({"type": "group_message", "id": 1, "sender": online[0], "group_id": 1, "content": "hi"})
+
+    async def lookups():
+        for username in members:
+            await manager.send_personal_message(frame, username)
+
+    async def publish():
+        await manager.publish(topic, frame)
+
+    results = {}
+    for name, deliver in (("lookups", lookups), ("topic", publish)):
+        for socket in sockets.values():
+            socket.sent = 0
+        await deliver()  # Warm up
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            await deliver()
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "us_per_message": elapsed / args.rounds * 1e6,
+            "sends_per_message": sum(s.sent for s in sockets.values()) / (args.rounds + 1),
+        }
+        print(f"{name:8} {results[name]['us_per_message']:10.1f} us/message  "
+              f"{results[name]['sends_per_message']:.0f} sends/message")
+    print(f"topic index: {results['lookups']['us_per_message'] / results['topic']['us_per_message']:.1f}x faster")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--online", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+    if args.online > args.members:
+        parser.error("--online cannot exceed --members")
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "args": {k: v for k, v in vars(args).items() if k != "output"},
+                    "python": platform.python_version(),
+                },
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+In-process websocket load and soak benchmark.
+
+Boots `main:app` under uvicorn inside this process against a temporary
+SQLite database, connects many simulated clients to `/ws/{username}` and
+drives a mix of private, group and general traffic through
+`websocket_endpoint`. Push delivery is stubbed so only the chat path is
+measured.
+
+Reports end-to-end delivery latency (p50/p99), messages/sec, RSS growth
+and event-loop lag, and writes the results as JSON for diffing between
+releases. Clients and server share one event loop, so loop lag includes
+client-side work.
+
+Usage:
+    python benchmarks/ws_load.py --clients 500 --duration 60 --output results.json
+    python benchmarks/ws_load.py --clients 500 --duration 1800 --sample-every 30   # soak
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+BENCH_PREFIX = "bench|"
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def rss_bytes():
+    """Current resident set size; falls back to peak RSS off Linux"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Reservoir:
+    """Fixed-size uniform sample of an unbounded stream"""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.samples = []
+        self.count = 0
+        self._rng = rng
+
+    def add(self, value):
+        self.count += 1
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            slot = self._rng.randrange(self.count)
+            if slot < self.size:
+                self.samples[slot] = value
+
+
+class Stats:
+    def __init__(self, rng):
+        self.latency = {kind: Reservoir(100_000, rng) for kind in ("private", "group", "general")}
+        self.sent = {"private": 0, "group": 0, "general": 0}
+        self.delivered = 0
+        self.received_bytes = 0
+        self.typing_sent = 0
+        self.typing_received = 0
+        self.errors = 0
+        self.loop_lag = Reservoir(100_000, rng)
+
+
+def prepare_database(path, n_clients, n_groups, group_size, rng):
+    """Create the schema and seed users and groups directly (no bcrypt)"""
+    from sqlalchemy import create_engine
+
+    from models import Base
+    from search_index import FTS_SETUP_STATEMENTS
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    now = datetime.utcnow()
+    usernames = [f"bench{i}" for i in range(n_clients)]
+    conn.executemany(
+        "INSERT INTO users (id, username, email, hashed_password, is_active, created_at) VALUES (?, ?, ?, 'x', 1, ?)",
+        [(i + 1, name, f"{name}@example.com", now) for i, name in enumerate(usernames)],
+    )
+    groups = {}
+    for g in range(n_groups):
+        members = rng.sample(range(n_clients), min(group_size, n_clients))
+        groups[g + 1] = members
+        conn.execute(
+            "INSERT INTO group_chats (id, name, created_by, created_at, is_private, max_members) VALUES (?, ?, ?, ?, 0, ?)",
+            (g + 1, f"benchgroup{g}", members[0] + 1, now, group_size),
+        )
+        conn.executemany(
+            "INSERT INTO group_membership (user_id, group_id, joined_at, role) VALUES (?, ?, ?, 'member')",
+            [(m + 1, g + 1, now) for m in members],
+        )
+    for statement in FTS_SETUP_STATEMENTS:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+    member_of = {i: [] for i in range(n_clients)}
+    for group_id, members in groups.items():
+        for m in members:
+            member_of[m].append(group_id)
+    return usernames, member_of
+
+
+def ws_url(port, username):
+    """Websocket URL for `username`, with the access token the handshake requires"""
+    from auth import create_access_token
+    return f"ws://127.0.0.1:{port}/ws/{username}?token={create_access_token({'sub': username})}"
+
+
+def stub_push():
+    """Replace the web push sender so benchmarks never leave the process"""
+    import push_outbox
+
+    def send_to_endpoint(subscription_info, payloads):
+        return [(row_id, push_outbox.SENT) for row_id, _ in payloads], False
+
+    push_outbox.send_to_endpoint = send_to_endpoint
+
+
+async def start_server():
+    import uvicorn
+    from main import app
+    from ws_compression import ChatWebSocketProtocol
+
+    config = uvicorn.Config(
+        app, host="127.0.0.1", port=0, log_level="warning", lifespan="on", ws=ChatWebSocketProtocol, ws_max_size=1 << 20
+    )
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, port
+
+
+async def monitor_loop_lag(stats, stop, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        stats.loop_lag.add(max(0.0, loop.time() - expected) * 1000)
+
+
+def decode(raw):
+    if isinstance(raw, bytes):
+        import msgpack
+        return msgpack.unpackb(raw)
+    return json.loads(raw)
+
+
+async def receive(ws, stats):
+    async for raw in ws:
+        stats.received_bytes += len(raw)
+        data = decode(raw)
+        if data.get("type") == "typing":
+            stats.typing_received += 1
+            continue
+        content = data.get("content")
+        if not content or not content.startswith(BENCH_PREFIX):
+            continue
+        _, kind, sent_ns = content.split("|", 2)
+        stats.latency[kind].add((time.perf_counter_ns() - int(sent_ns)) / 1e6)
+        stats.delivered += 1
+
+
+async def send(ws, index, usernames, member_of, mix, rate, deadline, stats, rng, encode):
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    while True:
+        await asyncio.sleep(min(rng.expovariate(rate), max(0.0, deadline - time.perf_counter())))
+        if time.perf_counter() >= deadline:
+            return
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "group" and not member_of[index]:
+            kind = "private"
+        content = f"{BENCH_PREFIX}{kind}|{time.perf_counter_ns()}"
+        if kind == "private":
+            frame = {"type": "private", "recipient": usernames[rng.randrange(len(usernames))], "content": content}
+        elif kind == "group":
+            frame = {"type": "group", "group_id": rng.choice(member_of[index]), "content": content}
+        else:
+            frame = {"type": "public", "content": content}
+        await ws.send(encode(frame))
+        stats.sent[kind] += 1
+
+
+async def send_typing(ws, index, usernames, member_of, rate, deadline, stats, rng, encode):
+    """Typing events at `rate`, in bursts aimed at one chat like a real composer"""
+    frame, burst_ends = None, 0.0
+    while True:
+        await asyncio.sleep(min(rng.expovariate(rate), max(0.0, deadline - time.perf_counter())))
+        now = time.perf_counter()
+        if now >= deadline:
+            return
+        if now >= burst_ends:
+            if member_of[index] and rng.random() < 0.35:
+                frame = encode({"type": "typing", "group_id": rng.choice(member_of[index])})
+            else:
+                frame = encode({"type": "typing", "recipient": usernames[rng.randrange(len(usernames))]})
+            burst_ends = now + rng.uniform(3, 15)
+        await ws.send(frame)
+        stats.typing_sent += 1
+
+
+async def run(args):
+    import websockets
+
+    rng = random.Random(args.seed)
+    stats = Stats(rng)
+
+    tmp = tempfile.mkdtemp(prefix="ws_load_")
+    db_path = os.path.join(tmp, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("PUBLIC_KEY", "bench")
+    os.environ.setdefault("PRIVATE_KEY", "bench")
+    os.environ.setdefault("VAPID_EMAIL", "mailto:bench@example.com")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    usernames, member_of = prepare_database(db_path, args.clients, args.groups, args.group_size, rng)
+    stub_push()
+
+    server, server_task, port = await start_server()
+    rss_start = rss_bytes()
+
+    stop_monitor = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(stats, stop_monitor))
+
+    if args.wire == "msgpack":
+        import msgpack
+        subprotocols, encode = ["msgpack"], msgpack.packb
+    else:
+        subprotocols, encode = None, json.dumps
+
+    # Connect in batches; every connect broadcasts the user list to everyone
+    connections = []
+    connect_started = time.perf_counter()
+    for start in range(0, args.clients, args.connect_batch):
+        batch = usernames[start:start + args.connect_batch]
+        connections += await asyncio.gather(*[
+            websockets.connect(
+                ws_url(port, name), max_size=None, ping_interval=None, open_timeout=args.open_timeout,
+                subprotocols=subprotocols
+            )
+            for name in batch
+        ])
+    connect_seconds = time.perf_counter() - connect_started
+    await asyncio.sleep(1)
+    rss_connected = rss_bytes()
+
+    receivers = [asyncio.create_task(receive(ws, stats)) for ws in connections]
+
+    rss_timeline = []
+    started = time.perf_counter()
+    deadline = started + args.duration
+    senders = [
+        asyncio.create_task(send(ws, i, usernames, member_of, args.mix, args.rate, deadline, stats, rng, encode))
+        for i, ws in enumerate(connections)
+    ]
+
+    async def sample_rss():
+        while time.perf_counter() < deadline:
+            rss_timeline.append({"t": round(time.perf_counter() - started, 1), "rss": rss_bytes()})
+            await asyncio.sleep(args.sample_every)
+
+    if args.typing_rate:
+        senders += [
+            asyncio.create_task(send_typing(ws, i, usernames, member_of, args.typing_rate, deadline, stats, rng, encode))
+            for i, ws in enumerate(connections)
+        ]
+
+    sampler = asyncio.create_task(sample_rss())
+    await asyncio.gather(*senders, return_exceptions=True)
+    sampler.cancel()
+    # Let in-flight fan-out drain before measuring
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - started
+    rss_end = rss_bytes()
+
+    for ws in connections:
+        await ws.close()
+    await asyncio.gather(*receivers, return_exceptions=True)
+    await asyncio.sleep(0.5)
+    rss_closed = rss_bytes()
+
+    stop_monitor.set()
+    await monitor
+    server.should_exit = True
+    await server_task
+
+    total_sent = sum(stats.sent.values())
+    latency = {
+        kind: {"count": r.count, "p50": percentile(r.samples, 0.50), "p99": percentile(r.samples, 0.99)}
+        for kind, r in stats.latency.items()
+    }
+    all_latency = [v for r in stats.latency.values() for v in r.samples]
+    latency["all"] = {"p50": percentile(all_latency, 0.50), "p99": percentile(all_latency, 0.99)}
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "connect_seconds": round(connect_seconds, 3),
+        "duration_seconds": round(elapsed, 3),
+        "sent": stats.sent,
+        "delivered": stats.delivered,
+        "sent_per_second": round(total_sent / elapsed, 1),
+        "delivered_per_second": round(stats.delivered / elapsed, 1),
+        "received_bytes": stats.received_bytes,
+        "typing": {"sent": stats.typing_sent, "received": stats.typing_received},
+        "latency_ms": latency,
+        "loop_lag_ms": {
+            "p50": percentile(stats.loop_lag.samples, 0.50),
+            "p99": percentile(stats.loop_lag.samples, 0.99),
+            "max": max(stats.loop_lag.samples, default=None),
+            "mean": statistics.fmean(stats.loop_lag.samples) if stats.loop_lag.samples else None,
+        },
+        "rss_bytes": {
+            "start": rss_start,
+            "connected": rss_connected,
+            "end": rss_end,
+            "after_close": rss_closed,
+            "growth_during_run": rss_end - rss_connected,
+            "timeline": rss_timeline,
+        },
+    }
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        kind, weight = part.split("=")
+        if kind not in ("private", "group", "general"):
+            raise argparse.ArgumentTypeError(f"unknown message kind: {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument("--rate", type=float, default=0.2, help="messages/sec per client")
+    parser.add_argument("--typing-rate", type=float, default=0.0, help="typing events/sec per client")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("private=0.6,group=0.35,general=0.05"))
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--group-size", type=int, default=25)
+    parser.add_argument("--connect-batch", type=int, default=200)
+    parser.add_argument("--open-timeout", type=float, default=120.0, help="per-client handshake timeout in seconds")
+    parser.add_argument("--sample-every", type=float, default=5.0, help="RSS sampling interval in seconds")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for fan-out after sending stops")
+    parser.add_argument("--wire", choices=("json", "msgpack"), default="json", help="negotiated frame format")
+    parser.add_argument("--uvloop", action="store_true", help="run on uvloop if installed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON to this path")
+    args = parser.parse_args()
+
+    if args.uvloop:
+        import uvloop
+        uvloop.install()
+
+    results = asyncio.run(run(args))
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    summary = {k: results[k] for k in ("sent_per_second", "delivered_per_second", "received_bytes", "latency_ms", "loop_lag_ms")}
+    summary["rss_growth_mb"] = round(results["rss_bytes"]["growth_during_run"] / 2**20, 1)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Production entry point for the chat server.
+
+    python -m chat_server serve [--host HOST] [--port PORT] [--workers N]
+    python -m chat_server config     # print the resolved server options
+
+`python main.py` is the development server: it runs under uvicorn's
+file-watching reloader. `serve` runs without the reloader or the per-request access
+log. It uses uvloop and httptools when they are installed, and takes
+backlog, keep-alive, concurrency, graceful shutdown and websocket limits
+from `Settings` (`SERVER_*`, `WS_MAX_FRAME_BYTES`, `WS_MAX_QUEUE`).
+
+On SIGTERM or SIGINT it stops listening and then drains (drain.py):
+websocket clients are told to reconnect at staggered times over
+`DRAIN_RECONNECT_SPREAD` seconds and queued pushes and read cursors are
+flushed, before uvicorn closes whatever is left. A second SIGINT skips
+the rest of the drain.
+
+With more than one worker, uvicorn binds the listening socket once and
+forks workers that all accept from it. Websocket fan-out, the group cache,
+typing, rate limits and the read receipt buffer live in each worker's
+memory, so a message only reaches recipients connected to the same
+worker. Until delivery crosses workers, `--workers` above 1 needs
+`--allow-split-state` and is meant for HTTP-only benchmarking
+(benchmarks/launcher_bench.py).
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import sys
+
+import uvicorn
+
+from config import settings
+
+logger = logging.getLogger("chat.server")
+
+
+def available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def server_options(host: str, port: int, workers: int) -> dict:
+    """Keyword arguments for uvicorn.run()"""
+    return {
+        "host": host,
+        "port": port,
+        "workers": workers,
+        "loop": "uvloop" if available("uvloop") else "asyncio",
+        "http": "httptools" if available("httptools") else "h11",
+        "backlog": settings.server_backlog,
+        "timeout_keep_alive": settings.server_keepalive_timeout,
+        "limit_concurrency": settings.server_limit_concurrency,
+        "timeout_graceful_shutdown": settings.server_graceful_shutdown_timeout,
+        "ws_max_size": settings.ws_max_frame_bytes,
+        "ws_max_queue": settings.ws_max_queue,
+        # The app's own heartbeat (WS_HEARTBEAT_INTERVAL) already finds dead peers
+        "ws_ping_interval": None,
+        "access_log": False,
+        # Leave logging to logging_config.py
+        "log_config": None,
+    }
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that moves websocket clients off gradually before closing connections"""
+
+    async def shutdown(self, sockets=None):
+        # Stop accepting first, as uvicorn does; it closes these again harmlessly
+        for server in self.servers:
+            server.close()
+        for sock in sockets or []:
+            sock.close()
+
+        from drain import drain
+        task = asyncio.create_task(drain(
+            settings.drain_reconnect_spread, settings.drain_close_grace, settings.drain_flush_timeout
+        ))
+        while not task.done():
+            if self.force_exit:
+                task.cancel()
+                break
+            await asyncio.wait({task}, timeout=0.1)
+        if task.done() and not task.cancelled() and task.exception():
+            logger.error("Drain failed", exc_info=task.exception())
+
+        await super().shutdown(sockets)
+
+
+def serve(args) -> int:
+    from ws_compression import ChatWebSocketProtocol
+
+    if args.workers > 1 and not args.allow_split_state:
+        print(
+            "--workers > 1 splits websocket delivery between processes; "
+            "pass --allow-split-state to run it anyway (HTTP benchmarking only)",
+            file=sys.stderr,
+        )
+        return 2
+
+    options = server_options(args.host, args.port, args.workers)
+    logger.info("Starting chat server", extra={k: options[k] for k in ("host", "port", "workers", "loop", "http")})
+    config = uvicorn.Config("main:app", ws=ChatWebSocketProtocol, **options)
+    server = DrainingServer(config)
+    if config.workers > 1:
+        from uvicorn.supervisors import Multiprocess
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+        return 0
+    server.run()
+    return 0 if server.started else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m chat_server", description="Run the chat API in production")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the server")
+    serve_parser.add_argument("--host", default=settings.host)
+    serve_parser.add_argument("--port", type=int, default=settings.port)
+    serve_parser.add_argument("--workers", type=int, default=settings.server_workers)
+    serve_parser.add_argument("--allow-split-state", action="store_true",
+                              help="allow several workers even though websocket state is per process")
+
+    config_parser = commands.add_parser("config", help="print the resolved uvicorn options")
+    config_parser.add_argument("--workers", type=int, default=settings.server_workers)
+
+    args = parser.parse_args(argv)
+    if args.command == "config":
+        print(json.dumps(server_options(settings.host, settings.port, args.workers), indent=2))
+        return 0
+
+    from logging_config import setup_logging
+    setup_logging()
+    return serve(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
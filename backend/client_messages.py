@@ -0,0 +1,80 @@
+"""
+Idempotent message resends.
+
+A `private`, `group` or `public` frame may carry a `client_msg_id` the
+client picked (a UUID, say). The message is stored with it under a
+unique index on (sender_id, client_msg_id), and the sender gets
+
+    {"type": "ack", "client_msg_id", "id", "timestamp", "duplicate": false}
+
+on the socket it sent from. A client that lost its socket before the ack
+resends the same frame. If it was already stored, the resend gets the
+same ack with `duplicate: true` and is neither stored nor fanned out
+again. The most recent `settings.client_msg_window` pairs are answered
+from memory; older ones, or ones stored before a restart, are caught by
+the unique index.
+"""
+
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import metrics
+from config import settings
+from models import Message
+from wire import Frame
+
+
+class ClientMessageWindow:
+    def __init__(self, size: int):
+        self.size = size
+        # (sender username, client_msg_id) -> (message id, ISO timestamp), oldest first
+        self._stored: Dict[Tuple[str, str], Tuple[int, str]] = {}
+
+    def get(self, sender: str, client_msg_id: str) -> Optional[Tuple[int, str]]:
+        return self._stored.get((sender, client_msg_id))
+
+    def remember(self, sender: str, client_msg_id: str, message_id: int, sent_at: str):
+        if not self.size:
+            return
+        self._stored[(sender, client_msg_id)] = (message_id, sent_at)
+        if len(self._stored) > self.size:
+            del self._stored[next(iter(self._stored))]
+
+    def __len__(self):
+        return len(self._stored)
+
+
+def stored_message(db: Session, sender_id: int, client_msg_id: str) -> Optional[Tuple[int, str]]:
+    """Id and timestamp of the message already stored under this client id, if any"""
+    row = db.query(Message.id, Message.timestamp).filter(
+        Message.sender_id == sender_id,
+        Message.client_msg_id == client_msg_id
+    ).first()
+    return (row.id, row.timestamp.isoformat()) if row else None
+
+
+def ack_frame(client_msg_id: str, message_id: int, sent_at: str, duplicate: bool = False) -> Frame:
+    return Frame({
+        "type": "ack",
+        "client_msg_id": client_msg_id,
+        "id": message_id,
+        "timestamp": sent_at,
+        "duplicate": duplicate
+    })
+
+
+resends = metrics.Counter(
+    "chat_ws_resends_total",
+    "Message frames recognised as resends, by where the earlier copy was found",
+    ("source",),
+)
+
+# Global client message id window instance
+client_messages = ClientMessageWindow(settings.client_msg_window)
+
+metrics.Gauge(
+    "chat_ws_client_msg_window_size",
+    "Client message ids answered from memory",
+    callback=lambda: len(client_messages)
+)
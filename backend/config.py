@@ -1,13 +1,21 @@
 import os
-from pydantic_settings import BaseSettings
-from pydantic import ConfigDict, Field
-from typing import List
-from dotenv import load_dotenv
-load_dotenv()  # reads .env into environment
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic import Field
+from typing import List, Optional
+
+# .env next to this file, then one in the working directory
+ENV_FILES = (os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"), ".env")
 
 class Settings(BaseSettings):
     # Database
     database_url: str = "sqlite:///./chat.db"
+    # Handlers query on the event loop, so a request waiting for a pooled
+    # connection stalls every other request; keep pool capacity above the
+    # number of HTTP requests expected in flight
+    db_pool_size: int = Field(20, ge=1)
+    db_max_overflow: int = Field(40, ge=0)
+    db_pool_timeout: float = 30.0
     
     # Security
     secret_key: str = "your-secret-key-change-this-in-production"
@@ -15,18 +23,126 @@ class Settings(BaseSettings):
     access_token_expire_minutes: int = 60 * 24  # 24 hours
     refresh_token_expire_days: int = 7  # 7 days
     
+    # Users allowed on /api/admin (profiling); none by default
+    admin_usernames: List[str] = []
+    
     # CORS
     allowed_origins: List[str] = ["http://localhost:3000"]
     
     # Server
     host: str = "0.0.0.0"
-    port: int = 8000
+    port: int = Field(8000, ge=1, le=65535)
+    # Production launcher (chat_server.py)
+    server_workers: int = Field(1, ge=1)
+    server_backlog: int = 2048  # pending TCP connections queued by the kernel
+    server_keepalive_timeout: int = 5  # seconds an idle HTTP keep-alive connection stays open
+    server_limit_concurrency: Optional[int] = None  # connections + tasks before new requests get 503
+    server_graceful_shutdown_timeout: Optional[int] = 30  # seconds to let open connections finish on shutdown
+    ws_max_queue: int = 32  # inbound frames buffered per socket before reads stop
     
+    # Search
+    search_rank_window: int = 2000  # newest readable matches considered for ranking
+
+    # WebSocket heartbeats
+    ws_heartbeat_interval: float = Field(25.0, gt=0)  # seconds between server pings / reaper passes
+    ws_idle_timeout: float = 75.0  # close sockets with no inbound frame for this long
+
+    # Graceful drain (python -m chat_server serve, on SIGTERM/SIGINT)
+    drain_reconnect_spread: float = Field(10.0, ge=0)  # clients are told to reconnect at random points in this window
+    drain_close_grace: float = Field(2.0, ge=0)  # then sockets still open are closed by the server
+    drain_flush_timeout: float = Field(5.0, ge=0)  # seconds to finish queued pushes and read cursors
+
+    # Event loop lag monitor and load shedding (loop_monitor.py)
+    loop_lag_interval: float = Field(0.1, gt=0)  # seconds between lag samples
+    loop_shedding: bool = True  # False: measure lag only
+    loop_lag_shed_push_ms: float = Field(100.0, gt=0)  # smoothed lag at which push sends wait
+    loop_lag_shed_ephemeral_ms: float = Field(250.0, gt=0)  # ... typing and presence frames are dropped
+    loop_lag_shed_connections_ms: float = Field(500.0, gt=0)  # ... new websockets are turned away
+    loop_shed_cooldown: float = Field(5.0, ge=0)  # seconds under a stage's threshold before stepping down
+    loop_shed_retry_after: float = Field(5.0, ge=0)  # turned-away clients reconnect after this, plus as much jitter
+
+    # WebSocket inbound limits
+    ws_max_frame_bytes: int = 16384  # larger frames are refused with close code 1009
+    ws_max_content_chars: int = 4000
+    ws_rate_per_connection: float = 5.0  # sustained frames/sec per socket
+    ws_burst_per_connection: int = 20
+    ws_rate_per_user: float = 10.0  # sustained frames/sec across all of a user's sockets
+    ws_burst_per_user: int = 40
+
+    # Typing indicators
+    typing_refresh_seconds: float = 3.0  # relay at most one "typing" per sender and room this often
+    typing_ttl_seconds: float = 6.0  # receivers hide an unrefreshed indicator after this long
+
+    # Read receipts
+    read_flush_interval: float = Field(2.0, gt=0)  # seconds between batched read cursor writes
+    unread_count_cap: int = 100  # unread counts stop here ("99+")
+
+    # Attachments
+    attachments_dir: str = "attachments"  # uploads in progress and content-addressed files
+    attachment_max_bytes: int = 25 * 1024 * 1024
+    attachment_chunk_bytes: int = 1024 * 1024  # largest body one upload request may carry
+    attachment_max_per_message: int = 10
+    attachment_upload_ttl_hours: float = 24.0  # unfinished uploads are dropped after this
+
+    # Push notifications (push_outbox.py)
+    push_batch_size: int = Field(100, ge=1)  # outbox rows claimed per batch
+    push_poll_interval: float = Field(5.0, gt=0)  # seconds between outbox polls when no new message wakes the worker
+    push_send_concurrency: int = Field(8, ge=1)  # push endpoints sent to at once
+    push_send_timeout: float = Field(10.0, gt=0)  # seconds per request to a push service
+    push_max_attempts: int = Field(5, ge=1)  # then the row is marked failed
+    push_retry_delay: float = Field(30.0, ge=0)  # before the first retry; doubles with each attempt
+    push_claim_timeout: float = Field(120.0, gt=0)  # claimed rows not settled by then (worker died) are sent again
+
+    # Retention
+    retention_days: int = 0  # archive messages older than this; 0 keeps them forever
+    retention_interval: float = Field(3600.0, gt=0)  # seconds between archiving passes
+    retention_batch_size: int = 500  # messages moved per transaction
+
+    # WebSocket compression (permessage-deflate)
+    ws_compression: bool = True
+    ws_compression_level: int = Field(1, ge=1, le=9)  # zlib level 1-9
+    ws_compression_window_bits: int = Field(12, ge=9, le=15)  # server LZ77 window, 9-15
+    ws_compression_min_bytes: int = 128  # shorter frames are sent uncompressed
+
+    # Message ids (message_ids.py)
+    message_node_id: Optional[int] = Field(None, ge=0, le=15)  # unique per process writing to one database; unset: leased from the database at startup
+    message_node_lease_seconds: float = Field(60.0, gt=0)  # a leased node id is freed this long after its process stops renewing it
+
+    # Sync
+    sync_max_messages: int = 500  # per /api/sync page and per websocket replay
+    client_msg_window: int = Field(10000, ge=0)  # recent client message ids recognised without a query
+
+    # Caches
+    group_cache_size: int = 10000  # groups kept in the membership cache (LRU)
+
+    # Observability
+    log_level: str = "INFO"
+    log_json: bool = True
+    metrics_enabled: bool = True  # serve Prometheus metrics at /metrics
+    # Sampling profiler (profiling.py); admins can also switch it at runtime
+    profiling_enabled: bool = False
+    profile_sample_rate: float = Field(0.05, ge=0, le=1)  # fraction of requests/frames whose stacks are aggregated
+    profile_slow_ms: float = Field(250.0, gt=0)  # operations slower than this are captured with their stacks
+    profile_interval_ms: float = Field(5.0, gt=0)  # stack sampling period while anything is in flight
+    profile_max_slow: int = Field(100, ge=1)  # slow captures kept
+    # SQL accounting (query_log.py)
+    slow_query_ms: float = Field(100.0, gt=0)  # statements slower than this are logged
+    slow_query_explain: bool = True  # log the query plan with each slow statement
+    request_query_warn: int = Field(50, ge=1)  # log HTTP requests issuing more queries than this
+
     # Push Notifications (VAPID) - Generated from vapidkeys.com
-    vapid_public_key: str = os.environ["PUBLIC_KEY"]
-    vapid_private_key: str  = os.environ["PRIVATE_KEY"]
-    vapid_email: str  = os.environ["VAPID_EMAIL"]
+    vapid_public_key: str = Field(validation_alias="PUBLIC_KEY")
+    vapid_private_key: str = Field(validation_alias="PRIVATE_KEY")
+    vapid_email: str = Field(validation_alias="VAPID_EMAIL")
+
+    model_config = SettingsConfigDict(env_file=ENV_FILES, extra="ignore", populate_by_name=True)
+
+@lru_cache
+def get_settings() -> Settings:
+    """Environment and .env parsed and validated once per process.
 
-    model_config = ConfigDict(env_file=".env", extra="ignore")
+    Raises pydantic.ValidationError naming every missing or invalid variable.
+    """
+    return Settings()
 
-settings = Settings()
+settings = get_settings()
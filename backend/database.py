@@ -1,24 +1,36 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+import logging
 from sqlalchemy.orm import sessionmaker, Session
 from config import settings
 
 # Create engine
+pool_options = {} if ":memory:" in settings.database_url else {
+    "pool_size": settings.db_pool_size,
+    "max_overflow": settings.db_max_overflow,
+    "pool_timeout": settings.db_pool_timeout
+}
 engine = create_engine(
     settings.database_url, 
-    connect_args={"check_same_thread": False}
+    connect_args={"check_same_thread": False},
+    **pool_options
 )
 
+# Per-request query counts, slow-query log and query budgets (query_log.py)
+import query_log
+event.listen(engine, "before_cursor_execute", query_log.before_cursor_execute)
+event.listen(engine, "after_cursor_execute", query_log.after_cursor_execute)
+
 # Create session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Import all models to ensure they are registered with Base
-from models import Base, User, Message, PushSubscription, GroupChat, group_membership
+from models import Base, User, Message, MessageNodeLease, PushSubscription, GroupChat, Conversation, ReadCursor, ArchivedMessage, RetentionPolicy, Attachment, AttachmentUpload, group_membership
 
 # Create tables (only if they don't exist - for development without migrations)
 def create_tables():
     """Create all database tables if they don't exist"""
     Base.metadata.create_all(bind=engine)
-    print("Database tables created (if they didn't exist)!")
+    logging.getLogger(__name__).info("Database tables created (if they didn't exist)")
 
 # Optional: Create tables on import for development
 # Comment this out if you want to use migrations exclusively
@@ -0,0 +1,98 @@
+"""
+Graceful drain for shutdowns and rolling restarts.
+
+`chat_server.DrainingServer` runs `drain()` once it has stopped listening
+and before uvicorn closes the remaining connections:
+
+1. `manager.draining` is set. /health answers 503 so load balancers stop
+   routing here, and a websocket that still completes its handshake is
+   handed a reconnect hint and closed.
+2. Every open socket gets `{"type": "reconnect", "after_ms": N}` with N
+   drawn uniformly from `settings.drain_reconnect_spread`. Clients
+   reconnect (to another instance) at that point, so reconnects arrive
+   spread out instead of all at once. Until then the socket works as usual.
+3. A socket still open `settings.drain_close_grace` seconds after its
+   hinted time (a client that ignores hints) is closed with 1012 on the
+   same staggered schedule.
+4. `flush_queues()` writes pending read cursors and sends the push
+   notifications due in the outbox, up to `settings.drain_flush_timeout`.
+
+The lifespan shutdown in main.py runs `flush_queues()` too, whichever
+launcher is used. Pushes still in the outbox after that are sent by the
+next process to start.
+"""
+
+import asyncio
+import logging
+import random
+from time import monotonic
+
+import metrics
+from read_receipts import read_buffer
+from push_outbox import push_outbox
+from websocket_manager import SERVICE_RESTART, manager, reconnect_frame
+from wire import send_frame
+
+logger = logging.getLogger(__name__)
+
+
+async def drain(spread: float, grace: float, flush_timeout: float):
+    """Move every websocket client elsewhere over `spread` seconds, then flush queues"""
+    started = monotonic()
+    manager.draining = True
+    connections = list(manager.active_connections.items())
+    logger.info("Draining %d websocket connections over %.1fs", len(connections), spread)
+    await asyncio.gather(*(
+        _hint_and_close(username, websocket, random.uniform(0, spread), grace)
+        for username, websocket in connections
+    ))
+    await flush_queues(flush_timeout)
+    drain_seconds.observe(monotonic() - started)
+    logger.info("Drain finished in %.1fs", monotonic() - started)
+
+
+async def _hint_and_close(username: str, websocket, after: float, grace: float):
+    try:
+        # A peer that stopped reading must not hold up the drain
+        await asyncio.wait_for(send_frame(websocket, reconnect_frame(after)), grace or None)
+        reconnect_hints.inc()
+    except Exception:
+        pass
+    await asyncio.sleep(after + grace)
+    if manager.active_connections.get(username) is not websocket:
+        return  # The client left as asked
+    manager.disconnect(username, websocket)
+    forced_closes.inc()
+    try:
+        await asyncio.wait_for(websocket.close(code=SERVICE_RESTART), grace or None)
+    except Exception:
+        pass  # Already gone; uvicorn drops whatever is left
+
+
+async def flush_queues(timeout: float):
+    """Write pending read cursors and send due pushes, within `timeout` seconds"""
+    deadline = monotonic() + timeout
+    await read_buffer.flush()
+    left = await push_outbox.flush(max(deadline - monotonic(), 0))
+    if left:
+        pushes_left.inc(left)
+        logger.info("%d push notifications left in the outbox for the next start", left)
+
+
+reconnect_hints = metrics.Counter(
+    "chat_drain_reconnect_hints_total",
+    "Reconnect hints sent to open websockets while draining",
+)
+forced_closes = metrics.Counter(
+    "chat_drain_forced_closes_total",
+    "Websockets the server closed because the client did not leave after its hint",
+)
+pushes_left = metrics.Counter(
+    "chat_drain_pushes_left_total",
+    "Push notifications still in the outbox when the flush deadline passed",
+)
+drain_seconds = metrics.Histogram(
+    "chat_drain_seconds",
+    "Time from drain start until queues were flushed",
+    buckets=(1, 2.5, 5, 10, 15, 20, 30, 60),
+)
@@ -0,0 +1,98 @@
+"""
+Process-wide cache of group membership used for group message fan-out.
+
+Maps group_id to the group's name and its members' ids and usernames so a
+group send needs no membership queries. Entries are evicted LRU once
+`settings.group_cache_size` groups are cached. The routers that change
+membership (create, add members, leave) call `invalidate()` after commit.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import metrics
+from config import settings
+from models import User, GroupChat, group_membership
+
+
+@dataclass(frozen=True)
+class GroupInfo:
+    group_id: int
+    name: str
+    member_ids: FrozenSet[int]
+    member_usernames: Tuple[str, ...]
+    version: int
+
+
+class GroupMembershipCache:
+    def __init__(self, max_groups: int):
+        self.max_groups = max_groups
+        self.version = 0  # bumped on every invalidation
+        self._entries: "OrderedDict[int, GroupInfo]" = OrderedDict()
+
+    def get(self, db: Session, group_id: int) -> Optional[GroupInfo]:
+        """Return cached membership for a group, loading it on a miss"""
+        info = self._entries.get(group_id)
+        if info is not None:
+            self._entries.move_to_end(group_id)
+            cache_requests.inc(1, "hit")
+            return info
+
+        cache_requests.inc(1, "miss")
+        version = self.version
+        info = self._load(db, group_id, version)
+        # Don't cache a result that an invalidation may have raced with
+        if info is not None and version == self.version:
+            self._entries[group_id] = info
+            if len(self._entries) > self.max_groups:
+                self._entries.popitem(last=False)
+        return info
+
+    def invalidate(self, group_id: int):
+        """Drop a group after its membership or name changed"""
+        self.version += 1
+        self._entries.pop(group_id, None)
+
+    def clear(self):
+        self.version += 1
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _load(db: Session, group_id: int, version: int) -> Optional[GroupInfo]:
+        group = db.query(GroupChat.name).filter(GroupChat.id == group_id).first()
+        if group is None:
+            return None
+        members = db.query(User.id, User.username).join(
+            group_membership, User.id == group_membership.c.user_id
+        ).filter(
+            group_membership.c.group_id == group_id
+        ).all()
+        return GroupInfo(
+            group_id=group_id,
+            name=group.name,
+            member_ids=frozenset(member.id for member in members),
+            member_usernames=tuple(member.username for member in members),
+            version=version
+        )
+
+
+cache_requests = metrics.Counter(
+    "chat_group_cache_requests_total",
+    "Group membership cache lookups",
+    ("result",),
+)
+
+# Global group membership cache instance
+group_cache = GroupMembershipCache(settings.group_cache_size)
+
+metrics.Gauge(
+    "chat_group_cache_entries",
+    "Groups held in the membership cache",
+    callback=lambda: len(group_cache)
+)
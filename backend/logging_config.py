@@ -0,0 +1,88 @@
+"""
+Structured, non-blocking logging.
+
+Records are handed to a queue on the calling thread (the event loop) and
+formatted as JSON and written to stdout by a background listener thread.
+Use %-style arguments (`logger.debug("sent to %s", user_id)`) so disabled
+levels cost only a level check; pass structured fields with `extra={...}`.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+from config import settings
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the message and any `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in-process, so skip the base class's eager
+        # formatting and hand the record over untouched.
+        return record
+
+
+def _stdout_handler() -> logging.Handler:
+    output = logging.StreamHandler(sys.stdout)
+    if settings.log_json:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    return output
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Route the root logger through a queue to a JSON stdout writer (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = _stdout_handler()
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [_QueueHandler(log_queue)]
+    root.setLevel(settings.log_level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread
+
+    The root logger writes to stdout directly afterwards, so records logged
+    after shutdown (or before the next `setup_logging()`, e.g. when a test
+    runs the app's lifespan again) are not queued where nothing drains them.
+    """
+    global _listener
+    if _listener is not None:
+        logging.getLogger().handlers = [_stdout_handler()]
+        _listener.stop()
+        _listener = None
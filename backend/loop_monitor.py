@@ -0,0 +1,134 @@
+"""
+Event loop lag monitor and staged load shedding.
+
+Everything in this server runs on one event loop, so any blocking call
+(bcrypt, a synchronous query, a slow client write) delays every other
+connection. The background task started in main.py sleeps
+`settings.loop_lag_interval` seconds at a time. Lag is how much later than
+asked it woke up. Samples go to `chat_event_loop_lag_seconds`, and a
+smoothed value drives the shedding stage:
+
+    stage  threshold (smoothed lag)            shed
+    1      LOOP_LAG_SHED_PUSH_MS (100)         push outbox sends wait
+    2      LOOP_LAG_SHED_EPHEMERAL_MS (250)    typing relays and users_update presence frames dropped
+    3      LOOP_LAG_SHED_CONNECTIONS_MS (500)  new websockets told to come back later and closed (1013)
+
+Each stage includes the ones below it. Message delivery, acks, read
+receipts and heartbeats are never shed. The stage rises as soon as the
+smoothed lag crosses a threshold and falls one stage at a time, after
+the lag has stayed under the current stage's threshold for
+`settings.loop_shed_cooldown` seconds, so it doesn't flap. With
+`LOOP_SHEDDING=false` lag is only measured.
+"""
+
+import asyncio
+import logging
+from time import monotonic
+from typing import Callable, List
+
+import metrics
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+NORMAL, DEFER_PUSH, DROP_EPHEMERAL, REJECT_CONNECTIONS = range(4)
+STAGE_NAMES = ("normal", "defer_push", "drop_ephemeral", "reject_connections")
+
+# Weight of the newest sample in the smoothed lag
+SMOOTHING = 0.3
+
+
+class LoopLagMonitor:
+    def __init__(self, thresholds_ms: List[float], cooldown: float, enabled: bool = True):
+        # Lag (seconds) at which each stage from DEFER_PUSH up starts
+        self.thresholds = [ms / 1000 for ms in thresholds_ms]
+        self.cooldown = cooldown
+        self.enabled = enabled
+        self.stage = NORMAL
+        self.smoothed = 0.0
+        self._calm_since = None
+        self._watchers: List[Callable[[int, int], None]] = []
+
+    def sheds(self, stage: int) -> bool:
+        """Whether work shed at `stage` should be skipped right now"""
+        return self.stage >= stage
+
+    def watch(self, callback: Callable[[int, int], None]):
+        """Call `callback(old, new)` on every stage change"""
+        self._watchers.append(callback)
+
+    def observe(self, lag: float, now: float):
+        """Fold in one lag sample and move the stage if needed"""
+        loop_lag.observe(lag)
+        self.smoothed += SMOOTHING * (lag - self.smoothed)
+        if not self.enabled:
+            return
+        target = NORMAL
+        for stage, threshold in enumerate(self.thresholds, start=DEFER_PUSH):
+            if self.smoothed >= threshold:
+                target = stage
+        if target > self.stage:
+            self._calm_since = None
+            self._set_stage(target)
+        elif target < self.stage:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.cooldown:
+                self._calm_since = now
+                self._set_stage(self.stage - 1)
+        else:
+            self._calm_since = None
+
+    def _set_stage(self, stage: int):
+        old, self.stage = self.stage, stage
+        log = logger.warning if stage > old else logger.info
+        log("Load shedding stage %s -> %s (smoothed loop lag %.0f ms)",
+            STAGE_NAMES[old], STAGE_NAMES[stage], self.smoothed * 1000)
+        stage_changes.inc(1, STAGE_NAMES[stage])
+        for callback in self._watchers:
+            try:
+                callback(old, stage)
+            except Exception:
+                logger.exception("Shedding stage watcher failed")
+
+    async def run(self, interval: float):
+        """Background task: sample loop lag every `interval` seconds"""
+        while True:
+            started = monotonic()
+            await asyncio.sleep(interval)
+            now = monotonic()
+            self.observe(max(now - started - interval, 0.0), now)
+
+
+loop_lag = metrics.Histogram(
+    "chat_event_loop_lag_seconds",
+    "How much later than scheduled the loop monitor woke up",
+)
+stage_changes = metrics.Counter(
+    "chat_load_shed_stage_changes_total",
+    "Load shedding stage transitions, by the stage entered",
+    ("stage",),
+)
+shed_work = metrics.Counter(
+    "chat_load_shed_total",
+    "Low-priority work skipped because of event loop lag",
+    ("work",),
+)
+
+# Global loop lag monitor instance
+loop_monitor = LoopLagMonitor(
+    [settings.loop_lag_shed_push_ms, settings.loop_lag_shed_ephemeral_ms, settings.loop_lag_shed_connections_ms],
+    settings.loop_shed_cooldown,
+    settings.loop_shedding,
+)
+
+metrics.Gauge(
+    "chat_event_loop_lag_smoothed_seconds",
+    "Smoothed event loop lag that drives load shedding",
+    callback=lambda: loop_monitor.smoothed
+)
+metrics.Gauge(
+    "chat_load_shed_stage",
+    "Current load shedding stage (0 normal, 1 defer push, 2 drop typing/presence, 3 reject new websockets)",
+    callback=lambda: loop_monitor.stage
+)
@@ -1,24 +1,82 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
-import uvicorn
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import importlib
+import logging
 
 from config import settings
-from routers import auth, users, messages, websocket, push, groups
+from logging_config import setup_logging, shutdown_logging
+import metrics
+from websocket_manager import manager
+from read_receipts import read_buffer
+from retention import message_archiver
+from push_outbox import push_outbox
+from loop_monitor import loop_monitor
+from profiling import ProfilingMiddleware, profiler
+from node_lease import node_lease
+from query_log import QueryCountingMiddleware
+from drain import flush_queues
+from routers import auth, users, messages, websocket, push, groups, search, conversations, attachments, admin
 
 # Import database to ensure tables are created
 import database
 
+setup_logging()
+logger = logging.getLogger("chat")
+
+# Heavy modules kept off the import path (see push_outbox.py and auth.py)
+DEFERRED_MODULES = ("jose.jwt", "bcrypt", "pywebpush")
+
+async def preload_deferred_modules():
+    """Import deferred modules in a thread once the app is serving, so the first push or login doesn't pay for them"""
+    for name in DEFERRED_MODULES:
+        try:
+            await run_in_threadpool(importlib.import_module, name)
+        except ImportError:
+            logger.warning("Deferred module %s is not installed", name)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("🚀 Starting Chat API with Group Functionality")
-    print("📊 Database tables initialized")
-    print("🔗 WebSocket support enabled")
-    print("👥 Group chat functionality ready")
+    setup_logging()  # No-op on first start; restarts the listener if an earlier lifespan stopped it
+    logger.info("Starting Chat API with Group Functionality")
+    leased = settings.message_node_id is None
+    if leased:
+        # Message ids need a node id no other running process has (message_ids.py)
+        node_lease.acquire()
+    heartbeat = asyncio.create_task(
+        manager.run_heartbeat(settings.ws_heartbeat_interval, settings.ws_idle_timeout)
+    )
+    read_flusher = asyncio.create_task(read_buffer.run(settings.read_flush_interval))
+    archiver = asyncio.create_task(message_archiver.run(settings.retention_interval))
+    push_sender = asyncio.create_task(push_outbox.run(settings.push_poll_interval))
+    lag_monitor = asyncio.create_task(loop_monitor.run(settings.loop_lag_interval))
+    preload = asyncio.create_task(preload_deferred_modules())
+    tasks = [heartbeat, read_flusher, archiver, push_sender, lag_monitor, preload]
+    if leased:
+        tasks.append(asyncio.create_task(node_lease.run(settings.message_node_lease_seconds / 3)))
+    if settings.profiling_enabled:
+        profiler.enable()
+    logger.info("WebSocket support enabled")
+    logger.info("Group chat functionality ready")
     yield
     # Shutdown
-    print("👋 Shutting down Chat API")
+    logger.info("Shutting down Chat API")
+    # Deliver what is already queued instead of cancelling it with the loop
+    await flush_queues(settings.drain_flush_timeout)
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    if leased:
+        node_lease.release()
+    profiler.disable()
+    shutdown_logging()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -28,6 +86,12 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Request timing for the opt-in profiler; one flag check while it is off
+app.add_middleware(ProfilingMiddleware)
+
+# Query count and database time per request (Server-Timing header, metrics)
+app.add_middleware(QueryCountingMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -44,6 +108,10 @@ app.include_router(messages.router)
 app.include_router(websocket.router)
 app.include_router(push.router)
 app.include_router(groups.router)
+app.include_router(search.router)
+app.include_router(conversations.router)
+app.include_router(attachments.router)
+app.include_router(admin.router)
 
 # Startup event moved to lifespan context manager above
 
@@ -57,6 +125,7 @@ async def root():
             "Real-time messaging",
             "Private messages", 
             "Group chat",
+            "Message search",
             "Push notifications",
             "User authentication"
         ],
@@ -66,12 +135,27 @@ async def root():
 # Health check
 @app.get("/health")
 async def health_check():
+    if manager.draining:
+        # Tell load balancers to stop routing here during a drain
+        return JSONResponse({"status": "draining"}, status_code=503)
     return {"status": "healthy"}
 
+# Prometheus metrics
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return PlainTextResponse(metrics.render_latest(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    import uvicorn
+    from ws_compression import ChatWebSocketProtocol
+
+    # Development server; use `python -m chat_server serve` in production
     uvicorn.run(
         "main:app", 
         host=settings.host, 
         port=settings.port, 
-        reload=True
+        reload=True,
+        ws=ChatWebSocketProtocol,
+        ws_max_size=settings.ws_max_frame_bytes
     )
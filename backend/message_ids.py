@@ -0,0 +1,88 @@
+"""
+Time-ordered message ids, assigned in process before the INSERT.
+
+Layout, most significant bit first:
+
+    41 bits  milliseconds since ID_EPOCH (good until 2093)
+     4 bits  node id (settings.message_node_id)
+     8 bits  sequence within the millisecond
+
+53 bits in all, so ids stay exact as JSON numbers in browsers
+(Number.MAX_SAFE_INTEGER is 2**53 - 1). Ids from one node are strictly
+increasing; ids from different nodes are ordered to the millisecond.
+Rows inserted before this scheme keep their small autoincrement ids,
+which sort before every generated one.
+
+Two processes writing to one database must use different node ids, or
+they can issue the same id. `settings.message_node_id` pins one; when it
+is unset the app leases a free node at startup (node_lease.py), and ids
+can't be issued until it has. Should ids still collide (a lease lost
+while the process was frozen), routers/websocket.py retries the insert
+under a fresh id.
+
+Ids are not in commit order across nodes. Each process assigns ids
+before its INSERT commits, so while two writers overlap (a drain
+hand-off, several workers) a row with a smaller id from one node can
+commit after a larger one from the other is already visible. A client
+whose cursor (`/api/sync`, `last_seen_id` replay) moved past the larger
+id skips the late row. With one writer, ids commit in order.
+
+If the clock steps back, or a node issues more than 256 ids in one
+millisecond, the generator keeps counting from the last millisecond it
+used instead of waiting, so ids never repeat or go backwards.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import settings
+
+ID_EPOCH = datetime(2024, 1, 1)
+ID_EPOCH_MS = int((ID_EPOCH - datetime(1970, 1, 1)).total_seconds() * 1000)
+NODE_BITS = 4
+SEQUENCE_BITS = 8
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class IdGenerator:
+    def __init__(self, node_id: Optional[int] = None):
+        self.node_id: Optional[int] = None
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.set_node(node_id)
+
+    def set_node(self, node_id: Optional[int]):
+        """Switch node id (None: stop issuing ids until one is set)"""
+        if node_id is not None and not 0 <= node_id <= MAX_NODE:
+            raise ValueError(f"node id must be between 0 and {MAX_NODE}")
+        with self._lock:
+            self.node_id = node_id
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self.node_id is None:
+                raise RuntimeError("No message node id: set MESSAGE_NODE_ID, or lease one first (node_lease.py)")
+            now_ms = time.time_ns() // 1_000_000 - ID_EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            elif self._sequence < MAX_SEQUENCE:
+                self._sequence += 1
+            else:
+                # Sequence exhausted, or the clock went back: borrow the next millisecond
+                self._last_ms += 1
+                self._sequence = 0
+            return (self._last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self._sequence
+
+
+def id_time(message_id: int) -> datetime:
+    """When a generated id was issued (naive UTC, millisecond precision)"""
+    return ID_EPOCH + timedelta(milliseconds=message_id >> (NODE_BITS + SEQUENCE_BITS))
+
+
+# Global message id generator instance; without MESSAGE_NODE_ID the node is leased at startup
+message_ids = IdGenerator(settings.message_node_id)
@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Table
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Table, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
+from message_ids import message_ids
+
 Base = declarative_base()
 
 # Association table for many-to-many relationship between users and group chats
@@ -12,7 +14,9 @@ group_membership = Table(
     Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
     Column('group_id', Integer, ForeignKey('group_chats.id'), primary_key=True),
     Column('joined_at', DateTime, default=datetime.utcnow),
-    Column('role', String, default='member')  # member, admin, owner
+    Column('role', String, default='member'),  # member, admin, owner
+    # The primary key leads with user_id; member lists and counts look up by group
+    Index('ix_group_membership_group_id', 'group_id')
 )
 
 class User(Base):
@@ -32,18 +36,33 @@ class User(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_room_id", "room", "id"),
+        # A resent frame can't be stored twice; NULLs (no client id) never conflict
+        Index("ux_messages_sender_client_msg_id", "sender_id", "client_msg_id", unique=True),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    # Time-ordered, assigned in process (message_ids.py); never left to SQLite's max(rowid)+1
+    id = Column(Integer, primary_key=True, index=True, default=message_ids.next_id)
     content = Column(String, nullable=False)
     sender_id = Column(Integer, ForeignKey("users.id"))
     room = Column(String, default="general")  # For backward compatibility
     group_id = Column(Integer, ForeignKey("group_chats.id"), nullable=True , default=0)  # For group messages
     timestamp = Column(DateTime, default=datetime.utcnow)
+    client_msg_id = Column(String, nullable=True)
     
     # Relationships
     sender = relationship("User", back_populates="messages")
     group_chat = relationship("GroupChat", back_populates="messages")
 
+class MessageNodeLease(Base):
+    """Message id node held by a running process (node_lease.py)"""
+    __tablename__ = "message_node_leases"
+
+    node_id = Column(Integer, primary_key=True, autoincrement=False)
+    holder = Column(String, nullable=False)  # host:pid:random of the process holding it
+    expires_at = Column(DateTime, nullable=False)
+
 class PushSubscription(Base):
     __tablename__ = "push_subscriptions"
     
@@ -72,3 +91,113 @@ class GroupChat(Base):
     creator = relationship("User", foreign_keys=[created_by])
     members = relationship("User", secondary=group_membership, back_populates="group_chats")
     messages = relationship("Message", back_populates="group_chat", cascade="all, delete-orphan")
+
+class Conversation(Base):
+    """One row per participant of a private conversation, kept current on every message"""
+    __tablename__ = "conversations"
+    __table_args__ = (
+        UniqueConstraint("user_id", "peer_id", name="uq_conversations_user_peer"),
+        Index("ix_conversations_user_activity", "user_id", "last_activity"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    peer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    room = Column(String, nullable=False, index=True)
+    last_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    last_activity = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Relationships
+    user = relationship("User", foreign_keys=[user_id])
+    peer = relationship("User", foreign_keys=[peer_id])
+    last_message = relationship("Message")
+
+class ReadCursor(Base):
+    """How far a user has read in a room; written in batches by read_receipts.py"""
+    __tablename__ = "read_cursors"
+    __table_args__ = (
+        UniqueConstraint("user_id", "room", name="uq_read_cursors_user_room"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    room = Column(String, nullable=False, index=True)
+    last_read_message_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Relationships
+    user = relationship("User")
+
+class ArchivedMessage(Base):
+    """Messages moved out of `messages` by the retention task (retention.py)"""
+    __tablename__ = "archived_messages"
+    __table_args__ = (
+        Index("ix_archived_messages_room_id", "room", "id"),
+    )
+    
+    # Keeps the id it had in `messages`
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    content = Column(String, nullable=False)
+    sender_id = Column(Integer, ForeignKey("users.id"))
+    room = Column(String)
+    group_id = Column(Integer, nullable=True)
+    timestamp = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class RetentionPolicy(Base):
+    """Per-room override of settings.retention_days; 0 keeps a room's messages forever"""
+    __tablename__ = "retention_policies"
+    
+    room = Column(String, primary_key=True)
+    days = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class Attachment(Base):
+    """A file stored under settings.attachments_dir, named by its SHA-256 and shared by identical uploads"""
+    __tablename__ = "attachments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Set when sent; no foreign key since archived messages keep their ids
+    message_id = Column(Integer, nullable=True, index=True)
+    room = Column(String, nullable=True)
+    sha256 = Column(String(64), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    thumbnail = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Relationships
+    uploader = relationship("User")
+
+class AttachmentUpload(Base):
+    """An upload in progress; chunks are written to <attachments_dir>/uploads/<id>.part at their offset"""
+    __tablename__ = "attachment_uploads"
+    
+    id = Column(String, primary_key=True)
+    uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    received = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class PushOutbox(Base):
+    """A push notification waiting to be sent; written with its message, drained by push_outbox.py"""
+    __tablename__ = "push_outbox"
+    __table_args__ = (
+        Index("ix_push_outbox_status_available_at", "status", "available_at"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    message_id = Column(Integer, nullable=True)
+    title = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    data = Column(Text, nullable=False)  # JSON
+    status = Column(String, default="pending", nullable=False)  # pending, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    # Not claimable before this; a claim pushes it out by settings.push_claim_timeout
+    available_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,154 @@
+"""
+Leased message id nodes.
+
+Message ids carry a 4-bit node id (message_ids.py), and two processes
+writing to one database with the same node issue the same ids. Unless
+`settings.message_node_id` pins one, main.py leases a node at startup:
+
+- `acquire()` takes the lowest node id with no row in
+  `message_node_leases`, or whose lease has expired. The primary key
+  decides between processes starting at the same time.
+- The background task renews the lease every third of
+  `settings.message_node_lease_seconds`. A process that stops renewing
+  (killed, frozen) frees its node when the lease runs out; one that can't
+  reach the database to renew stops issuing ids once its lease runs out,
+  and issues them again once a renewal shows the node is still its own.
+- A process that finds its lease gone or taken over stops issuing ids and
+  leases another node.
+- `release()` deletes the row at shutdown, so during a drain hand-off the
+  old process keeps its node until it exits and the new one gets another.
+
+With all 16 nodes leased, startup fails rather than share one.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import DateTime, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+import metrics
+from config import settings
+from database import SessionLocal
+from message_ids import MAX_NODE, IdGenerator, message_ids
+
+logger = logging.getLogger(__name__)
+
+LEASES = text("SELECT node_id, expires_at FROM message_node_leases").columns(expires_at=DateTime)
+CLAIM_FREE = text("""
+    INSERT INTO message_node_leases (node_id, holder, expires_at)
+    VALUES (:node_id, :holder, :expires_at)
+""")
+CLAIM_EXPIRED = text("""
+    UPDATE message_node_leases SET holder = :holder, expires_at = :expires_at
+    WHERE node_id = :node_id AND expires_at < :now
+""")
+RENEW = text("""
+    UPDATE message_node_leases SET expires_at = :expires_at
+    WHERE node_id = :node_id AND holder = :holder
+""")
+RELEASE = text("DELETE FROM message_node_leases WHERE node_id = :node_id AND holder = :holder")
+
+
+class NodeLease:
+    def __init__(self, generator: IdGenerator, ttl: float):
+        self.generator = generator
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.node_id: Optional[int] = None
+        self.expires_at: Optional[datetime] = None
+
+    def acquire(self) -> int:
+        """Lease a free node id and hand it to the generator"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=self.ttl)
+            params = {"holder": self.holder, "expires_at": expires_at, "now": now}
+            leases = dict(db.execute(LEASES).all())
+            for node_id in range(MAX_NODE + 1):
+                if node_id in leases and leases[node_id] >= now:
+                    continue
+                try:
+                    claimed = db.execute(
+                        CLAIM_EXPIRED if node_id in leases else CLAIM_FREE, {**params, "node_id": node_id}
+                    ).rowcount
+                    db.commit()
+                except IntegrityError:
+                    claimed = 0  # Another process took it first
+                    db.rollback()
+                if claimed:
+                    self.node_id, self.expires_at = node_id, expires_at
+                    self.generator.set_node(node_id)
+                    logger.info("Leased message node id %d", node_id, extra={"holder": self.holder})
+                    return node_id
+            raise RuntimeError(
+                f"All {MAX_NODE + 1} message node ids are leased; stop a writer or set MESSAGE_NODE_ID"
+            )
+        finally:
+            db.close()
+
+    def renew(self):
+        """Extend the lease; lease another node if this one was lost"""
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+        db = SessionLocal()
+        try:
+            renewed = db.execute(RENEW, {
+                "node_id": self.node_id,
+                "holder": self.holder,
+                "expires_at": expires_at,
+            }).rowcount
+            db.commit()
+        finally:
+            db.close()
+        if renewed:
+            self.expires_at = expires_at
+            # Still ours: hand the node back if run() took it when renewals kept failing past expiry
+            self.generator.set_node(self.node_id)
+        else:
+            logger.warning("Lost the lease on message node id %s; leasing another", self.node_id)
+            lost_leases.inc(1)
+            # Another process may own this node by now: issue nothing until we have a new one
+            self.generator.set_node(None)
+            self.node_id = None
+            self.acquire()
+
+    def release(self):
+        if self.node_id is None:
+            return
+        self.generator.set_node(None)
+        db = SessionLocal()
+        try:
+            db.execute(RELEASE, {"node_id": self.node_id, "holder": self.holder})
+            db.commit()
+        except SQLAlchemyError:
+            logger.exception("Failed to release message node id %d", self.node_id)
+        finally:
+            db.close()
+        self.node_id = None
+
+    async def run(self, interval: float):
+        """Background task: renew the lease every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.renew()
+            except Exception:
+                logger.exception("Message node lease renewal failed")
+                if self.expires_at is not None and datetime.utcnow() >= self.expires_at:
+                    # Another process may lease this node now
+                    self.generator.set_node(None)
+
+
+lost_leases = metrics.Counter(
+    "chat_message_node_leases_lost_total",
+    "Times this process found its message node lease expired or taken and leased another",
+)
+
+# Global node lease instance; used only when MESSAGE_NODE_ID is unset
+node_lease = NodeLease(message_ids, settings.message_node_lease_seconds)
@@ -0,0 +1,235 @@
+"""
+Opt-in sampling profiler for HTTP requests and websocket frames.
+
+Off unless `settings.profiling_enabled` is set or an admin turns it on
+through `PUT /api/admin/profile` (routers/admin.py). While off, the HTTP
+middleware and the websocket handler only check `profiler.enabled`.
+
+While on:
+
+- Every HTTP request and inbound websocket frame is timed as an
+  operation. A fraction of them (`settings.profile_sample_rate`) are
+  sampled.
+- A daemon thread reads the event loop thread's stack every
+  `settings.profile_interval_ms` milliseconds while any operation is in
+  flight. The event loop runs one task at a time, so each stack shows
+  exactly which handler held the loop. Stacks taken while a sampled
+  operation is in flight are added to an aggregate in folded-stack format
+  (`frame;frame;frame count`), which flamegraph.pl or speedscope render
+  directly.
+- Any operation slower than `settings.profile_slow_ms` is kept, with the
+  stacks seen while it ran, in a ring of the most recent
+  `settings.profile_max_slow` captures.
+"""
+
+import logging
+import os
+import random
+import sys
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from itertools import count
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import metrics
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Distinct stacks kept in the aggregate and per operation; the rest fold into OTHER
+MAX_STACKS = 10000
+MAX_OP_STACKS = 50
+MAX_DEPTH = 64
+OTHER = "[other]"
+
+
+class Operation:
+    __slots__ = ("kind", "name", "sampled", "started", "stacks")
+
+    def __init__(self, kind: str, name: str, sampled: bool):
+        self.kind = kind
+        self.name = name
+        self.sampled = sampled
+        self.started = perf_counter()
+        self.stacks: Counter = Counter()
+
+
+def folded_stack(frame) -> str:
+    """`file:function;...` from the outermost frame to `frame`"""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        # co_qualname is Python 3.11+
+        names.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _add(stacks: Counter, stack: str, limit: int):
+    if stack in stacks or len(stacks) < limit:
+        stacks[stack] += 1
+    else:
+        stacks[OTHER] += 1
+
+
+class Profiler:
+    def __init__(self, sample_rate: float, slow_ms: float, interval_ms: float, max_slow: int):
+        self.enabled = False
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.interval_ms = interval_ms
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.slow = deque(maxlen=max_slow)
+        self._inflight: Dict[int, Operation] = {}
+        self._ids = count()
+        self._lock = threading.Lock()
+        self._loop_thread: Optional[int] = None
+        self._stop: Optional[threading.Event] = None
+
+    def enable(self):
+        """Start profiling; call from the event loop thread"""
+        if self.enabled:
+            return
+        self._loop_thread = threading.get_ident()
+        self._stop = threading.Event()
+        threading.Thread(target=self._sample_loop, args=(self._stop,), name="profiler", daemon=True).start()
+        self.enabled = True
+        logger.info("Profiling enabled", extra={"sample_rate": self.sample_rate, "slow_ms": self.slow_ms})
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        with self._lock:
+            self._inflight.clear()
+        logger.info("Profiling disabled")
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.slow.clear()
+
+    # Operations
+
+    def start(self, kind: str, name: str) -> Optional[int]:
+        """Begin timing an operation; None (and nothing else) while disabled"""
+        if not self.enabled:
+            return None
+        op_id = next(self._ids)
+        operation = Operation(kind, name, random.random() < self.sample_rate)
+        with self._lock:
+            self._inflight[op_id] = operation
+        return op_id
+
+    def finish(self, op_id: Optional[int], name: Optional[str] = None):
+        """End an operation started with start(); `name` replaces the one it started with"""
+        if op_id is None:
+            return
+        with self._lock:
+            operation = self._inflight.pop(op_id, None)
+        if operation is None:
+            return  # Profiling was switched off meanwhile
+        duration_ms = (perf_counter() - operation.started) * 1000
+        operations.inc(1, operation.kind, "sampled" if operation.sampled else "timed")
+        if duration_ms >= self.slow_ms:
+            slow_operations.inc(1, operation.kind)
+            self.slow.append({
+                "kind": operation.kind,
+                "name": name or operation.name,
+                "duration_ms": round(duration_ms, 1),
+                "at": datetime.utcnow().isoformat(),
+                "stacks": [
+                    {"stack": stack, "samples": samples}
+                    for stack, samples in operation.stacks.most_common(5)
+                ],
+            })
+
+    # Sampling thread
+
+    def _sample_loop(self, stop: threading.Event):
+        interval = self.interval_ms / 1000
+        while not stop.wait(interval):
+            if not self._inflight:
+                continue
+            try:
+                self._sample()
+            except Exception:
+                # A dead sampler would leave profiling "enabled" with no samples
+                logger.exception("Profiler sample failed")
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = folded_stack(frame)
+        with self._lock:
+            sampled = False
+            for operation in self._inflight.values():
+                _add(operation.stacks, stack, MAX_OP_STACKS)
+                sampled = sampled or operation.sampled
+            if sampled:
+                _add(self.stacks, stack, MAX_STACKS)
+                self.samples += 1
+
+    # Reports
+
+    def folded(self) -> str:
+        """Aggregate stacks, one `stack count` line each, heaviest first"""
+        with self._lock:
+            return "".join(f"{stack} {samples}\n" for stack, samples in self.stacks.most_common())
+
+    def slow_captures(self) -> List[dict]:
+        """Most recent slow operations, newest first"""
+        return list(reversed(self.slow))
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "interval_ms": self.interval_ms,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+            "slow_captures": len(self.slow),
+            "in_flight": len(self._inflight),
+        }
+
+
+class ProfilingMiddleware:
+    """Times HTTP requests for the profiler; websocket frames are timed in routers/websocket.py"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not profiler.enabled or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        op_id = profiler.start("http", f"{scope['method']} {scope['path']}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Routing has filled in the endpoint by now; name by handler, not by path with ids in it
+            endpoint = scope.get("endpoint")
+            profiler.finish(op_id, f"{scope['method']} {endpoint.__name__}" if endpoint else None)
+
+
+operations = metrics.Counter(
+    "chat_profile_operations_total",
+    "Operations timed while profiling was on, by whether their stacks went into the aggregate",
+    ("kind", "mode"),
+)
+slow_operations = metrics.Counter(
+    "chat_profile_slow_operations_total",
+    "Operations slower than the profiling threshold",
+    ("kind",),
+)
+
+# Global profiler instance
+profiler = Profiler(
+    settings.profile_sample_rate, settings.profile_slow_ms, settings.profile_interval_ms, settings.profile_max_slow
+)
@@ -0,0 +1,323 @@
+"""
+Durable push notification outbox.
+
+Handlers don't send pushes themselves. They insert `push_outbox` rows in
+the same transaction as the message (or membership change) that causes
+them, one row per recipient with at least one subscription, and call
+`push_outbox.wake()` after committing. A push is therefore queued exactly
+when its message is stored, and survives restarts.
+
+The background task started in main.py drains the outbox in batches:
+
+1. Claim up to `settings.push_batch_size` due rows with one UPDATE ...
+   RETURNING that also moves `available_at` out by
+   `settings.push_claim_timeout`, so rows claimed by a worker that died
+   are picked up again later.
+2. Load the subscriptions of every recipient in the batch in one query
+   and group the notifications by endpoint. Each endpoint gets its
+   notifications in order, in a worker thread (pywebpush blocks), with
+   `settings.push_send_concurrency` endpoints at a time.
+3. Settle the batch in one transaction: delete rows delivered to at least
+   one endpoint (or whose recipient has no subscription left), reschedule
+   the rest with exponential backoff, mark rows past
+   `settings.push_max_attempts` failed, and delete subscriptions the push
+   service reported gone (404/410).
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from config import settings
+from database import SessionLocal
+from loop_monitor import DEFER_PUSH, loop_monitor, shed_work
+
+logger = logging.getLogger(__name__)
+
+ENQUEUE = """
+    INSERT INTO push_outbox (user_id, message_id, title, body, data, status, attempts, available_at, created_at)
+    SELECT DISTINCT s.user_id, :message_id, :title, :body, :data, 'pending', 0, :now, :now
+    FROM push_subscriptions s
+    {where}
+"""
+ENQUEUE_TO_USERS = text(ENQUEUE.format(where="WHERE s.user_id IN :user_ids")).bindparams(
+    bindparam("user_ids", expanding=True), bindparam("now", type_=DateTime)
+)
+ENQUEUE_TO_ALL_EXCEPT = text(ENQUEUE.format(where="WHERE s.user_id != :user_id")).bindparams(
+    bindparam("now", type_=DateTime)
+)
+
+# Oldest due rows first, via ix_push_outbox_status_available_at
+CLAIM = text("""
+    UPDATE push_outbox
+    SET attempts = attempts + 1, available_at = :lease_until
+    WHERE id IN (
+        SELECT id FROM push_outbox
+        WHERE status = 'pending' AND available_at <= :now
+        ORDER BY available_at, id
+        LIMIT :limit
+    )
+    RETURNING id, user_id, title, body, data, attempts
+""").bindparams(bindparam("now", type_=DateTime), bindparam("lease_until", type_=DateTime))
+
+SUBSCRIPTIONS = text("""
+    SELECT user_id, endpoint, p256dh, auth
+    FROM push_subscriptions
+    WHERE user_id IN :user_ids
+""").bindparams(bindparam("user_ids", expanding=True))
+
+DELETE_DONE = text("DELETE FROM push_outbox WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+MARK_FAILED = text("UPDATE push_outbox SET status = 'failed' WHERE id IN :ids").bindparams(
+    bindparam("ids", expanding=True)
+)
+RESCHEDULE = text("UPDATE push_outbox SET available_at = :available_at WHERE id = :id").bindparams(
+    bindparam("available_at", type_=DateTime)
+)
+DELETE_GONE = text("DELETE FROM push_subscriptions WHERE endpoint IN :endpoints").bindparams(
+    bindparam("endpoints", expanding=True)
+)
+PENDING_COUNT = text("SELECT COUNT(*) FROM push_outbox WHERE status = 'pending'")
+
+# Per endpoint and notification
+SENT, GONE, RETRY = "sent", "gone", "retry"
+
+
+def notification_payload(title: str, body: str, data: dict) -> str:
+    return json.dumps({
+        "notification": {
+            "title": title,
+            "body": body,
+            "icon": "/icon-192x192.png",
+            "badge": "/badge-72x72.png",
+            "vibrate": [100, 50, 100],
+            "data": data or {}
+        }
+    })
+
+
+def send_to_endpoint(subscription_info: dict, payloads: List[Tuple[int, str]]) -> Tuple[List[Tuple[int, str]], bool]:
+    """Send `payloads` ((row id, payload), in order) to one endpoint; runs in a worker thread.
+
+    Returns the outcome for each row and whether the endpoint is gone.
+    """
+    # Deferred: pywebpush pulls in requests and its crypto stack
+    from pywebpush import webpush, WebPushException
+
+    outcomes = []
+    for position, (row_id, payload) in enumerate(payloads):
+        started = perf_counter()
+        try:
+            webpush(
+                subscription_info=subscription_info,
+                data=payload,
+                vapid_private_key=settings.vapid_private_key,
+                vapid_claims={"sub": settings.vapid_email},
+                timeout=settings.push_send_timeout
+            )
+        except WebPushException as e:
+            status = e.response.status_code if e.response is not None else None
+            metrics.push_dispatch_seconds.observe(perf_counter() - started, "failed")
+            logger.warning("Push notification failed: %s", e, extra={
+                "status": status,
+                "response": e.response.text if e.response is not None else None
+            })
+            if status in (404, 410):
+                # The rest would fail the same way
+                return outcomes + [(rid, GONE) for rid, _ in payloads[position:]], True
+            outcomes.append((row_id, RETRY))
+        except Exception:
+            metrics.push_dispatch_seconds.observe(perf_counter() - started, "failed")
+            logger.exception("Push notification failed")
+            outcomes.append((row_id, RETRY))
+        else:
+            metrics.push_dispatch_seconds.observe(perf_counter() - started, "sent")
+            outcomes.append((row_id, SENT))
+    return outcomes, False
+
+
+class PushOutbox:
+    def __init__(self):
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def _event(self) -> asyncio.Event:
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        return self._wake
+
+    # Enqueueing: call inside the caller's transaction, then wake() after commit
+
+    def to_users(self, db: Session, user_ids: Iterable[int], title: str, body: str, data: dict,
+                 message_id: Optional[int] = None):
+        user_ids = list(user_ids)
+        if user_ids:
+            self._enqueue(db, ENQUEUE_TO_USERS, {"user_ids": user_ids}, title, body, data, message_id)
+
+    def to_all_except(self, db: Session, user_id: int, title: str, body: str, data: dict,
+                      message_id: Optional[int] = None):
+        self._enqueue(db, ENQUEUE_TO_ALL_EXCEPT, {"user_id": user_id}, title, body, data, message_id)
+
+    @staticmethod
+    def _enqueue(db: Session, statement, params: dict, title: str, body: str, data: dict, message_id: Optional[int]):
+        result = db.execute(statement, {
+            **params,
+            "message_id": message_id,
+            "title": title,
+            "body": body,
+            "data": json.dumps(data or {}),
+            "now": datetime.utcnow()
+        })
+        enqueued.inc(result.rowcount)
+
+    def wake(self):
+        """Have the worker look at the outbox now instead of at its next poll"""
+        self._event.set()
+
+    def resume(self, old_stage: int, new_stage: int):
+        """Loop monitor watcher: send what waited once pushes are no longer deferred"""
+        if new_stage < DEFER_PUSH <= old_stage:
+            self.wake()
+
+    # Draining
+
+    async def process_batch(self) -> int:
+        """Claim, send and settle one batch; returns how many rows were claimed"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            rows = db.execute(CLAIM, {
+                "now": now,
+                "lease_until": now + timedelta(seconds=settings.push_claim_timeout),
+                "limit": settings.push_batch_size
+            }).all()
+            db.commit()
+            if not rows:
+                return 0
+            batch_rows.observe(len(rows))
+
+            payloads_by_user = defaultdict(list)
+            for row in rows:
+                payloads_by_user[row.user_id].append((row.id, notification_payload(row.title, row.body, json.loads(row.data))))
+            # endpoint -> (subscription info, that user's notifications in claim order)
+            endpoints: Dict[str, Tuple[dict, List[Tuple[int, str]]]] = {}
+            for user_id, endpoint, p256dh, auth in db.execute(SUBSCRIPTIONS, {"user_ids": list(payloads_by_user)}):
+                endpoints[endpoint] = ({"endpoint": endpoint, "keys": {"p256dh": p256dh, "auth": auth}}, payloads_by_user[user_id])
+            db.rollback()  # End the read before the slow part
+            logger.debug("Sending %d outbox rows to %d push endpoints", len(rows), len(endpoints))
+
+            limit = asyncio.Semaphore(settings.push_send_concurrency)
+
+            async def send(subscription_info, payloads):
+                async with limit:
+                    return await run_in_threadpool(send_to_endpoint, subscription_info, payloads)
+
+            results = await asyncio.gather(*(send(info, payloads) for info, payloads in endpoints.values()))
+
+            outcomes = defaultdict(set)
+            gone = []
+            for (info, _), (row_outcomes, endpoint_gone) in zip(endpoints.values(), results):
+                if endpoint_gone:
+                    gone.append(info["endpoint"])
+                for row_id, outcome in row_outcomes:
+                    outcomes[row_id].add(outcome)
+            self._settle(db, rows, outcomes, gone)
+            return len(rows)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _settle(db: Session, rows, outcomes: Dict[int, set], gone: List[str]):
+        """Write the batch's results in one transaction"""
+        now = datetime.utcnow()
+        done, failed, retry = [], [], []
+        for row in rows:
+            row_outcomes = outcomes.get(row.id, set())
+            if SENT in row_outcomes or RETRY not in row_outcomes:
+                # Delivered somewhere, or no endpoint left to deliver to
+                done.append(row.id)
+                settled.inc(1, "sent" if SENT in row_outcomes else "no_subscription")
+            elif row.attempts >= settings.push_max_attempts:
+                failed.append(row.id)
+                settled.inc(1, "failed")
+            else:
+                delay = settings.push_retry_delay * 2 ** (row.attempts - 1)
+                retry.append({"id": row.id, "available_at": now + timedelta(seconds=delay)})
+                settled.inc(1, "retry")
+        if done:
+            db.execute(DELETE_DONE, {"ids": done})
+        if failed:
+            db.execute(MARK_FAILED, {"ids": failed})
+        if retry:
+            db.execute(RESCHEDULE, retry)
+        if gone:
+            db.execute(DELETE_GONE, {"endpoints": gone})
+            logger.info("Removed %d expired push subscriptions", len(gone))
+        with metrics.db_commit_seconds.time():
+            db.commit()
+
+    async def drain(self):
+        """Process batches until no due rows are left"""
+        while await self.process_batch() >= settings.push_batch_size:
+            pass
+
+    async def flush(self, timeout: float) -> int:
+        """Send what is due within `timeout` seconds; returns how many rows are still pending"""
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except Exception:
+            logger.exception("Push outbox flush failed")
+        db = SessionLocal()
+        try:
+            return db.execute(PENDING_COUNT).scalar()
+        finally:
+            db.close()
+
+    async def run(self, interval: float):
+        """Background task: drain the outbox when woken, and every `interval` seconds"""
+        # A fresh event per run: one left from an earlier lifespan is bound to that loop
+        event = self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(event.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+            if loop_monitor.sheds(DEFER_PUSH):
+                # Rows wait in the outbox; woken again when shedding stops
+                shed_work.inc(1, "push_batch")
+                continue
+            try:
+                await self.drain()
+            except Exception:
+                logger.exception("Push outbox batch failed")
+
+
+enqueued = metrics.Counter(
+    "chat_push_outbox_enqueued_total",
+    "Push notifications written to the outbox",
+)
+settled = metrics.Counter(
+    "chat_push_outbox_settled_total",
+    "Claimed outbox rows, by what became of them",
+    ("outcome",),
+)
+batch_rows = metrics.Histogram(
+    "chat_push_outbox_batch_rows",
+    "Outbox rows claimed per batch",
+    buckets=metrics.DEPTH_BUCKETS,
+)
+
+# Global push outbox instance
+push_outbox = PushOutbox()
+loop_monitor.watch(push_outbox.resume)
@@ -0,0 +1,184 @@
+"""
+SQL query accounting: per-request query counts, slow-query log and query budgets.
+
+database.py hooks `before_cursor_execute` and `after_cursor_execute` on the
+engine. Every statement is timed. The time goes to:
+
+- the request in flight, when it was issued under `QueryCountingMiddleware`.
+  Once the request finishes, its query count and total database time are
+  recorded by endpoint (`chat_db_queries_per_request`,
+  `chat_db_request_seconds`) and sent back in a `Server-Timing` header. A
+  request issuing more than `settings.request_query_warn` queries is
+  logged, which is how an N+1 loop shows up;
+- any open `query_budget()`;
+- the slow-query log, when the statement took at least
+  `settings.slow_query_ms`. The log has the statement (never its
+  parameters), its duration and, with `settings.slow_query_explain`, the
+  database's plan for it.
+
+`query_budget()` is for tests and benchmark scripts. It counts what runs
+on the engine from any thread and raises `QueryBudgetExceeded` when a
+block of code issues more statements than allowed:
+
+    with query_budget(3, "GET /api/groups/"):
+        client.get("/api/groups/", headers=headers)
+
+benchmarks/query_budget.py runs the endpoints that have had N+1 loops
+under a fixed budget.
+"""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import List, Optional
+
+import metrics
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Statements EXPLAIN makes sense for; DDL, PRAGMA and transaction control are skipped
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "statements", "keep_statements")
+
+    def __init__(self, keep_statements: bool = False):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: List[str] = []
+        self.keep_statements = keep_statements
+
+    def add(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        if self.keep_statements:
+            self.statements.append(statement)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+# The request being served in this context, if any
+_request: ContextVar[Optional[QueryStats]] = ContextVar("request_queries", default=None)
+# Open query_budget() blocks
+_budgets: List[QueryStats] = []
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, not the connection: a statement that raises never reaches
+    # after_cursor_execute, and its start time must not outlive it on a pooled connection
+    context._query_started = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = perf_counter() - context._query_started
+    queries.inc(1)
+    stats = _request.get()
+    if stats is not None:
+        stats.add(statement, seconds)
+    for budget in _budgets:
+        budget.add(statement, seconds)
+    if seconds * 1000 >= settings.slow_query_ms:
+        log_slow_query(cursor, statement, parameters, executemany, seconds)
+
+
+def log_slow_query(cursor, statement: str, parameters, executemany: bool, seconds: float):
+    slow_queries.inc(1)
+    plan = None
+    if settings.slow_query_explain and not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+        plan = explain(cursor, statement, parameters)
+    logger.warning(
+        "Slow query (%.0f ms): %s%s", seconds * 1000, " ".join(statement.split()),
+        f" -- plan: {'; '.join(plan)}" if plan else "",
+        extra={"duration_ms": round(seconds * 1000, 1), "plan": plan}
+    )
+
+
+def explain(cursor, statement: str, parameters) -> Optional[List[str]]:
+    """Plan for a statement that just ran, from a fresh cursor on the same DBAPI connection"""
+    prefix = "EXPLAIN QUERY PLAN " if type(cursor).__module__.startswith("sqlite3") else "EXPLAIN "
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters or ())
+        # SQLite: (id, parent, notused, detail); other databases: one text column
+        return [str(row[-1]) for row in explain_cursor.fetchall()]
+    except Exception:
+        logger.debug("EXPLAIN failed for slow query", exc_info=True)
+        return None
+    finally:
+        explain_cursor.close()
+
+
+@contextmanager
+def query_budget(max_queries: int, label: str = "block"):
+    """Raise QueryBudgetExceeded, listing the statements, if the block issues more than `max_queries`"""
+    stats = QueryStats(keep_statements=True)
+    _budgets.append(stats)
+    try:
+        yield stats
+    finally:
+        _budgets.remove(stats)
+    if stats.count > max_queries:
+        listing = "\n".join(f"  {i}. {' '.join(s.split())}" for i, s in enumerate(stats.statements, 1))
+        raise QueryBudgetExceeded(f"{label} issued {stats.count} queries, budget is {max_queries}:\n{listing}")
+
+
+class QueryCountingMiddleware:
+    """Counts queries and database time per HTTP request; websocket connections pass through"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = QueryStats()
+        token = _request.set(stats)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((
+                    b"server-timing",
+                    f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"'.encode()
+                ))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request.reset(token)
+            # Routing has filled in the endpoint by now; label by handler, not by path with ids in it
+            endpoint = scope.get("endpoint")
+            name = f"{scope['method']} {endpoint.__name__}" if endpoint else "unmatched"
+            request_queries.observe(stats.count, name)
+            request_seconds.observe(stats.seconds, name)
+            if stats.count > settings.request_query_warn:
+                logger.warning(
+                    "%s issued %d queries (%.0f ms in the database)", name, stats.count, stats.seconds * 1000,
+                    extra={"path": scope["path"], "queries": stats.count}
+                )
+
+
+queries = metrics.Counter(
+    "chat_db_queries_total",
+    "SQL statements executed",
+)
+slow_queries = metrics.Counter(
+    "chat_db_slow_queries_total",
+    "SQL statements slower than the slow-query threshold",
+)
+request_queries = metrics.Histogram(
+    "chat_db_queries_per_request",
+    "SQL statements issued per HTTP request, by endpoint",
+    ("endpoint",),
+    buckets=metrics.DEPTH_BUCKETS,
+)
+request_seconds = metrics.Histogram(
+    "chat_db_request_seconds",
+    "Time spent executing SQL per HTTP request, by endpoint",
+    ("endpoint",),
+)
@@ -0,0 +1,69 @@
+"""
+Token-bucket rate limiting for inbound websocket frames.
+
+Each connection owns a `TokenBucket`; `user_rate_limiter` additionally
+holds one bucket per username so a client can't multiply its budget by
+opening several sockets. Checks are a few float operations and run before
+a frame is parsed.
+"""
+
+from time import monotonic
+from typing import Dict, Hashable, Optional
+
+from config import settings
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic() if now is None else now
+
+    def take(self, now: Optional[float] = None) -> bool:
+        """Spend one token if available"""
+        now = monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class KeyedRateLimiter:
+    """One token bucket per key, created on first use"""
+
+    MIN_PRUNE_AT = 1024
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._prune_at = self.MIN_PRUNE_AT
+
+    def take(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune(now)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        return bucket.take(now)
+
+    def _prune(self, now: float):
+        # A bucket that has refilled is indistinguishable from a new one
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.is_full(now)}
+        self._prune_at = max(self.MIN_PRUNE_AT, 2 * len(self._buckets))
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Shared across all of a user's connections
+user_rate_limiter = KeyedRateLimiter(settings.ws_rate_per_user, settings.ws_burst_per_user)
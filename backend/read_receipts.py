@@ -0,0 +1,177 @@
+"""
+Read receipts and per-room read cursors.
+
+Clients report the newest message they have read with a websocket "read"
+frame. `ReadReceiptBuffer.record()` only advances an in-memory high-water
+mark per (user, room). Every `settings.read_flush_interval` seconds the
+background task started in main.py writes all pending cursors in one
+batched upsert and then notifies readers' peers:
+
+- private rooms: the other participant gets one "read" frame per reader
+  and batch;
+- groups: the group's topic (its online members) gets one "read_counts"
+  frame per batch, giving for each newly reached message how many
+  members have read at least that far.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy import bindparam, func, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+import metrics
+from database import SessionLocal
+from group_cache import group_cache
+from models import ReadCursor
+from room_access import private_recipient
+from websocket_manager import manager
+from wire import Frame
+
+logger = logging.getLogger(__name__)
+
+read_cursors = ReadCursor.__table__
+
+GROUP_CURSORS_QUERY = text("""
+    SELECT room, user_id, last_read_message_id
+    FROM read_cursors
+    WHERE room IN :rooms
+""").bindparams(bindparam("rooms", expanding=True))
+
+
+class ReadReceiptBuffer:
+    def __init__(self):
+        # (user_id, room) -> (newest message id read, username)
+        self._pending: Dict[Tuple[int, str], Tuple[int, str]] = {}
+
+    def record(self, user_id: int, username: str, room: str, message_id: int):
+        key = (user_id, room)
+        receipts.inc(1, "coalesced" if key in self._pending else "new")
+        self._advance(key, message_id, username)
+
+    def _advance(self, key: Tuple[int, str], message_id: int, username: str):
+        current = self._pending.get(key)
+        if current is None or message_id > current[0]:
+            self._pending[key] = (message_id, username)
+
+    def pending_for(self, user_id: int) -> Dict[str, int]:
+        """Unflushed cursors for one user, by room"""
+        return {room: message_id for (uid, room), (message_id, _) in self._pending.items() if uid == user_id}
+
+    async def flush(self) -> int:
+        """Write pending cursors in one upsert and notify peers; returns rows written"""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            stmt = insert(read_cursors)
+            db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[read_cursors.c.user_id, read_cursors.c.room],
+                    set_={
+                        # Cursors only move forward, even if receipts arrive out of order
+                        "last_read_message_id": func.max(
+                            read_cursors.c.last_read_message_id, stmt.excluded.last_read_message_id
+                        ),
+                        "updated_at": stmt.excluded.updated_at
+                    }
+                ),
+                [
+                    {"user_id": user_id, "room": room, "last_read_message_id": message_id, "updated_at": now}
+                    for (user_id, room), (message_id, _) in batch.items()
+                ]
+            )
+            with metrics.db_commit_seconds.time():
+                db.commit()
+            personal, published = self._notifications(db, batch)
+        except SQLAlchemyError:
+            logger.exception("Failed to flush %d read cursors", len(batch))
+            db.rollback()
+            # Keep them for the next flush
+            for key, (message_id, username) in batch.items():
+                self._advance(key, message_id, username)
+            return 0
+        finally:
+            db.close()
+
+        flush_rows.observe(len(batch))
+        for username, frame in personal:
+            await manager.send_personal_message(frame, username)
+        for topic, frame in published:
+            await manager.publish(topic, frame)
+        return len(batch)
+
+    @staticmethod
+    def _notifications(db: Session, batch) -> Tuple[List[Tuple[str, Frame]], List[Tuple[str, Frame]]]:
+        """Frames for a flushed batch: (username, frame) pairs and (group topic, frame) pairs"""
+        notifications, published = [], []
+        reached: Dict[str, set] = defaultdict(set)
+        for (user_id, room), (message_id, username) in batch.items():
+            if room.startswith("private_"):
+                peer = private_recipient(room, username, username)
+                notifications.append((peer, Frame({
+                    "type": "read",
+                    "room": room,
+                    "reader": username,
+                    "message_id": message_id
+                })))
+            elif room.startswith("group_"):
+                reached[room].add(message_id)
+        if not reached:
+            return notifications, published
+
+        # One query for every group touched in this batch
+        cursors = defaultdict(list)
+        for room, user_id, last_read in db.execute(GROUP_CURSORS_QUERY, {"rooms": list(reached)}):
+            cursors[room].append((user_id, last_read))
+        for room, message_ids in reached.items():
+            group = group_cache.get(db, int(room[len("group_"):]))
+            if not group:
+                continue
+            member_reads = [last_read for user_id, last_read in cursors[room] if user_id in group.member_ids]
+            counts = [
+                [message_id, sum(1 for last_read in member_reads if last_read >= message_id)]
+                for message_id in sorted(message_ids)
+            ]
+            published.append((room, Frame({
+                "type": "read_counts",
+                "group_id": group.group_id,
+                "counts": counts
+            })))
+        return notifications, published
+
+    async def run(self, interval: float):
+        """Background task: flush pending cursors every `interval` seconds"""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("Read cursor flush failed")
+        finally:
+            # Shutdown: don't drop receipts still in memory
+            await self.flush()
+
+
+receipts = metrics.Counter(
+    "chat_read_receipts_total",
+    "Inbound read receipts, by whether they merged into a pending cursor",
+    ("outcome",),
+)
+flush_rows = metrics.Histogram(
+    "chat_read_flush_rows",
+    "Read cursors written per batch",
+    buckets=metrics.DEPTH_BUCKETS,
+)
+
+# Global read receipt buffer instance
+read_buffer = ReadReceiptBuffer()
@@ -0,0 +1,191 @@
+"""
+Message retention and archive tiering.
+
+`messages` holds the hot window. Every `settings.retention_interval`
+seconds the background task started in main.py moves messages older than
+their room's retention into `archived_messages`, at most
+`settings.retention_batch_size` rows per transaction so no single write
+holds the database for long.
+
+Retention is `settings.retention_days` for every room unless
+`retention_policies` has a row for it; 0 keeps messages forever. Archived
+rows keep their ids, so history pages by id across both tables:
+`room_history()` reads the hot table and only falls through to the archive
+when a page reaches past the oldest hot message.
+
+Archived messages leave the search index (its triggers follow deletes from
+`messages`) and are not replayed by /api/sync or on reconnect.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from itertools import takewhile
+from typing import Dict, List, Optional
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+import metrics
+from config import settings
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Larger than any message id
+MAX_ID = 2 ** 63 - 1
+
+HISTORY_QUERY = """
+    SELECT m.id, m.content, m.sender_id, m.room, m.group_id, m.timestamp, u.username
+    FROM {table} m
+    JOIN users u ON m.sender_id = u.id
+    WHERE m.room = :room AND m.id < :before
+    ORDER BY m.id DESC
+    LIMIT :limit
+"""
+HOT_HISTORY = text(HISTORY_QUERY.format(table="messages")).columns(timestamp=DateTime)
+ARCHIVED_HISTORY = text(HISTORY_QUERY.format(table="archived_messages")).columns(timestamp=DateTime)
+
+POLICIES_QUERY = text("SELECT room, days FROM retention_policies")
+
+# Oldest messages of one room, via ix_messages_room_id
+ROOM_HEAD = text("""
+    SELECT id, timestamp FROM messages
+    WHERE room = :room
+    ORDER BY id
+    LIMIT :limit
+""").columns(timestamp=DateTime)
+
+# Oldest messages of every room past a cursor, via the primary key
+OLDEST_AFTER = text("""
+    SELECT id, room, timestamp FROM messages
+    WHERE id > :after
+    ORDER BY id
+    LIMIT :limit
+""").columns(timestamp=DateTime)
+
+COPY_TO_ARCHIVE = text("""
+    INSERT INTO archived_messages (id, content, sender_id, room, group_id, timestamp, archived_at)
+    SELECT id, content, sender_id, room, group_id, timestamp, :now
+    FROM messages
+    WHERE id IN :ids
+""").bindparams(bindparam("ids", expanding=True), bindparam("now", type_=DateTime))
+
+DELETE_HOT = text("DELETE FROM messages WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+
+
+def room_history(db: Session, room: str, limit: Optional[int], before_id: Optional[int] = None) -> list:
+    """Messages of a room with id < before_id, newest first; every one of them if limit is None"""
+    params = {"room": room, "before": before_id or MAX_ID, "limit": -1 if limit is None else limit}
+    rows = db.execute(HOT_HISTORY, params).fetchall()
+    if limit is not None and len(rows) == limit:
+        return rows
+
+    # The page reaches past the oldest hot message
+    if rows:
+        params["before"] = rows[-1].id
+    if limit is not None:
+        params["limit"] = limit - len(rows)
+    archived = db.execute(ARCHIVED_HISTORY, params).fetchall()
+    if archived:
+        archive_reads.inc()
+    return rows + archived
+
+
+class MessageArchiver:
+    def __init__(self, default_days: int, batch_size: int):
+        self.default_days = default_days
+        self.batch_size = batch_size
+        self._policies: Optional[Dict[str, int]] = None
+        # Messages up to this id in rooms without a policy have been checked
+        self._default_after = 0
+
+    async def archive_pass(self, now: Optional[datetime] = None) -> int:
+        """Archive everything past its room's retention; returns messages moved"""
+        now = now or datetime.utcnow()
+        db = SessionLocal()
+        try:
+            policies = dict(db.execute(POLICIES_QUERY).fetchall())
+            if policies != self._policies:
+                # A room may have fallen back to the default
+                self._policies, self._default_after = policies, 0
+
+            moved = 0
+            for room, days in policies.items():
+                if days:
+                    moved += await self._archive_room(db, room, now - timedelta(days=days))
+            if self.default_days:
+                moved += await self._archive_default(db, now - timedelta(days=self.default_days))
+            return moved
+        finally:
+            db.close()
+
+    async def _archive_room(self, db: Session, room: str, cutoff: datetime) -> int:
+        moved = 0
+        while True:
+            rows = db.execute(ROOM_HEAD, {"room": room, "limit": self.batch_size}).fetchall()
+            ids = [row.id for row in takewhile(lambda row: _older(row, cutoff), rows)]
+            moved += self._move(db, ids)
+            if len(ids) < self.batch_size:
+                return moved
+            await asyncio.sleep(0)
+
+    async def _archive_default(self, db: Session, cutoff: datetime) -> int:
+        moved = 0
+        while True:
+            rows = db.execute(OLDEST_AFTER, {"after": self._default_after, "limit": self.batch_size}).fetchall()
+            old = list(takewhile(lambda row: _older(row, cutoff), rows))
+            moved += self._move(db, [row.id for row in old if row.room not in self._policies])
+            if old:
+                self._default_after = old[-1].id
+            if len(old) < self.batch_size:
+                return moved
+            await asyncio.sleep(0)
+
+    @staticmethod
+    def _move(db: Session, ids: List[int]) -> int:
+        if not ids:
+            return 0
+        try:
+            with batch_seconds.time():
+                db.execute(COPY_TO_ARCHIVE, {"ids": ids, "now": datetime.utcnow()})
+                db.execute(DELETE_HOT, {"ids": ids})
+                db.commit()
+        except SQLAlchemyError:
+            db.rollback()
+            raise
+        archived.inc(len(ids))
+        return len(ids)
+
+    async def run(self, interval: float):
+        """Background task: run an archiving pass every `interval` seconds"""
+        while True:
+            try:
+                moved = await self.archive_pass()
+                if moved:
+                    logger.info("Archived messages", extra={"count": moved})
+            except Exception:
+                logger.exception("Message archiving pass failed")
+            await asyncio.sleep(interval)
+
+
+def _older(row, cutoff: datetime) -> bool:
+    return row.timestamp is not None and row.timestamp < cutoff
+
+
+archived = metrics.Counter(
+    "chat_messages_archived_total",
+    "Messages moved from the hot table to the archive",
+)
+archive_reads = metrics.Counter(
+    "chat_archive_reads_total",
+    "History pages that read through to the archive",
+)
+batch_seconds = metrics.Histogram(
+    "chat_archive_batch_seconds",
+    "Time to copy and delete one archiving batch",
+)
+
+# Global archiver instance
+message_archiver = MessageArchiver(settings.retention_days, settings.retention_batch_size)
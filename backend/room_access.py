@@ -0,0 +1,66 @@
+"""
+Helpers for deciding which rooms a user can read.
+
+Rooms are stored as strings on `messages.room`: "general", "group_<id>"
+and "private_<min>_<max>" for direct messages between two usernames.
+"""
+
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# SQL predicate over a `messages m` row; bind with readable_room_params().
+# Private rooms come from the caller's rows in the conversations index.
+READABLE_ROOM_FILTER = """(
+    m.room = 'general'
+    OR m.group_id IN (SELECT group_id FROM group_membership WHERE user_id = :user_id)
+    OR m.room IN (SELECT room FROM conversations WHERE user_id = :user_id)
+)"""
+
+# READABLE_ROOM_FILTER over a room rather than a stored message
+READABLE_ROOM = text(f"""
+    SELECT 1 FROM (SELECT :room AS room, :group_id AS group_id) m
+    WHERE {READABLE_ROOM_FILTER}
+""")
+
+
+USER_GROUP_ROOMS = text("""
+    SELECT 'group_' || gm.group_id
+    FROM group_membership gm
+    JOIN users u ON u.id = gm.user_id
+    WHERE u.username = :username
+""")
+
+
+def group_rooms(db: Session, username: str) -> List[str]:
+    """Rooms of every group `username` belongs to; their websocket topics"""
+    return list(db.execute(USER_GROUP_ROOMS, {"username": username}).scalars())
+
+
+def private_room_name(user_a: str, user_b: str) -> str:
+    """Consistent room name for a private conversation"""
+    return f"private_{min(user_a, user_b)}_{max(user_a, user_b)}"
+
+
+def readable_room_params(user_id: int) -> dict:
+    """Bind parameters for READABLE_ROOM_FILTER"""
+    return {"user_id": user_id}
+
+
+def can_read_room(db: Session, user_id: int, room: str) -> bool:
+    """Whether READABLE_ROOM_FILTER lets the user read messages of `room`"""
+    suffix = room[len("group_"):] if room.startswith("group_") else ""
+    group_id: Optional[int] = int(suffix) if suffix.isdigit() else None
+    params = {"room": room, "group_id": group_id, **readable_room_params(user_id)}
+    return db.execute(READABLE_ROOM, params).first() is not None
+
+
+def private_recipient(room: str, sender: str, username: str) -> str:
+    """Recipient of a message in one of `username`'s private rooms"""
+    private_prefix = f"private_{username}_"
+    if room.startswith(private_prefix):
+        other = room[len(private_prefix):]
+    else:
+        other = room[len("private_"):-len(f"_{username}")]
+    return other if sender == username else username
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from typing import List
+
+from models import User
+from schemas import ProfilerUpdate, ProfilerStatus, SlowCapture
+from auth import get_admin_user
+from profiling import profiler
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+@router.get("/profile", response_model=ProfilerStatus)
+async def get_profiler_status(admin: User = Depends(get_admin_user)):
+    """Profiler settings and how much it has collected"""
+    return profiler.status()
+
+@router.put("/profile", response_model=ProfilerStatus)
+async def update_profiler(update: ProfilerUpdate, admin: User = Depends(get_admin_user)):
+    """Switch profiling on or off and adjust sampling; takes effect for new operations"""
+    if update.sample_rate is not None:
+        profiler.sample_rate = update.sample_rate
+    if update.slow_ms is not None:
+        profiler.slow_ms = update.slow_ms
+    if update.enabled is True:
+        profiler.enable()
+    elif update.enabled is False:
+        profiler.disable()
+    return profiler.status()
+
+@router.delete("/profile", response_model=ProfilerStatus)
+async def reset_profiler(admin: User = Depends(get_admin_user)):
+    """Drop the aggregated stacks and slow captures"""
+    profiler.reset()
+    return profiler.status()
+
+@router.get("/profile/flamegraph", response_class=PlainTextResponse)
+async def get_flamegraph(admin: User = Depends(get_admin_user)):
+    """Aggregated stacks in folded format (`frame;frame;frame samples` per line) for flamegraph.pl or speedscope"""
+    return PlainTextResponse(profiler.folded())
+
+@router.get("/profile/slow", response_model=List[SlowCapture])
+async def get_slow_operations(admin: User = Depends(get_admin_user)):
+    """Recent requests and websocket frames over the slow threshold, newest first, with their top stacks"""
+    return profiler.slow_captures()
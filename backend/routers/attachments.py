@@ -0,0 +1,252 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from typing import Optional, Tuple
+import anyio
+import logging
+import os
+import uuid
+
+import metrics
+from database import get_db
+from models import User, Attachment, AttachmentUpload
+from schemas import UploadCreate, UploadResponse, AttachmentSummary
+from auth import get_current_user
+from config import settings
+from attachments import attachment_store, can_read, make_thumbnail, purge_stale_uploads, summary
+
+router = APIRouter(prefix="/api/attachments", tags=["attachments"])
+logger = logging.getLogger(__name__)
+
+RANGE_CHUNK_BYTES = 64 * 1024
+# Served inline; anything else downloads, so uploaded HTML never renders on our origin
+INLINE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "video/mp4", "audio/mpeg", "application/pdf"}
+
+# Move an upload's offset from one value to another; matches no row if another request moved it first
+MOVE_OFFSET = text("UPDATE attachment_uploads SET received = :to WHERE id = :id AND received = :expected")
+
+uploaded_bytes = metrics.Counter(
+    "chat_attachment_upload_bytes_total",
+    "Attachment bytes received",
+)
+attachments_stored = metrics.Counter(
+    "chat_attachments_total",
+    "Completed uploads, by whether an identical file was already stored",
+    ("outcome",),
+)
+
+def upload_response(upload: AttachmentUpload, attachment: Optional[Attachment] = None) -> UploadResponse:
+    return UploadResponse(
+        upload_id=upload.id,
+        offset=upload.received,
+        size=upload.size,
+        chunk_bytes=settings.attachment_chunk_bytes,
+        attachment=AttachmentSummary(**summary(attachment)) if attachment else None
+    )
+
+def get_own_upload(db: Session, upload_id: str, user: User) -> AttachmentUpload:
+    upload = db.get(AttachmentUpload, upload_id)
+    if not upload or upload.uploader_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found"
+        )
+    return upload
+
+@router.post("/uploads", response_model=UploadResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    request: UploadCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Start an upload; send the file with PUT /uploads/{upload_id}?offset= in chunks"""
+    purge_stale_uploads(db, attachment_store)
+    upload = AttachmentUpload(
+        id=uuid.uuid4().hex,
+        uploader_id=current_user.id,
+        filename=os.path.basename(request.filename),
+        content_type=request.content_type,
+        size=request.size
+    )
+    db.add(upload)
+    db.commit()
+    return upload_response(upload)
+
+@router.get("/uploads/{upload_id}", response_model=UploadResponse)
+async def get_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Where to resume an interrupted upload"""
+    return upload_response(get_own_upload(db, upload_id, current_user))
+
+@router.put("/uploads/{upload_id}", response_model=UploadResponse)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Write the request body at `offset`; the chunk that completes the file returns the attachment
+
+    The chunk's range is claimed by moving the upload's offset past it before
+    any byte is written, so of two requests for the same offset only one writes.
+    """
+    upload = get_own_upload(db, upload_id, current_user)
+    length = request.headers.get("content-length")
+    if length is None or not length.isdigit() or int(length) > settings.attachment_chunk_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Send chunks of at most {settings.attachment_chunk_bytes} bytes with a Content-Length"
+        )
+    end = offset + int(length)
+    if end > upload.size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="upload is larger than declared"
+        )
+
+    claimed = db.execute(MOVE_OFFSET, {"id": upload.id, "expected": offset, "to": end}).rowcount
+    db.commit()
+    if not claimed:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload is at offset {upload.received}"
+        )
+    try:
+        written = await attachment_store.write(upload.id, offset, end, request.stream())
+    except Exception as e:
+        # Hand the range back so the chunk can be sent again
+        db.execute(MOVE_OFFSET, {"id": upload.id, "expected": end, "to": offset})
+        db.commit()
+        if isinstance(e, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        raise
+    if written < end:
+        # Bytes before `offset` are missing from the part file; resume from where it ends
+        db.execute(MOVE_OFFSET, {"id": upload.id, "expected": end, "to": written})
+        db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload is at offset {written}"
+        )
+    uploaded_bytes.inc(end - offset)
+    if end < upload.size:
+        return upload_response(upload)
+
+    # Last chunk: hash, dedup into the blob store and create the attachment
+    sha256 = await run_in_threadpool(attachment_store.finish, upload)
+    existing = db.query(Attachment).filter(Attachment.sha256 == sha256).first()
+    if existing:
+        thumbnail = existing.thumbnail
+        attachments_stored.inc(1, "deduplicated")
+    else:
+        thumbnail = await run_in_threadpool(make_thumbnail, attachment_store.blob_path(sha256), upload.content_type)
+        attachments_stored.inc(1, "new")
+    attachment = Attachment(
+        uploader_id=current_user.id,
+        sha256=sha256,
+        filename=upload.filename,
+        content_type=upload.content_type,
+        size=upload.size,
+        thumbnail=thumbnail
+    )
+    db.add(attachment)
+    db.delete(upload)
+    db.flush()
+    response = upload_response(upload, attachment)
+    db.commit()
+    return response
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """First and last byte of a single `bytes=` range; None for a header we serve in full.
+
+    Raises ValueError when the range lies outside the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            first, last = max(size - int(end), 0), size - 1
+        else:
+            first, last = int(start), min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if first > last or first >= size:
+        raise ValueError(header)
+    return first, last
+
+async def read_range(path: str, first: int, last: int):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(first)
+        remaining = last - first + 1
+        while remaining:
+            chunk = await f.read(min(RANGE_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+@router.get("/{attachment_id}")
+async def download_attachment(
+    attachment_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """The attachment's file, honouring a single byte Range"""
+    attachment = db.get(Attachment, attachment_id)
+    if not attachment or not can_read(db, current_user, attachment):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Attachment not found"
+        )
+
+    path = attachment_store.blob_path(attachment.sha256)
+    headers = {
+        "Accept-Ranges": "bytes",
+        # Blobs are content-addressed, so they never change
+        "ETag": f'"{attachment.sha256}"',
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    disposition = "inline" if attachment.content_type in INLINE_TYPES else "attachment"
+
+    range_header = request.headers.get("range")
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, attachment.size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{attachment.size}"}
+            )
+        if byte_range:
+            first, last = byte_range
+            return StreamingResponse(
+                read_range(path, first, last),
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type=attachment.content_type,
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {first}-{last}/{attachment.size}",
+                    "Content-Length": str(last - first + 1)
+                }
+            )
+
+    return FileResponse(
+        path,
+        media_type=attachment.content_type,
+        filename=attachment.filename,
+        content_disposition_type=disposition,
+        headers=headers
+    )
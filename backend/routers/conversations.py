@@ -0,0 +1,80 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy import text, DateTime
+from typing import List
+import logging
+
+from database import get_db
+from models import User, Message, Conversation
+from schemas import ConversationResponse
+from auth import get_current_user
+
+router = APIRouter(prefix="/api", tags=["conversations"])
+logger = logging.getLogger(__name__)
+
+def touch_conversation(db: Session, sender: User, recipient: User, message: Message):
+    """Upsert both participants' conversation rows for a new private message.
+
+    Runs in the caller's transaction; the message must already be flushed.
+    """
+    participants = {(sender.id, recipient.id), (recipient.id, sender.id)}
+    for user_id, peer_id in participants:
+        stmt = insert(Conversation).values(
+            user_id=user_id,
+            peer_id=peer_id,
+            room=message.room,
+            last_message_id=message.id,
+            last_activity=message.timestamp
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[Conversation.user_id, Conversation.peer_id],
+            set_={
+                "last_message_id": stmt.excluded.last_message_id,
+                "last_activity": stmt.excluded.last_activity
+            }
+        ))
+
+@router.get("/conversations", response_model=List[ConversationResponse])
+async def get_conversations(
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """List the current user's private conversations, most recently active first"""
+    try:
+        query = text("""
+            SELECT c.room, c.last_activity, p.username AS peer,
+                   c.last_message_id, COALESCE(m.content, a.content) AS last_message,
+                   s.username AS last_sender
+            FROM conversations c
+            JOIN users p ON p.id = c.peer_id
+            LEFT JOIN messages m ON m.id = c.last_message_id
+            -- Quiet conversations may have had their last message archived
+            LEFT JOIN archived_messages a ON m.id IS NULL AND a.id = c.last_message_id
+            LEFT JOIN users s ON s.id = COALESCE(m.sender_id, a.sender_id)
+            WHERE c.user_id = :user_id
+            ORDER BY c.last_activity DESC
+            LIMIT :limit
+        """).columns(last_activity=DateTime)
+
+        result = db.execute(query, {"user_id": current_user.id, "limit": limit}).fetchall()
+
+        return [
+            ConversationResponse(
+                peer=row.peer,
+                room=row.room,
+                last_activity=row.last_activity,
+                last_message_id=row.last_message_id,
+                last_message=row.last_message,
+                last_sender=row.last_sender
+            )
+            for row in result
+        ]
+    except SQLAlchemyError as e:
+        logger.error("Database error in get_conversations: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to fetch conversations"
+        )
@@ -1,18 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, select, func, update
-from typing import List
+from sqlalchemy import and_, or_, select, func, update, delete
+from typing import List, Optional
 from datetime import datetime, timezone
-from .push import send_push_to_username
+import logging
 
 from database import get_db
-from database import get_db
-from models import User, GroupChat, Message, group_membership
-from schemas import GroupCreate, GroupResponse, GroupMemberResponse, MessageResponse, AddMembersRequest
+from models import User, GroupChat, Message, ArchivedMessage, RetentionPolicy, group_membership
+from schemas import (
+    GroupCreate, GroupResponse, GroupMemberResponse, MessageResponse, AddMembersRequest,
+    RetentionPolicyUpdate, RetentionPolicyResponse
+)
 from auth import get_current_user
-from websocket_manager import manager
+from websocket_manager import group_update_frame, manager
+from group_cache import group_cache
+from push_outbox import push_outbox
+from config import settings
+from retention import room_history
+from attachments import attachment_summaries
 
 router = APIRouter(prefix="/api/groups", tags=["groups"])
+logger = logging.getLogger(__name__)
 
 @router.get("/", response_model=List[GroupResponse])
 async def get_user_groups(
@@ -21,16 +29,18 @@ async def get_user_groups(
 ):
     """Get all groups that the current user is a member of"""
     try:
-        # Query groups where user is a member
-        groups = db.query(GroupChat).join(
+        # Query groups where user is a member, counting members in the same query
+        member_count = select(func.count()).where(
+            group_membership.c.group_id == GroupChat.id
+        ).correlate(GroupChat).scalar_subquery()
+        groups = db.query(GroupChat, member_count).join(
             group_membership, GroupChat.id == group_membership.c.group_id
         ).filter(
             group_membership.c.user_id == current_user.id
         ).all()
         
-        # Add member count to each group
         result = []
-        for group in groups:
+        for group, count in groups:
             group_dict = {
                 "id": group.id,
                 "name": group.name,
@@ -39,7 +49,7 @@ async def get_user_groups(
                 "max_members": group.max_members,
                 "created_by": group.created_by,
                 "created_at": group.created_at,
-                "member_count": len(group.members)
+                "member_count": count
             }
             result.append(group_dict)
         
@@ -78,6 +88,8 @@ async def create_group(
             joined_at=datetime.utcnow()
         )
         db.execute(creator_membership)
+        topic = f"group_{new_group.id}"
+        members_added = [current_user.username]
         
         # Add other members if specified
         if group_data.members:
@@ -91,12 +103,12 @@ async def create_group(
                         joined_at=datetime.utcnow()
                     )
                     db.execute(member_insert)
-                    send_push_to_username(
-                            user.username,
-                            f"You were added to new group {group_data.name}",
-                            f"You have been added to the group '{group_data.name}' by {current_user.username}",
-                            {"sender": current_user.username, "type": "group", "group_name": group_data.name},
-                            db
+                    members_added.append(user.username)
+                    push_outbox.to_users(
+                        db, (user.id,),
+                        f"You were added to new group {group_data.name}",
+                        f"You have been added to the group '{group_data.name}' by {current_user.username}",
+                        {"sender": current_user.username, "type": "group", "group_name": group_data.name}
                     )
                     
                     # Broadcast new group to the added user via WebSocket
@@ -113,6 +125,11 @@ async def create_group(
                     await manager.broadcast_group_update(user.username, new_group_data)
         
         db.commit()
+        push_outbox.wake()
+        # Online members receive the group's messages from now on
+        for username in members_added:
+            manager.subscribe(username, topic)
+        group_cache.invalidate(new_group.id)
         db.refresh(new_group)
         
         # Return group with member count
@@ -186,10 +203,12 @@ async def get_group_members(
 @router.get("/{group_id}/messages", response_model=List[MessageResponse])
 async def get_group_messages(
     group_id: int,
+    limit: Optional[int] = Query(None, ge=1),
+    before_id: Optional[int] = Query(None, ge=1),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all messages for a specific group"""
+    """Get messages for a specific group, oldest first; all of them unless a limit is given"""
     try:
         # Check if user is a member of the group
         membership = db.query(group_membership).filter(
@@ -205,21 +224,12 @@ async def get_group_messages(
                 detail="You are not a member of this group"
             )
         
-        # Get group messages using raw SQL to avoid pagination issues
-        from sqlalchemy import text
-        
-        query = text("""
-            SELECT m.id, m.content, m.sender_id, m.room, m.group_id, m.timestamp, u.username
-            FROM messages m
-            JOIN users u ON m.sender_id = u.id
-            WHERE m.group_id = :group_id
-            ORDER BY m.timestamp ASC
-        """)
-        
-        result = db.execute(query, {"group_id": group_id}).fetchall()
+        # Newest first, reading through to the archive past the hot window
+        result = room_history(db, f"group_{group_id}", limit, before_id)
+        attachments = attachment_summaries(db, (row.id for row in result))
         
         messages = []
-        for row in result:
+        for row in reversed(result):
             messages.append(MessageResponse(
                 id=row.id,
                 content=row.content,
@@ -227,7 +237,8 @@ async def get_group_messages(
                 timestamp=row.timestamp,
                 room=row.room,
                 group_id=row.group_id,
-                isPrivate=False
+                isPrivate=False,
+                attachments=attachments.get(row.id, [])
             ))
         
         return messages
@@ -277,14 +288,20 @@ async def leave_group(
             )
         ).first()
         
-        print(f"Debug: User {current_user.id} leaving group {group_id}")
-        print(f"Debug: Group created_by: {group.created_by}")
-        print(f"Debug: User membership role: {user_membership.role if user_membership else 'None'}")
+        logger.debug(
+            "User leaving group",
+            extra={
+                "user_id": current_user.id,
+                "group_id": group_id,
+                "created_by": group.created_by,
+                "role": user_membership.role if user_membership else None
+            }
+        )
         
         is_owner = group.created_by == current_user.id
         
         if is_owner:
-            print("Debug: User is owner, transferring ownership...")
+            logger.debug("User is owner, transferring ownership", extra={"group_id": group_id})
             
             # First, try to find another admin (excluding current owner)
             other_admins = db.execute(
@@ -297,12 +314,10 @@ async def leave_group(
                 )
             ).first()
             
-            print(f"Debug: Found other admins: {other_admins}")
-            
             if other_admins:
                 # Transfer ownership to first admin found
                 new_owner_id = other_admins[0]  # Get the user_id from the result
-                print(f"Debug: Transferring ownership to admin {new_owner_id}")
+                logger.debug("Transferring ownership to admin", extra={"group_id": group_id, "new_owner_id": new_owner_id})
                 
                 # Update group_membership table - promote admin to owner
                 db.execute(
@@ -319,8 +334,6 @@ async def leave_group(
                     update(GroupChat).where(GroupChat.id == group_id).values(created_by=new_owner_id)
                 )
                 
-                print(f"Debug: Successfully transferred ownership to {new_owner_id}")
-                
             else:
                 # No other admins, check if there are other members
                 other_members = db.execute(
@@ -331,13 +344,11 @@ async def leave_group(
                         )
                     )
                 ).first()
-                
-                print(f"Debug: Found other members: {other_members}")
 
                 if other_members:
                     # Promote first member to owner
                     new_owner_id = other_members[0]  # Get the user_id from the result
-                    print(f"Debug: Promoting member {new_owner_id} to owner")
+                    logger.debug("Promoting member to owner", extra={"group_id": group_id, "new_owner_id": new_owner_id})
                     
                     # Update group_membership table - promote member to owner
                     db.execute(
@@ -354,12 +365,13 @@ async def leave_group(
                         update(GroupChat).where(GroupChat.id == group_id).values(created_by=new_owner_id)
                     )
                     
-                    print(f"Debug: Successfully promoted member {new_owner_id} to owner")
-                    
                 else:
                     # No other members, delete the group
-                    print("Debug: No other members, deleting group")
+                    logger.debug("No other members, deleting group", extra={"group_id": group_id})
                     db.delete(group)
+                    # Hot messages go with the group through the cascade
+                    db.execute(delete(ArchivedMessage).where(ArchivedMessage.room == f"group_{group_id}"))
+                    db.execute(delete(RetentionPolicy).where(RetentionPolicy.room == f"group_{group_id}"))
 
         # Remove user from group
         db.execute(
@@ -372,13 +384,9 @@ async def leave_group(
         )
         
         db.commit()
-        
-        # Get remaining group members after user left
-        remaining_members = db.query(User.username).join(
-            group_membership, User.id == group_membership.c.user_id
-        ).filter(group_membership.c.group_id == group_id).all()
-        
-        remaining_usernames = [member.username for member in remaining_members]
+        group_cache.invalidate(group_id)
+        topic = f"group_{group_id}"
+        manager.unsubscribe(current_user.username, topic)
         
         # Prepare group data for WebSocket notification
         group_data = {
@@ -392,9 +400,8 @@ async def leave_group(
             "user_left": current_user.username  # Include who left the group
         }
         
-        # Notify all remaining group members about user leaving
-        for username in remaining_usernames:
-            await manager.broadcast_group_update(username, group_data, "user_left_group")
+        # Notify the remaining members who are online about user leaving
+        await manager.publish(topic, group_update_frame(group_data, "user_left_group"))
         
         # Also notify the user who left to remove group from their list
         await manager.broadcast_group_update(current_user.username, group_data, "removed_from_group")
@@ -404,7 +411,7 @@ async def leave_group(
         raise
     except Exception as e:
         db.rollback()
-        print(str(e))
+        logger.exception("Failed to leave group", extra={"group_id": group_id})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to leave group: {str(e)}"
@@ -446,25 +453,36 @@ async def add_member_to_group(
             )
         
         added_members = []
+        added_ids = []
         errors = []
         
+        # Look up every requested user, the group's current members and its size once, not per username
+        users_by_name = {
+            user.username: user
+            for user in db.query(User).filter(User.username.in_(request.members))
+        }
+        existing_ids = {
+            user_id for (user_id,) in db.query(group_membership.c.user_id).filter(
+                and_(
+                    group_membership.c.group_id == group_id,
+                    group_membership.c.user_id.in_([user.id for user in users_by_name.values()])
+                )
+            )
+        }
+        member_count = db.query(func.count()).select_from(group_membership).filter(
+            group_membership.c.group_id == group_id
+        ).scalar()
+        
         for member_username in request.members:
             try:
                 # Find the user to add
-                user_to_add = db.query(User).filter(User.username == member_username).first()
+                user_to_add = users_by_name.get(member_username)
                 if not user_to_add:
                     errors.append(f"User '{member_username}' not found")
                     continue
                 
                 # Check if user is already a member
-                existing_membership = db.query(group_membership).filter(
-                    and_(
-                        group_membership.c.user_id == user_to_add.id,
-                        group_membership.c.group_id == group_id
-                    )
-                ).first()
-                
-                if existing_membership:
+                if user_to_add.id in existing_ids:
                     errors.append(f"User '{member_username}' is already a member of this group")
                     continue
                 
@@ -476,14 +494,9 @@ async def add_member_to_group(
                     joined_at=datetime.now(timezone.utc)
                 )
                 db.execute(new_membership)
+                existing_ids.add(user_to_add.id)
                 added_members.append(member_username)
-                send_push_to_username(
-                            member_username,
-                            f"you added to group:{group.name} from {current_user.username}",
-                            "Welcome to group",
-                            {"sender": current_user.username, "type": "group", "group_name": group.name},
-                            db
-                        )
+                added_ids.append(user_to_add.id)
                 
                 # Broadcast group update to the newly added user via WebSocket
                 group_data = {
@@ -494,13 +507,23 @@ async def add_member_to_group(
                     "max_members": group.max_members,
                     "created_by": group.created_by,
                     "created_at": group.created_at.isoformat() if group.created_at else None,
-                    "member_count": len(group.members) + len(added_members)
+                    "member_count": member_count + len(added_members)
                 }
                 await manager.broadcast_group_update(member_username, group_data)
             except Exception as e:
                 errors.append(f"Failed to add '{member_username}': {str(e)}")
         
+        push_outbox.to_users(
+            db, added_ids,
+            f"you added to group:{group.name} from {current_user.username}",
+            "Welcome to group",
+            {"sender": current_user.username, "type": "group", "group_name": group.name}
+        )
         db.commit()
+        push_outbox.wake()
+        for member_username in added_members:
+            manager.subscribe(member_username, f"group_{group_id}")
+        group_cache.invalidate(group_id)
         
         # Prepare response message
         message = ""
@@ -527,3 +550,75 @@ async def add_member_to_group(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to add members: {str(e)}"
         )
+
+@router.get("/{group_id}/retention", response_model=RetentionPolicyResponse)
+async def get_group_retention(
+    group_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """How long the group's messages stay in the hot table before archiving"""
+    group = group_cache.get(db, group_id)
+    if not group or current_user.id not in group.member_ids:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not a member of this group"
+        )
+
+    room = f"group_{group_id}"
+    policy = db.get(RetentionPolicy, room)
+    if policy is None:
+        return RetentionPolicyResponse(room=room, days=settings.retention_days, is_default=True)
+    return RetentionPolicyResponse(room=room, days=policy.days, is_default=False)
+
+@router.put("/{group_id}/retention", response_model=RetentionPolicyResponse)
+async def set_group_retention(
+    group_id: int,
+    request: RetentionPolicyUpdate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Override the retention period for a group (admin only)"""
+    try:
+        membership = db.query(group_membership).filter(
+            and_(
+                group_membership.c.user_id == current_user.id,
+                group_membership.c.group_id == group_id,
+                or_(
+                    group_membership.c.role == "admin",
+                    group_membership.c.role == "owner"
+                )
+            )
+        ).first()
+
+        if not membership:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You don't have permission to change this group's retention"
+            )
+
+        room = f"group_{group_id}"
+        policy = db.get(RetentionPolicy, room)
+        if request.days is None:
+            if policy is not None:
+                db.delete(policy)
+            db.commit()
+            return RetentionPolicyResponse(room=room, days=settings.retention_days, is_default=True)
+
+        if policy is None:
+            policy = RetentionPolicy(room=room, days=request.days)
+            db.add(policy)
+        else:
+            policy.days = request.days
+            policy.updated_at = datetime.utcnow()
+        db.commit()
+        return RetentionPolicyResponse(room=room, days=policy.days, is_default=False)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to update retention: {str(e)}"
+        )
@@ -1,36 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List
+from sqlalchemy import text, DateTime
+from typing import List, Optional
+import logging
 
 from database import get_db
 from models import User, Message
-from schemas import MessageResponse
+from schemas import MessageResponse, SyncResponse, ReadCursorResponse
 from auth import get_current_user
+from config import settings
+from room_access import READABLE_ROOM_FILTER, can_read_room, readable_room_params, private_recipient, private_room_name
+from read_receipts import read_buffer
+from retention import room_history
+from attachments import attachment_summaries
 
 router = APIRouter(prefix="/api", tags=["messages"])
+logger = logging.getLogger(__name__)
 
 @router.get("/messages", response_model=List[MessageResponse])
 async def get_messages(
     room: str = "general",
     limit: int = 50,
+    before_id: Optional[int] = Query(None, ge=1),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     try:
-        # Use raw SQL to avoid SQLAlchemy pagination issues
-        from sqlalchemy import text
-        
-        query = text("""
-            SELECT m.id, m.content, m.sender_id, m.room, m.group_id, m.timestamp, u.username
-            FROM messages m
-            JOIN users u ON m.sender_id = u.id
-            WHERE m.room = :room
-            ORDER BY m.timestamp DESC
-            LIMIT :limit
-        """)
-        
-        result = db.execute(query, {"room": room, "limit": limit}).fetchall()
+        if not can_read_room(db, current_user.id, room):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You can't read this room"
+            )
+        # Pass the oldest id of a page as before_id for the one before it
+        result = room_history(db, room, limit, before_id)
+        attachments = attachment_summaries(db, (row.id for row in result))
         
         messages = []
         for row in result:
@@ -41,12 +45,13 @@ async def get_messages(
                 timestamp=row.timestamp,
                 room=row.room,
                 isPrivate=row.room.startswith("private_"),
-                group_id=row.group_id
+                group_id=row.group_id,
+                attachments=attachments.get(row.id, [])
             ))
         
         return list(reversed(messages))
     except SQLAlchemyError as e:
-        print(f"Database error in get_messages: {e}")
+        logger.error("Database error in get_messages: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to fetch messages"
@@ -56,26 +61,19 @@ async def get_messages(
 async def get_private_messages(
     other_user: str,
     limit: int = 50,
+    before_id: Optional[int] = Query(None, ge=1),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     try:
         # Create consistent room name for private messages
-        room_name = f"private_{min(current_user.username, other_user)}_{max(current_user.username, other_user)}"
-        
-        # Use raw SQL to avoid SQLAlchemy pagination issues
-        from sqlalchemy import text
-        
-        query = text("""
-            SELECT m.id, m.content, m.sender_id, m.room, m.group_id, m.timestamp, u.username
-            FROM messages m
-            JOIN users u ON m.sender_id = u.id
-            WHERE m.room = :room_name
-            ORDER BY m.timestamp DESC
-            LIMIT :limit
-        """)
-        
-        result = db.execute(query, {"room_name": room_name, "limit": limit}).fetchall()
+        room_name = private_room_name(current_user.username, other_user)
+        # Usernames may contain underscores, so the name alone can match someone else's
+        # conversation; nothing has been said in one the user isn't part of
+        if not can_read_room(db, current_user.id, room_name):
+            return []
+        result = room_history(db, room_name, limit, before_id)
+        attachments = attachment_summaries(db, (row.id for row in result))
         
         messages = []
         for row in result:
@@ -87,13 +85,119 @@ async def get_private_messages(
                 room=row.room,
                 isPrivate=True,
                 recipient=other_user if row.username == current_user.username else current_user.username,
-                group_id=row.group_id
+                group_id=row.group_id,
+                attachments=attachments.get(row.id, [])
             ))
         
         return list(reversed(messages))
     except SQLAlchemyError as e:
-        print(f"Database error in get_private_messages: {e}")
+        logger.error("Database error in get_private_messages: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to fetch private messages"
         )
+
+def fetch_messages_since(db: Session, user: User, since: int, limit: int):
+    """Messages with id > since in every room the user can read, oldest first"""
+    query = text(f"""
+        SELECT m.id, m.content, m.sender_id, m.room, m.group_id, m.timestamp, u.username,
+               g.name AS group_name
+        FROM messages m
+        JOIN users u ON m.sender_id = u.id
+        LEFT JOIN group_chats g ON g.id = m.group_id
+        WHERE m.id > :since AND {READABLE_ROOM_FILTER}
+        ORDER BY m.id
+        LIMIT :limit
+    """).columns(timestamp=DateTime)
+    params = {"since": since, "limit": limit, **readable_room_params(user.id)}
+    return db.execute(query, params).fetchall()
+
+@router.get("/sync", response_model=SyncResponse)
+async def sync_messages(
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(settings.sync_max_messages, ge=1, le=settings.sync_max_messages),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Return everything new across general, private and group rooms since a cursor.
+
+    The cursor is the id of the last message the client has seen. Without one,
+    no messages are returned and the cursor is the current high-water mark.
+    """
+    try:
+        if since is None:
+            high_water = db.execute(text("SELECT MAX(id) FROM messages")).scalar()
+            return SyncResponse(messages=[], cursor=high_water or 0)
+
+        result = fetch_messages_since(db, current_user, since, limit + 1)
+        has_more = len(result) > limit
+        result = result[:limit]
+        attachments = attachment_summaries(db, (row.id for row in result))
+
+        messages = []
+        for row in result:
+            is_private = row.room.startswith("private_")
+            messages.append(MessageResponse(
+                id=row.id,
+                content=row.content,
+                sender=row.username,
+                timestamp=row.timestamp,
+                room=row.room,
+                isPrivate=is_private,
+                recipient=private_recipient(row.room, row.username, current_user.username) if is_private else None,
+                group_id=row.group_id,
+                attachments=attachments.get(row.id, [])
+            ))
+
+        cursor = result[-1].id if result else since
+        return SyncResponse(messages=messages, cursor=cursor, has_more=has_more)
+    except SQLAlchemyError as e:
+        logger.error("Database error in sync_messages: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to sync messages"
+        )
+
+# Messages after a cursor in one room, counted up to :cap via ix_messages_room_id
+UNREAD_COUNT = """
+    (SELECT COUNT(*) FROM (
+        SELECT 1 FROM messages m
+        WHERE m.room = {room} AND m.id > {cursor}
+        LIMIT :cap
+    ))
+"""
+
+@router.get("/read-cursors", response_model=List[ReadCursorResponse])
+async def get_read_cursors(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Read position and unread count for every room the user has sent a read receipt in"""
+    try:
+        query = text(f"""
+            SELECT c.room, c.last_read_message_id,
+                   {UNREAD_COUNT.format(room="c.room", cursor="c.last_read_message_id")} AS unread
+            FROM read_cursors c
+            WHERE c.user_id = :user_id
+        """)
+        cap = settings.unread_count_cap
+        cursors = {
+            row.room: ReadCursorResponse(room=row.room, last_read_message_id=row.last_read_message_id, unread=row.unread)
+            for row in db.execute(query, {"user_id": current_user.id, "cap": cap})
+        }
+
+        # Receipts still waiting for the next batched write
+        recount = text(f"SELECT {UNREAD_COUNT.format(room=':room', cursor=':cursor')}")
+        for room, message_id in read_buffer.pending_for(current_user.id).items():
+            if room in cursors and cursors[room].last_read_message_id >= message_id:
+                continue
+            unread = db.execute(recount, {"room": room, "cursor": message_id, "cap": cap}).scalar()
+            cursors[room] = ReadCursorResponse(room=room, last_read_message_id=message_id, unread=unread)
+
+        return list(cursors.values())
+    except SQLAlchemyError as e:
+        logger.error("Database error in get_read_cursors: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to fetch read cursors"
+        )
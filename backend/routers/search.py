@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import text
+from typing import List
+import logging
+
+from database import get_db
+from models import User
+from schemas import MessageResponse
+from auth import get_current_user
+from search_index import SEARCH_QUERY, search_params
+from room_access import private_recipient
+from config import settings
+
+router = APIRouter(prefix="/api", tags=["search"])
+logger = logging.getLogger(__name__)
+
+@router.get("/search", response_model=List[MessageResponse])
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Search messages in rooms and groups the current user belongs to, best match first"""
+    params = search_params(
+        q, current_user.id, limit, offset, settings.search_rank_window
+    )
+    if not params["match"]:
+        return []
+
+    try:
+        result = db.execute(text(SEARCH_QUERY), params).fetchall()
+    except SQLAlchemyError as e:
+        logger.error("Database error in search_messages: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to search messages"
+        )
+
+    messages = []
+    for row in result:
+        is_private = row.room.startswith("private_")
+        messages.append(MessageResponse(
+            id=row.id,
+            content=row.content,
+            sender=row.username,
+            timestamp=row.timestamp,
+            room=row.room,
+            isPrivate=is_private,
+            recipient=private_recipient(row.room, row.username, current_user.username) if is_private else None,
+            group_id=row.group_id
+        ))
+
+    return messages
@@ -1,173 +1,460 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-import json
-import asyncio
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from typing import Optional
+from time import monotonic, perf_counter
+import logging
+import random
 
+import metrics
+
+from auth import verify_token
 from database import get_db
-from models import User, Message, GroupChat, group_membership
-from websocket_manager import manager
-from .push import send_push_to_username
-from sqlalchemy import and_
+from models import User, Message
+from schemas import InboundFrame, PrivateFrame, GroupFrame, TypingFrame, ReadFrame, PingFrame, PongFrame
+from websocket_manager import GENERAL_TOPIC, TRY_AGAIN_LATER, manager
+from loop_monitor import DROP_EPHEMERAL, REJECT_CONNECTIONS, loop_monitor, shed_work
+from group_cache import group_cache
+from rate_limit import TokenBucket, user_rate_limiter
+from typing_events import typing_tracker
+from read_receipts import read_buffer
+from attachments import attachment_summaries, link_attachments
+from message_ids import message_ids, id_time
+from push_outbox import push_outbox
+from profiling import profiler
+from client_messages import client_messages, ack_frame, resends, stored_message
+from wire import Frame, send_frame, receive_raw, decode_msgpack
+from config import settings
+from room_access import private_recipient, private_room_name
+from .messages import fetch_messages_since
+from .conversations import touch_conversation
 
 router = APIRouter(tags=["websocket"])
+logger = logging.getLogger(__name__)
 
-async def send_push_background(recipient: str, title: str, body: str, data: dict):
-    """Send push notification in background without blocking WebSocket"""
-    db = next(get_db())
+# Validator for the inbound frame union, built once; parses and validates in one pass
+inbound_frames = TypeAdapter(InboundFrame)
+
+RATE_LIMITED_FRAME = Frame({"type": "error", "code": "rate_limited"})
+INVALID_FRAME = Frame({"type": "error", "code": "invalid_frame"})
+PONG_FRAME = Frame({"type": "pong"})
+
+# Inserts retried under a fresh id when another process issued the same one
+ID_CONFLICT_RETRIES = 3
+MESSAGE_EXISTS = text("SELECT 1 FROM messages WHERE id = :id")
+
+frames_rejected = metrics.Counter(
+    "chat_ws_frames_rejected_total",
+    "Inbound websocket frames dropped before processing",
+    ("reason",),
+)
+id_conflicts = metrics.Counter(
+    "chat_message_id_conflicts_total",
+    "Message inserts retried because another process had stored a message under the same id",
+)
+handshakes_refused = metrics.Counter(
+    "chat_ws_handshakes_refused_total",
+    "Websocket handshakes closed with 1008 because the token was missing or not for the path's user",
+)
+
+def token_subject(token: Optional[str]) -> Optional[str]:
+    """Username a handshake's access token was issued to; None if missing or invalid"""
+    if not token:
+        return None
     try:
-        await send_push_to_username(recipient, title, body, data, db)
-    except Exception as e:
-        print(f"Background push notification error: {e}")
-    finally:
-        db.close()
+        return verify_token(token, HTTPException(status_code=status.HTTP_401_UNAUTHORIZED))
+    except HTTPException:
+        return None
+
+def new_message(**fields) -> Message:
+    """A message whose id and timestamp are known before the INSERT, so nothing is read back"""
+    message_id = message_ids.next_id()
+    return Message(id=message_id, timestamp=id_time(message_id), **fields)
+
+async def insert_message(db, websocket: WebSocket, user: User, db_message: Message) -> bool:
+    """Add and flush a new message; False for a resend the unique index caught, which is acked instead.
+
+    A process holding the same node id (see message_ids.py) may have stored
+    a message under this id already; the insert is then retried under a fresh one.
+    """
+    for attempt in range(ID_CONFLICT_RETRIES + 1):
+        db.add(db_message)
+        try:
+            db.flush()
+            return True
+        except IntegrityError as error:
+            db.rollback()
+            conflict = error
+        if db_message.client_msg_id is not None:
+            stored = stored_message(db, user.id, db_message.client_msg_id)
+            if stored is not None:
+                resends.inc(1, "index")
+                client_messages.remember(user.username, db_message.client_msg_id, *stored)
+                await send_frame(websocket, ack_frame(db_message.client_msg_id, *stored, duplicate=True))
+                return False
+        if attempt == ID_CONFLICT_RETRIES or db.execute(MESSAGE_EXISTS, {"id": db_message.id}).first() is None:
+            raise conflict
+        id_conflicts.inc(1)
+        logger.warning("Message id %d already taken; retrying under a new id", db_message.id)
+        db_message.id = message_ids.next_id()
+        db_message.timestamp = id_time(db_message.id)
+
+async def acknowledge(websocket: WebSocket, username: str, client_msg_id: Optional[str], message_id: int, sent_at: str):
+    """Tell the sender its message is stored, under which id"""
+    if client_msg_id is None:
+        return
+    client_messages.remember(username, client_msg_id, message_id, sent_at)
+    try:
+        await send_frame(websocket, ack_frame(client_msg_id, message_id, sent_at))
+    except Exception:
+        pass  # Stored anyway; a resend after reconnecting gets the ack
+
+def message_frame(row, username: str, attachments=()) -> dict:
+    """Build the live websocket frame for a stored message row"""
+    if row.room.startswith("private_"):
+        return {
+            "type": "private_message",
+            "id": row.id,
+            "sender": row.username,
+            "recipient": private_recipient(row.room, row.username, username),
+            "content": row.content,
+            "attachments": list(attachments),
+            "timestamp": row.timestamp.isoformat(),
+            "isPrivate": True
+        }
+    if row.room.startswith("group_"):
+        return {
+            "type": "group_message",
+            "id": row.id,
+            "sender": row.username,
+            "group_id": row.group_id,
+            "group_name": row.group_name,
+            "content": row.content,
+            "attachments": list(attachments),
+            "timestamp": row.timestamp.isoformat()
+        }
+    return {
+        "type": "message",
+        "id": row.id,
+        "sender": row.username,
+        "content": row.content,
+        "attachments": list(attachments),
+        "timestamp": row.timestamp.isoformat()
+    }
+
+async def replay_missed_messages(websocket: WebSocket, db, user: User, last_seen_id: int):
+    """Send messages the client missed while disconnected, in order"""
+    limit = settings.sync_max_messages
+    rows = fetch_messages_since(db, user, last_seen_id, limit + 1)
+    attachments = attachment_summaries(db, (row.id for row in rows[:limit]))
+    for row in rows[:limit]:
+        await send_frame(websocket, Frame(message_frame(row, user.username, attachments.get(row.id, ()))))
+    if len(rows) > limit:
+        # Too much to replay inline; the client should page through /api/sync
+        await send_frame(websocket, Frame({
+            "type": "sync_required",
+            "cursor": rows[limit - 1].id
+        }))
+
+async def relay_typing(db, username: str, frame: TypingFrame):
+    """Relay a typing event to the target's online members; never stored or pushed"""
+    if loop_monitor.sheds(DROP_EPHEMERAL):
+        # Receivers expire indicators on their own
+        shed_work.inc(1, "typing")
+        return
+    event = {
+        "type": "typing",
+        "sender": username,
+        "active": frame.active,
+        "expires_in": settings.typing_ttl_seconds
+    }
+    if frame.recipient is not None:
+        if frame.recipient == username:
+            return
+        room = private_room_name(username, frame.recipient)
+        event["recipient"] = frame.recipient
+    else:
+        # Served from the membership cache; only a cold group costs a read
+        group = group_cache.get(db, frame.group_id)
+        if not group or username not in group.member_usernames:
+            return
+        room = f"group_{group.group_id}"
+        event["group_id"] = group.group_id
+
+    if not typing_tracker.should_forward(username, room, frame.active):
+        return
+    typing_frame = Frame(event)
+    if frame.recipient is not None:
+        await manager.send_personal_message(typing_frame, frame.recipient)
+    else:
+        await manager.publish(room, typing_frame, exclude_user=username)
+
+def record_read(db, user: User, frame: ReadFrame):
+    """Advance the user's read cursor in memory; read_receipts flushes it in batches"""
+    if frame.recipient is not None:
+        room = private_room_name(user.username, frame.recipient)
+    elif frame.group_id is not None:
+        group = group_cache.get(db, frame.group_id)
+        if not group or user.id not in group.member_ids:
+            return
+        room = f"group_{group.group_id}"
+    else:
+        room = "general"
+    read_buffer.record(user.id, user.username, room, frame.message_id)
 
 @router.websocket("/ws/{username}")
-async def websocket_endpoint(websocket: WebSocket, username: str):
+async def websocket_endpoint(
+    websocket: WebSocket, username: str, token: Optional[str] = None, last_seen_id: Optional[int] = None
+):
+    # Browsers can't set headers on a websocket handshake, so the access token
+    # comes as a query parameter; it must be the path user's own
+    if token_subject(token) != username:
+        handshakes_refused.inc(1)
+        await manager.refuse(websocket)
+        return
+    if manager.draining:
+        await manager.turn_away(websocket, random.uniform(0, settings.drain_reconnect_spread))
+        return
+    if loop_monitor.sheds(REJECT_CONNECTIONS):
+        # Overloaded: keep serving the sockets we have
+        shed_work.inc(1, "handshake")
+        retry_after = settings.loop_shed_retry_after
+        await manager.turn_away(websocket, random.uniform(retry_after, 2 * retry_after), TRY_AGAIN_LATER)
+        return
+
     # Get database session
     db = next(get_db())
     
-    await manager.connect(websocket, username)
+    # Subscribed to their groups' topics; membership changes update it from routers/groups.py
+    await manager.connect(websocket, username, db)
     try:
+        if last_seen_id is not None:
+            user = db.query(User).filter(User.username == username).first()
+            if user:
+                await replay_missed_messages(websocket, db, user, last_seen_id)
+
+        bucket = TokenBucket(settings.ws_rate_per_connection, settings.ws_burst_per_connection)
+        throttled = False
+        profiled = None
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-           
-               # Get the user from database
+            # The previous frame is done once we are back here
+            profiler.finish(profiled)
+            profiled = None
+            # Return the pooled connection while idle; the session reconnects on next use
+            db.close()
+            data = await receive_raw(websocket)
+            received_at = perf_counter()
+            manager.touch(username, websocket)
+
+            # Cheap checks first so abusive clients never reach the parser.
+            # The server's ws_max_size enforces this in bytes before buffering;
+            # this covers other launchers.
+            if len(data) > settings.ws_max_frame_bytes:
+                frames_rejected.inc(1, "too_large")
+                await websocket.close(code=1009)
+                break
+            now = monotonic()
+            if not (bucket.take(now) and user_rate_limiter.take(username, now)):
+                frames_rejected.inc(1, "rate_limited")
+                if not throttled:
+                    # Tell the client once per throttled stretch, then drop silently
+                    throttled = True
+                    await send_frame(websocket, RATE_LIMITED_FRAME)
+                continue
+            throttled = False
+
+            try:
+                if isinstance(data, str):
+                    frame = inbound_frames.validate_json(data)
+                else:
+                    frame = inbound_frames.validate_python(decode_msgpack(data))
+            except (ValidationError, ValueError):
+                frames_rejected.inc(1, "invalid")
+                await send_frame(websocket, INVALID_FRAME)
+                continue
+            profiled = profiler.start("ws", frame.type)
+
+            # Heartbeat frames only refresh activity
+            if isinstance(frame, PongFrame):
+                continue
+            if isinstance(frame, PingFrame):
+                await send_frame(websocket, PONG_FRAME)
+                continue
+            if isinstance(frame, TypingFrame):
+                await relay_typing(db, username, frame)
+                continue
+
+            # A resend of a message stored moments ago is only acknowledged again
+            client_msg_id = getattr(frame, "client_msg_id", None)
+            if client_msg_id is not None:
+                stored = client_messages.get(username, client_msg_id)
+                if stored:
+                    resends.inc(1, "window")
+                    await send_frame(websocket, ack_frame(client_msg_id, *stored, duplicate=True))
+                    continue
+
+            # Get the user from database
             user = db.query(User).filter(User.username == username).first()
             if not user:
                 continue
+            if isinstance(frame, ReadFrame):
+                record_read(db, user, frame)
+                continue
             # Check message type
-            if message_data.get("type") == "private" and message_data.get("recipient"):
-                recipient = message_data.get("recipient")
-                content = message_data.get("content", "")
+            if isinstance(frame, PrivateFrame):
+                recipient = frame.recipient
+                content = frame.content
                 
                 # Save private message to database
-                db_message = Message(
+                db_message = new_message(
                     content=content,
                     sender_id=user.id,
-                    room=f"private_{min(username, recipient)}_{max(username, recipient)}"
+                    room=private_room_name(username, recipient),
+                    client_msg_id=client_msg_id
                 )
-                db.add(db_message)
-                db.commit()
-                db.refresh(db_message)
+                if not await insert_message(db, websocket, user, db_message):
+                    continue
+                attachments = link_attachments(db, user, frame.attachment_ids, db_message)
+                typing_tracker.clear(username, db_message.room)
+
+                # Keep both participants' conversation index current
+                recipient_user = db.query(User).filter(User.username == recipient).first()
+                if recipient_user:
+                    touch_conversation(db, user, recipient_user, db_message)
+                    # Push notification, committed with the message
+                    push_outbox.to_users(
+                        db, (recipient_user.id,),
+                        f"New message from {username}",
+                        content[:100] or "Sent an attachment",  # First 100 chars
+                        {"sender": username, "type": "private"},
+                        message_id=db_message.id
+                    )
+                message_id, sent_at = db_message.id, db_message.timestamp.isoformat()
+                with metrics.db_commit_seconds.time():
+                    db.commit()
+                push_outbox.wake()
+                await acknowledge(websocket, username, client_msg_id, message_id, sent_at)
                 
-                private_msg = json.dumps({
+                private_msg = Frame({
                     "type": "private_message",
+                    "id": message_id,
                     "sender": username,
                     "recipient": recipient,
                     "content": content,
-                    "timestamp": db_message.timestamp.isoformat(),
+                    "attachments": attachments,
+                    "timestamp": sent_at,
                     "isPrivate": True
                 })
                 
                 # Send to recipient
                 sent = await manager.send_personal_message(private_msg, recipient)
                 
-               
-                # Send push notification in background (non-blocking)
-                asyncio.create_task(send_push_background(
-                    recipient,
-                    f"New message from {username}",
-                    content[:100],  # First 100 chars
-                    {"sender": username, "type": "private"}
-                ))
-                
                 # Echo back to sender
                 await manager.send_personal_message(private_msg, username)
-            elif message_data.get("type") == "group" and message_data.get("group_id"):
-                group_id = message_data.get("group_id")
-                content = message_data.get("content", "")
-                
-                # Verify user is a member of the group
-                membership = db.query(group_membership).filter(
-                    and_(
-                        group_membership.c.user_id == user.id,
-                        group_membership.c.group_id == group_id
-                    )
-                ).first()
+                metrics.ws_fanout_seconds.observe(perf_counter() - received_at, "private")
+                metrics.ws_messages_total.inc(1, "private")
+            elif isinstance(frame, GroupFrame):
+                group_id = frame.group_id
+                content = frame.content
                 
-                if not membership:
-                    continue  # User is not a member, ignore message
-                
-                # Get group info
-                group = db.query(GroupChat).filter(GroupChat.id == group_id).first()
-                if not group:
-                    continue
+                # Membership and group name come from the process-wide cache
+                group = group_cache.get(db, group_id)
+                if not group or user.id not in group.member_ids:
+                    continue  # No such group or user is not a member, ignore message
                 
                 # Save group message to database
-                db_message = Message(
+                db_message = new_message(
                     content=content,
                     sender_id=user.id,
                     room=f"group_{group_id}",
-                    group_id=group_id
+                    group_id=group_id,
+                    client_msg_id=client_msg_id
+                )
+                if not await insert_message(db, websocket, user, db_message):
+                    continue
+                attachments = link_attachments(db, user, frame.attachment_ids, db_message)
+                typing_tracker.clear(username, db_message.room)
+                # Push notifications to the other members, committed with the message
+                push_outbox.to_users(
+                    db, group.member_ids - {user.id},
+                    f"New message in {group.name} from {username}",
+                    content[:100] or "Sent an attachment",
+                    {"sender": username, "type": "group", "group_name": group.name},
+                    message_id=db_message.id
                 )
-                db.add(db_message)
-                db.commit()
-                db.refresh(db_message)
+                message_id, sent_at = db_message.id, db_message.timestamp.isoformat()
+                with metrics.db_commit_seconds.time():
+                    db.commit()
+                push_outbox.wake()
+                await acknowledge(websocket, username, client_msg_id, message_id, sent_at)
                 
-                group_msg = json.dumps({
+                group_msg = Frame({
                     "type": "group_message",
+                    "id": message_id,
                     "sender": username,
                     "group_id": group_id,
                     "group_name": group.name,
                     "content": content,
-                    "timestamp": db_message.timestamp.isoformat()
+                    "attachments": attachments,
+                    "timestamp": sent_at
                 })
                 
-                # Get all group members
-                group_members = db.query(User).join(
-                    group_membership, User.id == group_membership.c.user_id
-                ).filter(
-                    group_membership.c.group_id == group_id
-                ).all()
-                
-                # Send to all group members
-                for member in group_members:
-                    await manager.send_personal_message(group_msg, member.username)
-                    
-                    # Send push notification to offline members (except sender) in background
-                    if member.username != username:
-                        asyncio.create_task(send_push_background(
-                            member.username,
-                            f"New message in {group.name} from {username}",
-                            content[:100],
-                            {"sender": username, "type": "group", "group_name": group.name}
-                        ))
+                # Send to the group's online members only
+                await manager.publish(f"group_{group_id}", group_msg)
+                metrics.ws_fanout_seconds.observe(perf_counter() - received_at, "group")
+                metrics.ws_messages_total.inc(1, "group")
                 
             else:
                 # Save public message to database
-                content = message_data.get("content", "")
-                db_message = Message(
+                content = frame.content
+                db_message = new_message(
                     content=content,
                     sender_id=user.id,
-                    room="general"
+                    room="general",
+                    client_msg_id=client_msg_id
+                )
+                if not await insert_message(db, websocket, user, db_message):
+                    continue
+                attachments = link_attachments(db, user, frame.attachment_ids, db_message)
+                # Push notifications to everyone else, committed with the message
+                push_outbox.to_all_except(
+                    db, user.id,
+                    f"New message in general from {username}",
+                    content[:100] or "Sent an attachment",
+                    {"sender": username, "type": "public"},
+                    message_id=db_message.id
                 )
-                db.add(db_message)
-                db.commit()
-                db.refresh(db_message)
+                message_id, sent_at = db_message.id, db_message.timestamp.isoformat()
+                with metrics.db_commit_seconds.time():
+                    db.commit()
+                push_outbox.wake()
+                await acknowledge(websocket, username, client_msg_id, message_id, sent_at)
                 
                 # Broadcast public message to all connected clients
-                await manager.broadcast(json.dumps({
+                await manager.publish(GENERAL_TOPIC, Frame({
                     "type": "message",
+                    "id": message_id,
                     "sender": username,
                     "content": content,
-                    "timestamp": db_message.timestamp.isoformat()
+                    "attachments": attachments,
+                    "timestamp": sent_at
                 }))
-                
-
-                # Send push notifications to offline users in background
-                all_users = db.query(User).filter(User.username != username).all()
-                for other_user in all_users:
-                    # Check if user is offline (not in active connections)
-                    # if other_user.username not in manager.active_connections:
-                    asyncio.create_task(send_push_background(
-                        other_user.username,
-                        f"New message in general from {username}",
-                        content[:100],
-                        {"sender": username, "type": "public"}
-                    ))
+                metrics.ws_fanout_seconds.observe(perf_counter() - received_at, "general")
+                metrics.ws_messages_total.inc(1, "general")
             
     except WebSocketDisconnect:
-        manager.disconnect(username)
-        await manager.broadcast_user_list()
+        pass
+    except Exception:
+        logger.exception("Websocket handler for %s failed", username)
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
     finally:
+        # Every exit path releases the socket and the session
+        profiler.finish(profiled)
         db.close()
+        if manager.active_connections.get(username) is websocket:
+            manager.disconnect(username, websocket)
+            await manager.broadcast_user_list()
@@ -1,6 +1,8 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal, Union, Annotated
+
+from config import settings
 
 # User Schemas
 class UserBase(BaseModel):
@@ -37,6 +39,27 @@ class MessageBase(BaseModel):
 class MessageCreate(MessageBase):
     room: Optional[str] = "general"
 
+# Attachment Schemas
+class AttachmentSummary(BaseModel):
+    """What travels with a message; the file itself is fetched from /api/attachments/{id}"""
+    id: int
+    filename: str
+    content_type: str
+    size: int
+    thumbnail: Optional[str] = None  # small JPEG data URL for images
+
+class UploadCreate(BaseModel):
+    filename: Annotated[str, Field(min_length=1, max_length=255)]
+    content_type: Annotated[str, Field(min_length=1, max_length=127)] = "application/octet-stream"
+    size: Annotated[int, Field(ge=1, le=settings.attachment_max_bytes)]
+
+class UploadResponse(BaseModel):
+    upload_id: str
+    offset: int  # bytes received so far; send the next chunk from here
+    size: int
+    chunk_bytes: int  # largest chunk one request may carry
+    attachment: Optional[AttachmentSummary] = None  # set once the last chunk is in
+
 class MessageResponse(MessageBase):
     id: int
     sender: str
@@ -45,9 +68,92 @@ class MessageResponse(MessageBase):
     isPrivate: Optional[bool] = False
     recipient: Optional[str] = None
     group_id: Optional[int] = None
+    attachments: List[AttachmentSummary] = []
     
     model_config = ConfigDict(from_attributes=True)
 
+class SyncResponse(BaseModel):
+    messages: List[MessageResponse]
+    cursor: int
+    has_more: bool = False
+
+class ReadCursorResponse(BaseModel):
+    room: str
+    last_read_message_id: int
+    unread: int  # capped at settings.unread_count_cap
+
+# Conversation Schemas
+class ConversationResponse(BaseModel):
+    peer: str
+    room: str
+    last_activity: datetime
+    last_message_id: Optional[int] = None
+    last_message: Optional[str] = None
+    last_sender: Optional[str] = None
+
+# WebSocket inbound frames
+FrameContent = Annotated[str, Field(max_length=settings.ws_max_content_chars)]
+# Ids from /api/attachments/uploads; the files themselves never travel over the websocket
+FrameAttachments = Annotated[List[int], Field(max_length=settings.attachment_max_per_message)]
+# Picked by the client so a resend after a dropped socket is recognised (client_messages.py)
+ClientMessageId = Annotated[str, Field(min_length=1, max_length=64)]
+
+class PrivateFrame(BaseModel):
+    type: Literal["private"]
+    recipient: Annotated[str, Field(min_length=1)]
+    content: FrameContent = ""
+    attachment_ids: FrameAttachments = []
+    client_msg_id: Optional[ClientMessageId] = None
+
+class GroupFrame(BaseModel):
+    type: Literal["group"]
+    group_id: int
+    content: FrameContent = ""
+    attachment_ids: FrameAttachments = []
+    client_msg_id: Optional[ClientMessageId] = None
+
+class PublicFrame(BaseModel):
+    type: Literal["public"]
+    content: FrameContent = ""
+    attachment_ids: FrameAttachments = []
+    client_msg_id: Optional[ClientMessageId] = None
+
+class TypingFrame(BaseModel):
+    type: Literal["typing"]
+    recipient: Optional[Annotated[str, Field(min_length=1)]] = None
+    group_id: Optional[int] = None
+    active: bool = True
+
+    @model_validator(mode="after")
+    def one_target(self):
+        if (self.recipient is None) == (self.group_id is None):
+            raise ValueError("typing needs exactly one of recipient or group_id")
+        return self
+
+class ReadFrame(BaseModel):
+    """Newest message read in a private chat (recipient), a group, or general (neither)"""
+    type: Literal["read"]
+    recipient: Optional[Annotated[str, Field(min_length=1)]] = None
+    group_id: Optional[int] = None
+    message_id: Annotated[int, Field(ge=1)]
+
+    @model_validator(mode="after")
+    def one_target(self):
+        if self.recipient is not None and self.group_id is not None:
+            raise ValueError("read takes at most one of recipient or group_id")
+        return self
+
+class PingFrame(BaseModel):
+    type: Literal["ping"]
+
+class PongFrame(BaseModel):
+    type: Literal["pong"]
+
+InboundFrame = Annotated[
+    Union[PrivateFrame, GroupFrame, PublicFrame, TypingFrame, ReadFrame, PingFrame, PongFrame],
+    Field(discriminator="type")
+]
+
 # Group Schemas
 class GroupBase(BaseModel):
     name: str
@@ -77,3 +183,40 @@ class GroupMemberResponse(BaseModel):
 
 class AddMembersRequest(BaseModel):
     members: List[str]
+
+class RetentionPolicyUpdate(BaseModel):
+    """Days to keep a group's messages before archiving; 0 keeps them, null restores the default"""
+    days: Optional[Annotated[int, Field(ge=0)]] = None
+
+class RetentionPolicyResponse(BaseModel):
+    room: str
+    days: int
+    is_default: bool
+
+# Profiling Schemas (admin)
+class ProfilerUpdate(BaseModel):
+    """Fields left out keep their current value"""
+    enabled: Optional[bool] = None
+    sample_rate: Optional[Annotated[float, Field(ge=0, le=1)]] = None
+    slow_ms: Optional[Annotated[float, Field(gt=0)]] = None
+
+class ProfilerStatus(BaseModel):
+    enabled: bool
+    sample_rate: float
+    slow_ms: float
+    interval_ms: float
+    samples: int
+    distinct_stacks: int
+    slow_captures: int
+    in_flight: int
+
+class StackSummary(BaseModel):
+    stack: str
+    samples: int
+
+class SlowCapture(BaseModel):
+    kind: str
+    name: str
+    duration_ms: float
+    at: datetime
+    stacks: List[StackSummary]
@@ -0,0 +1,85 @@
+"""
+Full-text search over messages using an SQLite FTS5 index.
+
+The `messages_fts` virtual table is an external-content index over
+`messages.content`, kept in sync by triggers created in the
+`add_message_search_index` migration.
+"""
+
+import re
+
+from room_access import READABLE_ROOM_FILTER, readable_room_params
+
+FTS_TABLE = "messages_fts"
+
+# DDL for the index and its sync triggers (mirrors the Alembic migration)
+FTS_SETUP_STATEMENTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content,
+        content='messages',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+]
+
+# Ranked search restricted to rooms the caller can read. Ranking runs over the
+# newest :window readable matches only, so a query for a very common word
+# costs O(window) instead of O(all matches).
+SEARCH_QUERY = f"""
+    WITH candidates AS (
+        SELECT messages_fts.rowid AS id, messages_fts.rank AS rank
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH :match AND {READABLE_ROOM_FILTER}
+        ORDER BY messages_fts.rowid DESC
+        LIMIT :window
+    )
+    SELECT m.id, m.content, m.sender_id, m.room, m.group_id, m.timestamp, u.username
+    FROM candidates c
+    JOIN messages m ON m.id = c.id
+    JOIN users u ON m.sender_id = u.id
+    ORDER BY c.rank, m.id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_query(query: str) -> str:
+    """Turn free text into an FTS5 MATCH expression of quoted, ANDed terms.
+
+    Quoting every term keeps user input from being parsed as FTS5 syntax
+    (column filters, NEAR, boolean operators). Returns "" if no terms remain.
+    """
+    terms = _TERM_RE.findall(query)
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def search_params(query: str, user_id: int, limit: int, offset: int, window: int = 2000) -> dict:
+    """Bind parameters for SEARCH_QUERY"""
+    return {
+        "match": build_match_query(query),
+        "limit": limit,
+        "offset": offset,
+        "window": window,
+        **readable_room_params(user_id),
+    }
@@ -0,0 +1,68 @@
+"""
+Ephemeral typing indicators.
+
+Typing events are relayed only to online members through `manager`; they
+are never stored and never trigger push notifications. Per (sender, room)
+the tracker forwards the first "typing" event, then at most one refresh
+every `settings.typing_refresh_seconds`, so a client sending on every
+keystroke costs a dict lookup per frame. Receivers hide the indicator
+after `expires_in` seconds unless refreshed, so nothing has to be sent
+when a client just goes quiet or disconnects.
+"""
+
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+import metrics
+from config import settings
+
+
+class TypingTracker:
+    MIN_PRUNE_AT = 1024
+
+    def __init__(self, refresh: float, ttl: float):
+        self.refresh = refresh
+        self.ttl = ttl
+        # (sender, room) -> when the last "typing" event was forwarded
+        self._forwarded: Dict[Tuple[str, str], float] = {}
+        self._prune_at = self.MIN_PRUNE_AT
+
+    def should_forward(self, sender: str, room: str, active: bool, now: Optional[float] = None) -> bool:
+        """Record a typing event and decide whether receivers need to hear about it"""
+        now = monotonic() if now is None else now
+        key = (sender, room)
+        last = self._forwarded.get(key)
+        if not active:
+            # Only announce a stop for an indicator receivers may still be showing
+            self._forwarded.pop(key, None)
+            forward = last is not None and now - last < self.ttl
+        elif last is not None and now - last < self.refresh:
+            forward = False
+        else:
+            if last is None and len(self._forwarded) >= self._prune_at:
+                self._prune(now)
+            self._forwarded[key] = now
+            forward = True
+        typing_events.inc(1, "forwarded" if forward else "coalesced")
+        return forward
+
+    def clear(self, sender: str, room: str):
+        """A real message ends the sender's indicator; receivers clear it on receipt"""
+        self._forwarded.pop((sender, room), None)
+
+    def _prune(self, now: float):
+        self._forwarded = {key: at for key, at in self._forwarded.items() if now - at < self.ttl}
+        self._prune_at = max(self.MIN_PRUNE_AT, 2 * len(self._forwarded))
+
+    def __len__(self):
+        return len(self._forwarded)
+
+
+typing_events = metrics.Counter(
+    "chat_ws_typing_events_total",
+    "Inbound typing events by whether they were relayed",
+    ("outcome",),
+)
+
+# Global typing tracker instance
+typing_tracker = TypingTracker(settings.typing_refresh_seconds, settings.typing_ttl_seconds)
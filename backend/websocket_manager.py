@@ -1,71 +1,267 @@
 from fastapi import WebSocket
-from typing import Dict
-import json
+from sqlalchemy.orm import Session
+from typing import Dict, Optional, Set
+from time import monotonic
+import asyncio
+import logging
+
+import metrics
+from loop_monitor import DROP_EPHEMERAL, loop_monitor, shed_work
+from room_access import group_rooms
+from wire import Frame, negotiate, send_frame
+
+logger = logging.getLogger(__name__)
+
+PING_FRAME = Frame({"type": "ping"})
+POLICY_VIOLATION = 1008
+SERVICE_RESTART = 1012
+TRY_AGAIN_LATER = 1013
+# Every connection is subscribed to the general room
+GENERAL_TOPIC = "general"
+
+def reconnect_frame(after: float) -> Frame:
+    """Tell a client this server is going away and when to reconnect"""
+    return Frame({"type": "reconnect", "after_ms": int(after * 1000)})
+
+def group_update_frame(group_data: dict, action: str = "added_to_group") -> Frame:
+    return Frame({
+        "type": "group_update",
+        "action": action,
+        "group": group_data
+    })
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        self.last_activity: Dict[str, float] = {}
+        # Topic (room name: "general", "group_<id>") -> online subscribers' sockets,
+        # so a publish touches only connections that are online
+        self.topics: Dict[str, Dict[str, WebSocket]] = {}
+        self.user_topics: Dict[str, Set[str]] = {}
+        self._closing: Set[asyncio.Task] = set()
+        self._presence_tasks: Set[asyncio.Task] = set()
+        # A users_update was shed; send a fresh one once shedding stops
+        self.presence_stale = False
+        # Set by drain.drain(); new sockets are turned away
+        self.draining = False
 
-    async def connect(self, websocket: WebSocket, username: str):
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, username: str, db: Optional[Session] = None):
+        """Accept and register a socket, subscribed to general and, with `db`, the user's group rooms"""
+        await websocket.accept(subprotocol=negotiate(websocket))
         self.active_connections[username] = websocket
+        self.last_activity[username] = monotonic()
+        # A newer connection replaces the old one in every topic. Groups are read only now,
+        # with no await since registering: a member added while accept was pending was
+        # either subscribed by routers/groups.py already or is in the query's result.
+        self._unsubscribe_all(username)
+        for topic in (GENERAL_TOPIC, *(group_rooms(db, username) if db is not None else ())):
+            self.subscribe(username, topic)
         await self.broadcast_user_list()
 
-    def disconnect(self, username: str):
-        if username in self.active_connections:
-            del self.active_connections[username]
+    async def turn_away(self, websocket: WebSocket, after: float, code: int = SERVICE_RESTART):
+        """Handshake a socket we won't serve, tell it to reconnect after `after` seconds and close it"""
+        await websocket.accept(subprotocol=negotiate(websocket))
+        try:
+            await send_frame(websocket, reconnect_frame(after))
+        except Exception:
+            pass
+        await self._close_quietly(websocket, code)
+
+    async def refuse(self, websocket: WebSocket, code: int = POLICY_VIOLATION):
+        """Handshake a socket we won't serve and close it with `code`, so the client sees why"""
+        await websocket.accept(subprotocol=negotiate(websocket))
+        await self._close_quietly(websocket, code)
+
+    def disconnect(self, username: str, websocket: Optional[WebSocket] = None):
+        """Forget a user's socket. With `websocket`, only if it is still the registered one,
+        so a stale handler can't drop the user's newer connection."""
+        current = self.active_connections.get(username)
+        if current is None or (websocket is not None and current is not websocket):
+            return
+        del self.active_connections[username]
+        self.last_activity.pop(username, None)
+        self._unsubscribe_all(username)
+
+    def subscribe(self, username: str, topic: str):
+        """Add an online user's socket to a topic; offline users are subscribed when they connect"""
+        websocket = self.active_connections.get(username)
+        if websocket is None:
+            return
+        self.topics.setdefault(topic, {})[username] = websocket
+        self.user_topics.setdefault(username, set()).add(topic)
+
+    def unsubscribe(self, username: str, topic: str):
+        self._remove_subscriber(topic, username)
+        topics = self.user_topics.get(username)
+        if topics is not None:
+            topics.discard(topic)
+
+    def _unsubscribe_all(self, username: str):
+        for topic in self.user_topics.pop(username, ()):
+            self._remove_subscriber(topic, username)
+
+    def _remove_subscriber(self, topic: str, username: str):
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.pop(username, None)
+            if not subscribers:
+                del self.topics[topic]
+
+    def touch(self, username: str, websocket: WebSocket):
+        """Record inbound activity for the idle reaper"""
+        if self.active_connections.get(username) is websocket:
+            self.last_activity[username] = monotonic()
 
-    async def send_personal_message(self, message: str, username: str):
+    async def send_personal_message(self, message: Frame, username: str):
         if username in self.active_connections:
             websocket = self.active_connections[username]
             try:
-                await websocket.send_text(message)
+                await send_frame(websocket, message)
                 return True
-            except:
+            except Exception:
                 # Connection might be closed, remove it
-                self.disconnect(username)
+                self.disconnect(username, websocket)
                 return False
         return False
 
-    async def broadcast(self, message: str, exclude_user: str = None):
-        disconnected_users = []
-        for username, connection in self.active_connections.items():
+    async def publish(self, topic: str, message: Frame, exclude_user: str = None) -> int:
+        """Send to every online subscriber of `topic`; returns how many sends succeeded"""
+        # Snapshot; sends yield to the loop and subscriptions may change meanwhile
+        subscribers = list(self.topics.get(topic, {}).items())
+        topic_recipients.observe(len(subscribers))
+        sent = 0
+        for username, connection in subscribers:
+            if username == exclude_user:
+                continue
+            try:
+                await send_frame(connection, message)
+                sent += 1
+            except Exception:
+                # Connection is closed; drops it from every topic
+                self.disconnect(username, connection)
+        return sent
+
+    async def broadcast(self, message: Frame, exclude_user: str = None):
+        disconnected = []
+        # Iterate a snapshot; sends yield to the loop and other sockets may connect meanwhile
+        for username, connection in list(self.active_connections.items()):
             if username != exclude_user:
                 try:
-                    await connection.send_text(message)
-                except:
+                    await send_frame(connection, message)
+                except Exception:
                     # Connection is closed, mark for removal
-                    disconnected_users.append(username)
+                    disconnected.append((username, connection))
         
         # Remove disconnected users
-        for username in disconnected_users:
-            self.disconnect(username)
+        for username, connection in disconnected:
+            self.disconnect(username, connection)
     
     async def broadcast_user_list(self):
+        if self.draining:
+            # Everyone is moving to other servers; n departures would cost n² frames
+            return
+        if loop_monitor.sheds(DROP_EPHEMERAL):
+            # Each connect or disconnect costs a frame per online user; catch up later
+            self.presence_stale = True
+            shed_work.inc(1, "presence")
+            return
+        self.presence_stale = False
         users = list(self.active_connections.keys())
-        message = json.dumps({
+        message = Frame({
             "type": "users_update",
             "users": users
         })
         await self.broadcast(message)
     
+    def resume_presence(self, old_stage: int, new_stage: int):
+        """Loop monitor watcher: resend the user list once presence frames are no longer shed"""
+        if self.presence_stale and new_stage < DROP_EPHEMERAL <= old_stage:
+            task = asyncio.create_task(self.broadcast_user_list())
+            self._presence_tasks.add(task)
+            task.add_done_callback(self._presence_tasks.discard)
+
     async def broadcast_group_update(self, username: str, group_data: dict, action: str = "added_to_group"):
         """Broadcast group updates to specific user"""
-        message = json.dumps({
-            "type": "group_update",
-            "action": action,
-            "group": group_data
-        })
-        await self.send_personal_message(message, username)
+        await self.send_personal_message(group_update_frame(group_data, action), username)
     
     async def broadcast_group_list_update(self, usernames: list):
         """Broadcast group list refresh to multiple users"""
-        message = json.dumps({
+        message = Frame({
             "type": "groups_refresh",
             "action": "refresh_groups"
         })
         for username in usernames:
             await self.send_personal_message(message, username)
 
+    async def reap_idle(self, idle_timeout: float, send_timeout: float) -> int:
+        """Close sockets with no inbound frames for `idle_timeout` seconds and ping the rest.
+
+        A ping that can't be written within `send_timeout` (the peer stopped reading)
+        also counts as dead.
+        """
+        now = monotonic()
+        idle, live = [], []
+        for username, connection in list(self.active_connections.items()):
+            if now - self.last_activity.get(username, now) > idle_timeout:
+                idle.append((username, connection))
+            else:
+                live.append((username, connection))
+
+        results = await asyncio.gather(
+            *(asyncio.wait_for(send_frame(connection, PING_FRAME), send_timeout) for _, connection in live),
+            return_exceptions=True
+        )
+        idle += [peer for peer, result in zip(live, results) if isinstance(result, BaseException)]
+
+        for username, connection in idle:
+            self.disconnect(username, connection)
+            # Close in the background: a peer that stopped reading holds close()
+            # until the server's close timeout, which must not stall the heartbeat
+            task = asyncio.create_task(self._close_quietly(connection, 1001))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        if idle:
+            idle_reaped.inc(len(idle))
+            await self.broadcast_user_list()
+        return len(idle)
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass  # Already gone (half-open or closed underneath us)
+
+    async def run_heartbeat(self, interval: float, idle_timeout: float):
+        """Background task: ping live sockets and reap idle ones every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap_idle(idle_timeout, send_timeout=interval)
+            except Exception:
+                logger.exception("Heartbeat pass failed")
+
+topic_recipients = metrics.Histogram(
+    "chat_ws_topic_recipients",
+    "Online subscribers one topic publish was sent to",
+    buckets=metrics.DEPTH_BUCKETS,
+)
+idle_reaped = metrics.Counter(
+    "chat_ws_idle_reaped_total",
+    "Websocket connections closed by the idle reaper",
+)
+
 # Global connection manager instance
 manager = ConnectionManager()
+loop_monitor.watch(manager.resume_presence)
+
+metrics.Gauge(
+    "chat_ws_active_connections",
+    "Open websocket connections",
+    callback=lambda: len(manager.active_connections)
+)
+metrics.Gauge(
+    "chat_ws_topics",
+    "Topics (general and group rooms) with at least one online subscriber",
+    callback=lambda: len(manager.topics)
+)
@@ -0,0 +1,81 @@
+"""
+Websocket wire formats.
+
+JSON text frames are the default. A client that offers the `msgpack`
+subprotocol at handshake gets MessagePack binary frames instead. Inbound
+frames are decoded by frame type (text is JSON, binary is MessagePack), so
+either kind of client may send either.
+
+Outbound payloads are wrapped in a `Frame`, which encodes lazily and
+caches per format, so fan-out serializes each message at most once per
+format however many recipients it has.
+"""
+
+import json
+from typing import Optional, Union
+
+import msgpack
+from fastapi import WebSocket, WebSocketDisconnect
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Subprotocol token -> wire format
+SUBPROTOCOLS = {"msgpack": MSGPACK}
+
+
+class Frame:
+    """An outbound payload, encoded at most once per wire format"""
+
+    __slots__ = ("payload", "_json", "_msgpack")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self._json: Optional[str] = None
+        self._msgpack: Optional[bytes] = None
+
+    def json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self.payload)
+        return self._json
+
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack.packb(self.payload)
+        return self._msgpack
+
+
+def negotiate(websocket: WebSocket) -> Optional[str]:
+    """Pick the subprotocol to accept and record the connection's format"""
+    for offered in websocket.scope.get("subprotocols", ()):
+        if offered in SUBPROTOCOLS:
+            websocket.state.wire_format = SUBPROTOCOLS[offered]
+            return offered
+    websocket.state.wire_format = JSON
+    return None
+
+
+async def send_frame(websocket: WebSocket, frame: Frame):
+    if getattr(websocket.state, "wire_format", JSON) == MSGPACK:
+        await websocket.send_bytes(frame.msgpack())
+    else:
+        await websocket.send_text(frame.json())
+
+
+async def receive_raw(websocket: WebSocket) -> Union[str, bytes]:
+    """Next text or binary frame, undecoded"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    return text if text is not None else message["bytes"]
+
+
+def decode_msgpack(data: bytes):
+    """Unpack a binary frame; raises ValueError on malformed input"""
+    try:
+        return msgpack.unpackb(data)
+    except ValueError:
+        raise
+    except msgpack.UnpackException as e:
+        raise ValueError(str(e)) from e
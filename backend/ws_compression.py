@@ -0,0 +1,74 @@
+"""
+permessage-deflate policy for websocket connections.
+
+uvicorn's websockets protocol negotiates permessage-deflate with zlib's
+defaults: a 32 KiB window and level 6, about 260 KiB of compressor state
+per socket, with every frame compressed. This protocol subclass negotiates
+deflate with a configurable window and level. Frames shorter than
+`settings.ws_compression_min_bytes` go out uncompressed; RFC 7692 allows
+that per message by leaving RSV1 clear. The threshold targets pings,
+pongs and error frames, where deflate's overhead outweighs any gain.
+Context takeover already makes ordinary chat frames compress well, so
+see benchmarks/ws_compression.py before raising it.
+
+Pass `ws=ChatWebSocketProtocol` to uvicorn.
+"""
+
+import dataclasses
+
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets import frames
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+
+from config import settings
+
+# zlib memLevel for the per-connection compressor; 5 keeps the compressor
+# near 16 KiB of state (the default 8 is 128 KiB) for a small ratio loss
+MEM_LEVEL = 5
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """PerMessageDeflate that leaves short single-frame messages uncompressed"""
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.fin and frame.opcode in frames.DATA_OPCODES and len(frame.data) < self.min_size:
+            # Skipping a whole message leaves the compression context untouched
+            return dataclasses.replace(frame, rsv1=False)
+        return super().encode(frame)
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size
+        )
+
+
+def deflate_factory() -> ThresholdPerMessageDeflateFactory:
+    return ThresholdPerMessageDeflateFactory(
+        server_max_window_bits=settings.ws_compression_window_bits,
+        compress_settings={"level": settings.ws_compression_level, "memLevel": MEM_LEVEL},
+        min_size=settings.ws_compression_min_bytes
+    )
+
+
+class ChatWebSocketProtocol(WebSocketProtocol):
+    """uvicorn websockets protocol using the configured compression policy"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.available_extensions = [deflate_factory()] if settings.ws_compression else []
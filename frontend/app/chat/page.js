@@ -27,6 +27,7 @@ import CreateGroupModal from "../components/CreateGroupModal";
 import AddMemberModal from "../components/AddMemberModal";
 import GroupList from "../components/GroupList";
 import GroupChat from "../components/GroupChat";
+import { AttachmentPicker, MessageAttachments } from "../components/Attachments";
 import AnimatedModel from "../m/page";
 export default function Chat() {
   const router = useRouter();
@@ -35,6 +36,7 @@ export default function Chat() {
   const [privateMessages, setPrivateMessages] = useState({});
   const [groupMessages, setGroupMessages] = useState({});
   const [newMessage, setNewMessage] = useState("");
+  const [pendingAttachments, setPendingAttachments] = useState([]);
   const [onlineUsers, setOnlineUsers] = useState([]);
   const [selectedUser, setSelectedUser] = useState(null);
   const [selectedGroup, setSelectedGroup] = useState(null);
@@ -46,15 +48,70 @@ export default function Chat() {
   const [showAddMemberModal, setShowAddMemberModal] = useState(false);
   const [selectedGroupForAddMember, setSelectedGroupForAddMember] = useState(null);
   const messagesEndRef = useRef(null);
+  const lastSeenIdRef = useRef(null);
+  // Bumped to open a new socket after the server closed ours
+  const [connectionEpoch, setConnectionEpoch] = useState(0);
+  const reconnectTimerRef = useRef(null);
+  // client_msg_id -> frame sent but not yet acknowledged; resent after reconnecting
+  const unackedRef = useRef(new Map());
   const [isConnected, setIsConnected] = useState(false);
   const [isMounted, setIsMounted] = useState(false);
   const [isPushEnabled, setIsPushEnabled] = useState(false);
+  // chat key ("user:<peer>" / "group:<id>") -> { sender: expiresAt ms }
+  const [typing, setTyping] = useState({});
+  const lastTypingSentRef = useRef(0);
+
+  const TYPING_SEND_INTERVAL_MS = 2000;
+  // Matches the server's UNREAD_COUNT_CAP default
+  const UNREAD_BADGE_CAP = 100;
+
+  // chat key ("general" / "user:<peer>" / "group:<id>") -> unread count
+  const [unread, setUnread] = useState({});
+  // peer -> newest of our private messages they have read
+  const [peerRead, setPeerRead] = useState({});
+  // group id -> { message id: members who have read that far }
+  const [groupReadCounts, setGroupReadCounts] = useState({});
+  const lastReadSentRef = useRef({});
 
   // Ensure component is mounted on client side
   useEffect(() => {
     setIsMounted(true);
   }, []);
 
+  // Drop typing indicators that stopped being refreshed
+  useEffect(() => {
+    const timer = setInterval(() => {
+      const now = Date.now();
+      setTyping((prev) => {
+        let changed = false;
+        const next = {};
+        for (const [key, senders] of Object.entries(prev)) {
+          const live = Object.fromEntries(
+            Object.entries(senders).filter(([, expiresAt]) => expiresAt > now)
+          );
+          if (Object.keys(live).length !== Object.keys(senders).length) changed = true;
+          if (Object.keys(live).length) next[key] = live;
+        }
+        return changed ? next : prev;
+      });
+    }, 1000);
+    return () => clearInterval(timer);
+  }, []);
+
+  const setSenderTyping = (key, sender, expiresAt) => {
+    setTyping((prev) => {
+      const senders = { ...(prev[key] || {}) };
+      if (expiresAt) {
+        senders[sender] = expiresAt;
+      } else if (sender in senders) {
+        delete senders[sender];
+      } else {
+        return prev;
+      }
+      return { ...prev, [key]: senders };
+    });
+  };
+
   // Scroll to bottom of messages
   const scrollToBottom = () => {
     if (messagesEndRef.current) {
@@ -136,6 +193,27 @@ export default function Chat() {
     loadGroups();
   }, [user]);
 
+  // Load read cursors and unread counts
+  useEffect(() => {
+    if (!user) return;
+
+    const loadReadCursors = async () => {
+      try {
+        const response = await api.get("/api/read-cursors");
+        const counts = {};
+        response.data.forEach((cursor) => {
+          counts[roomKey(cursor.room)] = cursor.unread;
+          lastReadSentRef.current[roomKey(cursor.room)] = cursor.last_read_message_id;
+        });
+        setUnread(counts);
+      } catch (error) {
+        console.error("Failed to load read cursors:", error);
+      }
+    };
+
+    loadReadCursors();
+  }, [user]);
+
   // Load private messages when selecting a user
   useEffect(() => {
     if (!selectedUser || !user) return;
@@ -206,15 +284,88 @@ export default function Chat() {
   useEffect(() => {
     if (!user) return;
 
-    const websocket = new WebSocket(`ws://localhost:8000/ws/${user.username}`);
+    // The handshake carries our access token; on reconnect, ask the server
+    // to replay only what we missed
+    const params = new URLSearchParams({ token: localStorage.getItem("token") || "" });
+    if (lastSeenIdRef.current !== null) {
+      params.set("last_seen_id", lastSeenIdRef.current);
+    }
+    const websocket = new WebSocket(`ws://localhost:8000/ws/${user.username}?${params}`);
+    let closedByUs = false;
+    // When the server told us to come back (a drain, or it is overloaded)
+    let reconnectAt = null;
+    // Replayed, live and synced messages can overlap after a reconnect; ids
+    // applied on this connection (message state already keeps every message)
+    const appliedIds = new Set();
+
+    // A message from /api/sync as the live frame the server would have sent
+    const syncedFrame = (message) => {
+      if (message.isPrivate) {
+        return { ...message, type: "private_message" };
+      }
+      if (message.room.startsWith("group_")) {
+        return { ...message, type: "group_message" };
+      }
+      return { ...message, type: "message" };
+    };
+
+    // Missed more than the server replays inline: page /api/sync from where
+    // the replay stopped until it comes back empty, so catching up costs what
+    // was missed rather than whole room histories
+    const syncFrom = async (cursor) => {
+      try {
+        while (!closedByUs) {
+          const { data: page } = await api.get("/api/sync", { params: { since: cursor } });
+          if (closedByUs || !page.messages.length) break;
+          page.messages.forEach((message) => handleFrame(syncedFrame(message)));
+          cursor = page.cursor;
+        }
+      } catch (error) {
+        console.error("Failed to sync missed messages:", error);
+      }
+    };
 
     websocket.onopen = () => {
       console.log("WebSocket connected");
       setIsConnected(true);
+      // The server acks a resend it already stored without storing it twice
+      for (const frame of unackedRef.current.values()) {
+        websocket.send(JSON.stringify(frame));
+      }
     };
 
-    websocket.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+    websocket.onmessage = (event) => handleFrame(JSON.parse(event.data));
+
+    function handleFrame(data) {
+      if (data.type === "ack") {
+        // Not a message we received, so it doesn't move lastSeenIdRef
+        unackedRef.current.delete(data.client_msg_id);
+        return;
+      }
+
+      if (data.id) {
+        if (appliedIds.has(data.id)) return;
+        appliedIds.add(data.id);
+      }
+      if (data.id && data.id > (lastSeenIdRef.current || 0)) {
+        lastSeenIdRef.current = data.id;
+      }
+
+      if (data.type === "ping") {
+        // Server heartbeat; answer so the idle reaper keeps us connected
+        websocket.send(JSON.stringify({ type: "pong" }));
+        return;
+      }
+
+      if (data.type === "reconnect") {
+        // The server is shutting down or overloaded and picked when we come
+        // back, so clients don't all reconnect at once; keep using this
+        // socket until then unless the server closes it first
+        reconnectAt = Date.now() + data.after_ms;
+        clearTimeout(reconnectTimerRef.current);
+        reconnectTimerRef.current = setTimeout(() => websocket.close(), data.after_ms);
+        return;
+      }
 
       if (data.type === "users_update") {
         setOnlineUsers(data.users.filter((u) => u !== user.username));
@@ -240,14 +391,41 @@ export default function Chat() {
             console.log(`${data.group.user_left} left the group: ${data.group.name}`);
           }
         }
+      } else if (data.type === "sync_required") {
+        syncFrom(data.cursor);
+      } else if (data.type === "typing") {
+        const key = data.group_id ? `group:${data.group_id}` : `user:${data.sender}`;
+        setSenderTyping(key, data.sender, data.active ? Date.now() + data.expires_in * 1000 : null);
+      } else if (data.type === "read") {
+        setPeerRead((prev) => ({
+          ...prev,
+          [data.reader]: Math.max(prev[data.reader] || 0, data.message_id),
+        }));
+      } else if (data.type === "read_counts") {
+        setGroupReadCounts((prev) => {
+          const counts = { ...(prev[data.group_id] || {}) };
+          data.counts.forEach(([messageId, readers]) => {
+            counts[messageId] = readers;
+          });
+          return { ...prev, [data.group_id]: counts };
+        });
+      } else if (data.type === "error") {
+        if (data.code === "rate_limited") {
+          toast.error("You're sending messages too fast");
+        } else {
+          console.warn("Server rejected frame:", data.code);
+        }
       } else if (data.type === "groups_refresh") {
         // Refresh groups list from server
         handleGroupUpdate();
       } else if (data.type === "message") {
+        countUnread("general", data.sender, !selectedUser && !selectedGroup);
         setMessages((prev) => [
           ...prev,
           {
+            id: data.id,
             content: data.content,
+            attachments: data.attachments,
             sender: data.sender,
             timestamp: data.timestamp || new Date().toISOString(),
           },
@@ -256,13 +434,17 @@ export default function Chat() {
         // Handle private messages
         const otherUser =
           data.sender === user.username ? data.recipient : data.sender;
+        setSenderTyping(`user:${data.sender}`, data.sender, null);
+        countUnread(`user:${otherUser}`, data.sender, selectedUser === otherUser);
 
         setPrivateMessages((prev) => ({
           ...prev,
           [otherUser]: [
             ...(prev[otherUser] || []),
             {
+              id: data.id,
               content: data.content,
+              attachments: data.attachments,
               sender: data.sender,
               timestamp: data.timestamp || new Date().toISOString(),
               isPrivate: true,
@@ -271,16 +453,14 @@ export default function Chat() {
           ],
         }));
       } else if (data.type === "group_message") {
+        setSenderTyping(`group:${data.group_id}`, data.sender, null);
+        countUnread(`group:${data.group_id}`, data.sender, selectedGroup?.id === data.group_id);
         // Handle group messages with deduplication
         setGroupMessages((prev) => {
           const existingMessages = prev[data.group_id] || [];
           
           // Check if message already exists (prevent duplicates)
-          const messageExists = existingMessages.some(
-            msg => msg.sender === data.sender && 
-                   msg.content === data.content && 
-                   Math.abs(new Date(msg.timestamp) - new Date(data.timestamp)) < 1000
-          );
+          const messageExists = existingMessages.some(msg => msg.id === data.id);
           
           if (messageExists) {
             return prev; // Don't add duplicate
@@ -291,7 +471,9 @@ export default function Chat() {
             [data.group_id]: [
               ...existingMessages,
               {
+                id: data.id,
                 content: data.content,
+                attachments: data.attachments,
                 sender: data.sender,
                 timestamp: data.timestamp || new Date().toISOString(),
                 group_id: data.group_id,
@@ -300,7 +482,7 @@ export default function Chat() {
           };
         });
       }
-    };
+    }
 
     websocket.onerror = (error) => {
       console.error("WebSocket error:", error);
@@ -308,20 +490,33 @@ export default function Chat() {
       toast.error("Connection error");
     };
 
-    websocket.onclose = () => {
+    websocket.onclose = (event) => {
       console.log("WebSocket disconnected");
       setIsConnected(false);
+      if (closedByUs) return;
+      if (event.code === 1008) {
+        // Token refused (most likely expired): any API call refreshes it, or
+        // sends us to the login page if it can't, before the reconnect below
+        api.get("/api/me").catch(() => {});
+      }
+      // After a hint, wait out whatever is left of it; otherwise add jitter of our own
+      const delay = reconnectAt !== null ? Math.max(0, reconnectAt - Date.now()) : 1000 + Math.random() * 4000;
+      clearTimeout(reconnectTimerRef.current);
+      reconnectTimerRef.current = setTimeout(() => setConnectionEpoch((n) => n + 1), delay);
     };
 
     setWs(websocket);
 
     return () => {
+      closedByUs = true;
+      clearTimeout(reconnectTimerRef.current);
       websocket.close();
     };
-  }, [user, selectedUser, selectedGroup]);
+  }, [user, selectedUser, selectedGroup, connectionEpoch]);
 
   const sendMessage = () => {
-    if (!newMessage || !ws) return;
+    if ((!newMessage && !pendingAttachments.length) || !ws) return;
+    const attachment_ids = pendingAttachments.map((a) => a.id);
 
     let messageData;
     if (selectedGroup) {
@@ -330,6 +525,7 @@ export default function Chat() {
         timestamp: new Date().toISOString(),
         type: "group",
         group_id: selectedGroup.id,
+        attachment_ids,
       };
     } else {
       messageData = {
@@ -337,11 +533,88 @@ export default function Chat() {
         timestamp: new Date().toISOString(),
         type: selectedUser ? "private" : "public",
         recipient: selectedUser,
+        attachment_ids,
       };
     }
 
-    ws.send(JSON.stringify(messageData));
+    messageData.client_msg_id = crypto.randomUUID();
+    unackedRef.current.set(messageData.client_msg_id, messageData);
+    if (ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify(messageData));
+    }
     setNewMessage("");
+    setPendingAttachments([]);
+    // The server ends our indicator when the message lands
+    lastTypingSentRef.current = 0;
+  };
+
+  const typingTarget = () => {
+    if (selectedGroup) return { group_id: selectedGroup.id };
+    if (selectedUser) return { recipient: selectedUser };
+    return null;
+  };
+
+  const handleInputChange = (value) => {
+    setNewMessage(value);
+    notifyTyping(value);
+  };
+
+  const notifyTyping = (value) => {
+    const target = typingTarget();
+    if (!ws || ws.readyState !== WebSocket.OPEN || !target) return;
+
+    const now = Date.now();
+    if (!value) {
+      if (lastTypingSentRef.current) {
+        ws.send(JSON.stringify({ type: "typing", active: false, ...target }));
+        lastTypingSentRef.current = 0;
+      }
+    } else if (now - lastTypingSentRef.current >= TYPING_SEND_INTERVAL_MS) {
+      // The server coalesces too; this just keeps keystrokes off the wire
+      ws.send(JSON.stringify({ type: "typing", active: true, ...target }));
+      lastTypingSentRef.current = now;
+    }
+  };
+
+  const currentChatKey = () =>
+    selectedGroup ? `group:${selectedGroup.id}` : selectedUser ? `user:${selectedUser}` : "general";
+
+  // Map a server room name to the chat key used for unread counts
+  const roomKey = (room) => {
+    if (room.startsWith("group_")) return `group:${room.slice("group_".length)}`;
+    if (room.startsWith("private_")) {
+      const prefix = `private_${user.username}_`;
+      return room.startsWith(prefix)
+        ? `user:${room.slice(prefix.length)}`
+        : `user:${room.slice("private_".length, -(user.username.length + 1))}`;
+    }
+    return room;
+  };
+
+  const countUnread = (key, sender, isOpen) => {
+    if (isOpen || sender === user.username) return;
+    setUnread((prev) => ({ ...prev, [key]: (prev[key] || 0) + 1 }));
+  };
+
+  // Members who have read a group message: everyone who read it or anything later
+  const groupReadBy = (groupId, messageId) => {
+    let readers = 0;
+    Object.entries(groupReadCounts[groupId] || {}).forEach(([id, n]) => {
+      if (Number(id) >= messageId) readers = Math.max(readers, n);
+    });
+    return readers;
+  };
+
+  const unreadBadge = (key) =>
+    unread[key] > 0 && (
+      <span className="ml-auto text-xs bg-blue-600 text-white rounded-full px-2 py-0.5">
+        {unread[key] >= UNREAD_BADGE_CAP ? `${UNREAD_BADGE_CAP - 1}+` : unread[key]}
+      </span>
+    );
+
+  const currentTypingUsers = () => {
+    const key = selectedGroup ? `group:${selectedGroup.id}` : selectedUser ? `user:${selectedUser}` : null;
+    return key ? Object.keys(typing[key] || {}) : [];
   };
 
   const handleLogout = () => {
@@ -398,6 +671,26 @@ export default function Chat() {
     return messages.filter((msg) => !msg.isPrivate);
   }; 
 
+  // Tell the server how far we have read in the open chat
+  const currentMessages = getCurrentMessages();
+  const latestMessageId = currentMessages.length
+    ? currentMessages[currentMessages.length - 1].id
+    : null;
+  useEffect(() => {
+    if (!ws || !isConnected || !latestMessageId) return;
+    const key = currentChatKey();
+    setUnread((prev) => (prev[key] ? { ...prev, [key]: 0 } : prev));
+    if (latestMessageId <= (lastReadSentRef.current[key] || 0)) return;
+
+    const target = selectedGroup
+      ? { group_id: selectedGroup.id }
+      : selectedUser
+      ? { recipient: selectedUser }
+      : {};
+    ws.send(JSON.stringify({ type: "read", message_id: latestMessageId, ...target }));
+    lastReadSentRef.current[key] = latestMessageId;
+  }, [ws, isConnected, latestMessageId, selectedUser, selectedGroup]);
+
   // Handle  selection
   const handleGroupSelect = (group) => {
     setSelectedGroup(group);
@@ -445,6 +738,7 @@ export default function Chat() {
   const handleSendGroupMessage = (messageData) => {
     // Don't add message locally - it will come back via WebSocket
     // This prevents duplication
+    lastTypingSentRef.current = 0;
   };
 
   // Show loading state during hydration
@@ -567,6 +861,7 @@ export default function Chat() {
                     <p className="font-semibold text-gray-800">General Chat</p>
                     <p className="text-xs text-gray-500">Chat with everyone</p>
                   </div>
+                  {unreadBadge("general")}
                 </button>
 
                 {/* User List */}
@@ -593,6 +888,7 @@ export default function Chat() {
                       <p className="font-semibold text-gray-800">{username}</p>
                       <p className="text-xs text-gray-500">Click to chat</p>
                     </div>
+                    {unreadBadge(`user:${username}`)}
                   </button>
                 ))}
 
@@ -613,6 +909,7 @@ export default function Chat() {
                   user={user}
                   onGroupUpdate={handleGroupUpdate}
                   onAddMembers={handleAddMembers}
+                  unread={unread}
                 />
               </>
             )}
@@ -645,6 +942,9 @@ export default function Chat() {
           isConnected={isConnected}
           messages={getCurrentMessages()}
           onSendMessage={handleSendGroupMessage}
+          onInputChange={notifyTyping}
+          typingUsers={currentTypingUsers()}
+          readBy={(messageId) => groupReadBy(selectedGroup.id, messageId)}
         />
       ) : (
         <div className="flex-1 flex flex-col">
@@ -728,7 +1028,8 @@ export default function Chat() {
                         : "bg-gray-200 text-gray-800"
                     }`}
                   >
-                    <p className="break-words">{message.content}</p>
+                    {message.content && <p className="break-words">{message.content}</p>}
+                    <MessageAttachments attachments={message.attachments} />
                   </div>
                   <div>
                     <p className={`text-[10px] text-gray-500  ${
@@ -737,22 +1038,37 @@ export default function Chat() {
                     : ""
                 }`}>
                       {format(new Date(message.timestamp), "HH:mm")}
+                      {selectedUser &&
+                        message.sender === user.username &&
+                        message.id <= (peerRead[selectedUser] || 0) &&
+                        " · Read"}
                     </p>
                   </div>
                 </div>
               </div>
             ))}
+            {currentTypingUsers().length > 0 && (
+              <p className="text-xs text-gray-500 italic">
+                {currentTypingUsers().join(", ")}{" "}
+                {currentTypingUsers().length === 1 ? "is" : "are"} typing…
+              </p>
+            )}
             <div ref={messagesEndRef} />
             </div>
           </div>
 
           {/* Message Input */}
           <div className="bg-white border-t border-gray-200 px-6 py-4">
-            <div className="flex gap-3">
+            <div className="flex gap-3 relative">
+              <AttachmentPicker
+                pending={pendingAttachments}
+                onChange={setPendingAttachments}
+                disabled={!isConnected}
+              />
               <input
                 type="text"
                 value={newMessage}
-                onChange={(e) => setNewMessage(e.target.value)}
+                onChange={(e) => handleInputChange(e.target.value)}
                 onKeyPress={(e) => e.key === "Enter" && sendMessage()}
                 placeholder={
                   selectedUser
@@ -763,7 +1079,7 @@ export default function Chat() {
               />
               <button
                 onClick={sendMessage}
-                disabled={!newMessage || !isConnected}
+                disabled={(!newMessage && !pendingAttachments.length) || !isConnected}
                 className="px-6 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition disabled:opacity-50 disabled:cursor-not-allowed flex items-center gap-2"
               >
                 <FiSend />
@@ -0,0 +1,90 @@
+"use client";
+
+import { useRef, useState } from "react";
+import { FiPaperclip, FiFile, FiX } from "react-icons/fi";
+import toast from "react-hot-toast";
+import { uploadAttachment, openAttachment } from "../../utils/attachments";
+
+const formatSize = (size) =>
+  size < 1024 * 1024 ? `${Math.ceil(size / 1024)} KB` : `${(size / 1024 / 1024).toFixed(1)} MB`;
+
+// Attachments of a sent message: thumbnails for images, a file chip otherwise
+export function MessageAttachments({ attachments }) {
+  if (!attachments?.length) return null;
+  return (
+    <div className="flex flex-wrap gap-2 mt-1">
+      {attachments.map((attachment) => (
+        <button
+          key={attachment.id}
+          onClick={() => openAttachment(attachment).catch(() => toast.error("Download failed"))}
+          className="text-left"
+          title={attachment.filename}
+        >
+          {attachment.thumbnail ? (
+            <img src={attachment.thumbnail} alt={attachment.filename} className="rounded-lg max-h-40" />
+          ) : (
+            <span className="flex items-center gap-2 px-3 py-2 rounded-lg bg-white/80 text-gray-800 text-sm border border-gray-200">
+              <FiFile />
+              {attachment.filename}
+              <span className="text-xs text-gray-500">{formatSize(attachment.size)}</span>
+            </span>
+          )}
+        </button>
+      ))}
+    </div>
+  );
+}
+
+// Paperclip button plus the list of uploaded, not yet sent attachments
+export function AttachmentPicker({ pending, onChange, disabled }) {
+  const inputRef = useRef(null);
+  const [progress, setProgress] = useState(null);
+
+  const handleFiles = async (files) => {
+    for (const file of files) {
+      try {
+        const attachment = await uploadAttachment(file, setProgress);
+        onChange((prev) => [...prev, attachment]);
+      } catch (error) {
+        toast.error(error.response?.data?.detail || `Failed to upload ${file.name}`);
+      }
+    }
+    setProgress(null);
+    inputRef.current.value = "";
+  };
+
+  return (
+    <>
+      <input
+        ref={inputRef}
+        type="file"
+        multiple
+        className="hidden"
+        onChange={(e) => handleFiles(Array.from(e.target.files))}
+      />
+      <button
+        onClick={() => inputRef.current.click()}
+        disabled={disabled || progress !== null}
+        className="px-3 py-2 text-gray-500 hover:text-gray-700 disabled:opacity-50"
+        title="Attach files"
+      >
+        {progress !== null ? `${Math.round(progress * 100)}%` : <FiPaperclip size={20} />}
+      </button>
+      {pending.length > 0 && (
+        <div className="absolute bottom-full left-0 mb-2 flex flex-wrap gap-2">
+          {pending.map((attachment) => (
+            <span
+              key={attachment.id}
+              className="flex items-center gap-1 px-2 py-1 rounded bg-gray-100 text-gray-700 text-xs"
+            >
+              {attachment.filename}
+              <button onClick={() => onChange((prev) => prev.filter((a) => a.id !== attachment.id))}>
+                <FiX size={12} />
+              </button>
+            </span>
+          ))}
+        </div>
+      )}
+    </>
+  );
+}
@@ -6,6 +6,7 @@ import { FiSend, FiUsers, FiMoreVertical, FiInfo } from "react-icons/fi";
 import toast from "react-hot-toast";
 import api from "../../utils/auth";
 import AnimatedModel from "../m/page.js";
+import { AttachmentPicker, MessageAttachments } from "./Attachments";
 export default function GroupChat({
   group,
   activeTab,
@@ -14,8 +15,12 @@ export default function GroupChat({
   isConnected,
   messages,
   onSendMessage,
+  onInputChange,
+  typingUsers = [],
+  readBy,
 }) {
   const [newMessage, setNewMessage] = useState("");
+  const [pendingAttachments, setPendingAttachments] = useState([]);
   const [groupMembers, setGroupMembers] = useState([]);
   const [showGroupInfo, setShowGroupInfo] = useState(false);
   const messagesEndRef = useRef(null);
@@ -54,18 +59,20 @@ export default function GroupChat({
   }, [group]);
 
   const handleSendMessage = () => {
-    if (!newMessage.trim() || !ws || !group) return;
+    if ((!newMessage.trim() && !pendingAttachments.length) || !ws || !group) return;
 
     const messageData = {
       content: newMessage.trim(),
       timestamp: new Date().toISOString(),
       type: "group",
       group_id: group.id,
+      attachment_ids: pendingAttachments.map((a) => a.id),
     };
 
     ws.send(JSON.stringify(messageData));
     onSendMessage(messageData);
     setNewMessage("");
+    setPendingAttachments([]);
   };
 
   const getGroupInitials = (name) => {
@@ -187,16 +194,28 @@ export default function GroupChat({
                               : "bg-gray-200 text-gray-800"
                           }`}
                         >
-                          <p className="break-words">{message.content}</p>
+                          {message.content && <p className="break-words">{message.content}</p>}
+                          <MessageAttachments attachments={message.attachments} />
                         </div>
                         <div>
                           <p className="text-[10px] text-gray-500 text-end mr-[2px] mt-1">
                             {format(new Date(message.timestamp), "HH:mm")}
+                            {/* Counts include our own cursor */}
+                            {readBy &&
+                              message.sender === user.username &&
+                              readBy(message.id) > 1 &&
+                              ` · Read by ${readBy(message.id) - 1}`}
                           </p>
                         </div>
                       </div>
                     </div>
                   ))}
+                  {typingUsers.length > 0 && (
+                    <p className="text-xs text-gray-500 italic">
+                      {typingUsers.join(", ")}{" "}
+                      {typingUsers.length === 1 ? "is" : "are"} typing…
+                    </p>
+                  )}
                   <div ref={messagesEndRef} />
                 </>
               )}
@@ -205,18 +224,26 @@ export default function GroupChat({
 
           {/* Message Input */}
           <div className="bg-white border-t border-gray-200 px-6 py-4">
-            <div className="flex gap-3">
+            <div className="flex gap-3 relative">
+              <AttachmentPicker
+                pending={pendingAttachments}
+                onChange={setPendingAttachments}
+                disabled={!isConnected}
+              />
               <input
                 type="text"
                 value={newMessage}
-                onChange={(e) => setNewMessage(e.target.value)}
+                onChange={(e) => {
+                  setNewMessage(e.target.value);
+                  onInputChange?.(e.target.value);
+                }}
                 onKeyPress={(e) => e.key === "Enter" && handleSendMessage()}
                 placeholder={`Message ${group.name}...`}
                 className="flex-1 px-4 py-2 border border-gray-300 rounded-lg focus:outline-none text-black"
               />
               <button
                 onClick={handleSendMessage}
-                disabled={!newMessage.trim() || !isConnected}
+                disabled={(!newMessage.trim() && !pendingAttachments.length) || !isConnected}
                 className="px-6 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition disabled:opacity-50 disabled:cursor-not-allowed flex items-center gap-2"
               >
                 <FiSend />
@@ -12,7 +12,8 @@ export default function GroupList({
   onCreateGroup, 
   user,
   onGroupUpdate,
-  onAddMembers 
+  onAddMembers,
+  unread = {}
 }) {
   const [showGroupMenu, setShowGroupMenu] = useState(null);
 
@@ -104,6 +105,11 @@ export default function GroupList({
                 <div className="flex-1 text-left">
                   <div className="flex items-center justify-between">
                     <p className="font-semibold text-gray-800 truncate">{group.name}</p>
+                    {unread[`group:${group.id}`] > 0 && (
+                      <span className="text-xs bg-blue-600 text-white rounded-full px-2 py-0.5">
+                        {unread[`group:${group.id}`]}
+                      </span>
+                    )}
                   </div>
                   <div className="flex items-center justify-between">
                     <p className="text-xs text-gray-500">
@@ -0,0 +1,43 @@
+import api from "./auth";
+
+// Upload a File in chunks; resolves to the attachment summary to send with a message
+export async function uploadAttachment(file, onProgress) {
+  const { data: upload } = await api.post("/api/attachments/uploads", {
+    filename: file.name,
+    content_type: file.type || "application/octet-stream",
+    size: file.size,
+  });
+
+  let offset = upload.offset;
+  let attachment = upload.attachment;
+  while (!attachment) {
+    const chunk = file.slice(offset, offset + upload.chunk_bytes);
+    try {
+      const { data } = await api.put(
+        `/api/attachments/uploads/${upload.upload_id}?offset=${offset}`,
+        chunk,
+        { headers: { "Content-Type": "application/octet-stream" } }
+      );
+      offset = data.offset;
+      attachment = data.attachment;
+    } catch (error) {
+      if (error.response?.status !== 409) throw error;
+      // A retried chunk already landed; continue from where the server is
+      const { data } = await api.get(`/api/attachments/uploads/${upload.upload_id}`);
+      offset = data.offset;
+    }
+    onProgress?.(offset / file.size);
+  }
+  return attachment;
+}
+
+// Fetch an attachment with the auth header and open or save it
+export async function openAttachment(attachment) {
+  const { data } = await api.get(`/api/attachments/${attachment.id}`, { responseType: "blob" });
+  const url = URL.createObjectURL(data);
+  const link = document.createElement("a");
+  link.href = url;
+  link.download = attachment.filename;
+  link.click();
+  setTimeout(() => URL.revokeObjectURL(url), 10000);
+}